@@ -0,0 +1,671 @@
+# Timing comparisons for parsing/processing code in get_rankings.py, using
+# sample pages in this repository, and memory used by a cache if given, e.g.
+#   python benchmarks.py [cache.pkl]
+
+import ast
+import contextlib
+import io
+import pickle
+import random
+import re
+import sys
+import threading
+import time
+import tracemalloc
+import types
+
+import get_rankings
+
+
+def legacy_get_html_content(html_text, html_tag):
+    """Original regex version of get_rankings.get_html_content(), rescanning text
+    for every call, kept here as the baseline for comparison"""
+
+    open_regex = re.compile(r'<' + html_tag + r'(.*?)>', flags=re.DOTALL)
+    close_regex = re.compile(r'</' + html_tag + r'>')
+
+    contents = []
+    offset = 0
+    nesting_depth = 0
+    inside_tag_block = False
+    block_content_start_idx = -1
+
+    while True:
+        open_match = open_regex.search(html_text, pos=offset)
+        close_match = close_regex.search(html_text, pos=offset)
+        if close_match is None:
+            break
+        if open_match is not None and (open_match.start() < close_match.start()):
+            if inside_tag_block:
+                nesting_depth += 1
+            else:
+                block_content_start_idx = open_match.end()
+                inside_tag_block = True
+                attribs_unparsed = open_match.group(1)
+                attrib_pairs = attribs_unparsed.split(' ')
+                content = get_rankings.HtmlBlock(html_tag)
+                content.attribs = {}
+                for attrib_pair in attrib_pairs:
+                    key, _, quoted_value = attrib_pair.partition('=')
+                    if not (key or quoted_value):
+                        continue
+                    unquoted_value = quoted_value.replace('"', '')
+                    content.attribs[key] = unquoted_value
+            offset = open_match.end()
+        else:
+            if nesting_depth > 0:
+                nesting_depth -= 1
+            else:
+                content.source_text = html_text
+                content.content_start = block_content_start_idx
+                content.content_end = close_match.start()
+                contents.append(content)
+                inside_tag_block = False
+            offset = close_match.end()
+
+    return contents
+
+
+def legacy_table_cells(html_text):
+    """All table cells as list per row per table, tables found at any depth by
+    repeated regex scans as the original code did"""
+
+    tables_cells = []
+    pending_texts = [html_text]
+    while pending_texts:
+        text = pending_texts.pop(0)
+        for table in legacy_get_html_content(text, 'table'):
+            pending_texts.append(table.inner_text)
+            rows = legacy_get_html_content(table.inner_text, 'tr')
+            tables_cells.append([[cell.inner_text for cell in legacy_get_html_content(row.inner_text, 'td')]
+                                 for row in rows])
+    return tables_cells
+
+
+def tree_table_cells(html_text):
+    """Same as legacy_table_cells() but from single pass tree"""
+
+    tables_cells = []
+    page = get_rankings.parse_html(html_text, get_rankings.html_table_tags)
+    for table in page.find_all('table'):
+        rows = get_rankings.get_table_rows(table)
+        tables_cells.append([[cell.inner_text for cell in get_rankings.get_row_cells(row)]
+                             for row in rows])
+    return tables_cells
+
+
+def legacy_wava_tables(html_text):
+    """Original four level nested scan for athlete profile results tables"""
+
+    all_tables = []
+    level_tables = legacy_get_html_content(html_text, 'table')
+    for _ in range(4):
+        all_tables.extend(level_tables)
+        next_level_tables = []
+        for table in level_tables:
+            next_level_tables.extend(legacy_get_html_content(table.inner_text, 'table'))
+        level_tables = next_level_tables
+    return [table.inner_text for table in all_tables if table.attribs.get('class') == 'alternatingrowspanel']
+
+
+def tree_wava_tables(html_text):
+    """Same as legacy_wava_tables() but with one query of tree at any depth"""
+
+    page = get_rankings.parse_html(html_text, ('table',))
+    return [table.inner_text for table in page.find_all('table', class_='alternatingrowspanel')]
+
+
+def make_runbritain_page(row_count):
+    """Large rankings page like runbritain gives with limit=n, rows based on the
+    example in notes.txt"""
+
+    rows = []
+    for i in range(row_count):
+        rows.append(f"['{i + 1}', '75:57', '', '76:02', '74:33', '<span class=\\\"rlpb\\\">PB</span>', "
+                    f"'<a href=\\\"/runners/profile.aspx?athleteid={69655 + i}\\\" target=\\\"_blank\\\">Runner O\\'Name {i}</a>', "
+                    "'V45', 'Cambridge & Coleridge', "
+                    "'<a href=\\\"/results/results.aspx?meetingid=189769&event=HM&date=15-Jan-17\\\" target=\\\"_blank\\\">York</a>', "
+                    "'15 Jan 17']")
+    return ('<script type="text/javascript">\r\nvar rankinglisttitle = [[\'HM Men Overall\']];\r\n\r\n'
+            'var runners = [\r\n' + ',\r\n'.join(rows) + '\r\n];\r\n</script>')
+
+
+def legacy_runbritain_rows(page_text, evaluate=eval):
+    array_match = re.search(r'runners =\s*(\[.*?\]);', page_text, flags=re.DOTALL)
+    array_str = array_match.group(1).replace('\n', ' ').replace('\r', '')
+    return [tuple(row) for row in evaluate(array_str)]
+
+
+def literal_eval_runbritain_rows(page_text):
+    return legacy_runbritain_rows(page_text, ast.literal_eval)
+
+
+def streamed_runbritain_rows(page_text):
+    array_match = get_rankings.runbritain_array_regex.search(page_text)
+    return list(get_rankings.iter_js_array_rows(page_text, array_match.end()))
+
+
+def json_runbritain_rows(page_text):
+    array_match = get_rankings.runbritain_array_regex.search(page_text)
+    return get_rankings.js_array_rows(page_text, array_match.end())
+
+
+def legacy_consider_performance_for_record(perf, record_list, max_records, smaller_score_better, compare_field):
+    """Original list version of get_rankings.RecordTable.consider_performance(),
+    rescanning and resorting the whole list for every performance"""
+
+    add_record = False
+    if len(record_list) < max_records:
+        add_record = True
+    else:
+        prev_worst_score = getattr(record_list[-1][0], compare_field)
+        if smaller_score_better:
+            if getattr(perf, compare_field) <= prev_worst_score: add_record = True
+        else:
+            if getattr(perf, compare_field) >= prev_worst_score: add_record = True
+
+    if add_record:
+        same_score_seen = False
+        tie_same_name_managed = False
+        for existing_perf_list in record_list:
+            if getattr(existing_perf_list[0], compare_field) == getattr(perf, compare_field):
+                same_score_seen = True
+                for perf_idx, existing_perf in enumerate(existing_perf_list):
+                    if existing_perf.athlete_name == perf.athlete_name:
+                        if getattr(perf, 'invalid', False):
+                            del existing_perf_list[perf_idx]
+                            tie_same_name_managed = True
+                            break
+                        existing_source_score = get_rankings.source_pref_score(existing_perf.source)
+                        this_source_score = get_rankings.source_pref_score(perf.source)
+                        if existing_source_score >= this_source_score:
+                            tie_same_name_managed = True
+                            break
+                        else:
+                            existing_perf_list[perf_idx] = perf
+                            tie_same_name_managed = True
+                            break
+                if not tie_same_name_managed:
+                    existing_perf_list.append(perf)
+                break
+        if not same_score_seen:
+            record_list.append([perf])
+            record_list.sort(key=lambda x: getattr(x[0], compare_field), reverse=not smaller_score_better)
+
+        lowest_rec_idx_for_this_name = len(record_list)
+        rec_idx = 0
+        while rec_idx < len(record_list):
+            perf_idx = 0
+            while perf_idx < len(record_list[rec_idx]):
+                existing_record_name = record_list[rec_idx][perf_idx].athlete_name
+                if existing_record_name == perf.athlete_name:
+                    if rec_idx > lowest_rec_idx_for_this_name:
+                        del record_list[rec_idx][perf_idx]
+                        continue
+                    elif rec_idx < lowest_rec_idx_for_this_name:
+                        lowest_rec_idx_for_this_name = rec_idx
+                perf_idx += 1
+            if not record_list[rec_idx]:
+                del record_list[rec_idx]
+            else:
+                rec_idx += 1
+        del record_list[max_records :]
+
+
+def make_random_performances(count, athlete_count, seed=1):
+    """Performances with plenty of ties, repeat athletes, different sources and
+    a few invalid anti-records, to exercise all the record table rules"""
+
+    rng = random.Random(seed)
+    sources = ['Po10 2020', 'Runbritain 2020', 'Historical worksheet: x.xlsx:Sheet1']
+    perfs = []
+    for _ in range(count):
+        score = 600.0 + rng.randint(0, 2000) / 10
+        perf = get_rankings.Performance('5000', score, 'ALL', 'M', '', 1, f'Athlete {rng.randrange(athlete_count)}',
+                                        date='1 Jan 20', source=rng.choice(sources), invalid=(rng.random() < 0.02))
+        perfs.append(perf)
+    # Record tables tell athletes apart by key, as they would for crawled lists
+    get_rankings.resolve_athlete_keys(perfs)
+    return perfs
+
+
+def legacy_record_tables(perfs, max_records=10):
+    record_list = []
+    for perf in perfs:
+        legacy_consider_performance_for_record(perf, record_list, max_records, True, 'score')
+    return [[id(perf) for perf in perf_list] for perf_list in record_list]
+
+
+def indexed_record_tables(perfs, max_records=10):
+    record_table = get_rankings.RecordTable(max_records, True, 'score')
+    for perf in perfs:
+        record_table.consider_performance(perf)
+    return [[id(perf) for perf in perf_list] for perf_list in record_table]
+
+
+class LegacyPerformance():
+    """Original get_rankings.Performance with per-instance dict and full strings"""
+
+    def __init__(self, event, score, category, gender, original_special, decimal_places, athlete_name, athlete_url='', date='',
+                       fixture_name='', fixture_url='', source='', wava=0.0, age=0, invalid=False, ea_pb_score=0.0):
+        self.event = event
+        self.score = score
+        self.category = category
+        self.gender = gender
+        self.original_special = original_special
+        self.decimal_places = decimal_places
+        self.athlete_name = athlete_name
+        self.athlete_url = athlete_url
+        self.date = date
+        self.fixture_name = fixture_name
+        self.fixture_url = fixture_url
+        self.source = source
+        self.wava = wava
+        self.age = age
+        self.invalid = invalid
+        self.ea_pb_score = ea_pb_score
+
+
+def make_parsed_performances(performance_class, count, athlete_count=3000, fixture_count=2000):
+    """Performances as parsers build them, with fresh string objects for each one
+    even where the text repeats, like a cache of club rankings over many years"""
+
+    rng = random.Random(1)
+    perfs = []
+    for _ in range(count):
+        athlete = rng.randrange(athlete_count)
+        fixture = rng.randrange(fixture_count)
+        year = 2004 + fixture % 21
+        event = rng.choice(['5K', '10K', 'HM', 'Mar', '100', '800', 'LJ'])
+        perfs.append(performance_class(''.join([event]), 1000.0 + rng.random(), ''.join(['ALL']), ''.join(['M']), '', 0,
+                                       f'Athlete Name{athlete}',
+                                       f'{get_rankings.runbritain_root_url}/runners/profile.aspx?athleteid={200000 + athlete}',
+                                       f'{fixture % 28 + 1} Jun {year % 100:02d}', f'Venue {fixture}',
+                                       f'{get_rankings.runbritain_root_url}/results/results.aspx?meetingid={300000 + fixture}&event={event}&date={fixture % 28 + 1}-Jun-{year % 100:02d}',
+                                       f'Runbritain {year}'))
+    return perfs
+
+
+legacy_regex_po10_date = re.compile(r'([0-9][0-9]?) ([A-Z][a-z][a-z]) ([0-9][0-9])')
+legacy_regex_4digits = re.compile(r'([0-9]{4})')
+
+def legacy_get_perf_year(perf_date_str):
+    """Year parsed from date string each time asked, as before"""
+    match_obj = legacy_regex_po10_date.match(perf_date_str)
+    if match_obj:
+        return 2000 + int(match_obj.group(3))
+    match_obj = legacy_regex_4digits.search(perf_date_str)
+    if match_obj:
+        return int(match_obj.group(1))
+    return 1900
+
+
+def legacy_count_year_entries(perfs, interest_year):
+    # Both years checked, as for new records this year and last year
+    return sum(1 for year in [interest_year, interest_year - 1]
+                 for perf in perfs if legacy_get_perf_year(perf.date) == year)
+
+
+def parsed_count_year_entries(perfs, interest_year):
+    return sum(1 for year in [interest_year, interest_year - 1]
+                 for perf in perfs if perf.year == year)
+
+
+def legacy_calculate_ea_pb_score(ea_pb_obj, score, smaller_score_better):
+    """Original get_rankings.calculate_ea_pb_score(), walking the levels each time"""
+
+    worst_defined = ea_pb_obj.level_scores[0]
+    best_defined = ea_pb_obj.level_scores[get_rankings.num_ea_pb_levels - 1]
+
+    if smaller_score_better:
+        if score > worst_defined:
+            reciprocal_score = 1.0 / score
+            reciprocal_worst = 1.0 / worst_defined
+            ea_score = reciprocal_score / reciprocal_worst
+        elif score <= best_defined:
+            limit_score = best_defined * (1 - get_rankings.ea_pb_limit_perf_fraction)
+            fraction_to_limit = (best_defined - score) / (best_defined - limit_score)
+            ea_score = get_rankings.num_ea_pb_levels + fraction_to_limit
+        else:
+            for lo_idx in range(0, get_rankings.num_ea_pb_levels - 1):
+                hi_idx = lo_idx + 1
+                if (score <= ea_pb_obj.level_scores[lo_idx] and
+                       score > ea_pb_obj.level_scores[hi_idx]):
+                    delta = ea_pb_obj.level_scores[lo_idx] - ea_pb_obj.level_scores[hi_idx]
+                    diff = ea_pb_obj.level_scores[lo_idx] - score
+                    ea_score = (lo_idx + 1) + diff / delta
+    else:
+        if score < worst_defined:
+            ea_score = score / worst_defined
+        elif score >= best_defined:
+            limit_score = best_defined * (1 + get_rankings.ea_pb_limit_perf_fraction)
+            fraction_to_limit = (score - best_defined) / (limit_score - best_defined)
+            ea_score = get_rankings.num_ea_pb_levels + fraction_to_limit
+        else:
+            for lo_idx in range(0, get_rankings.num_ea_pb_levels - 1):
+                hi_idx = lo_idx + 1
+                if (score >= ea_pb_obj.level_scores[lo_idx] and
+                       score < ea_pb_obj.level_scores[hi_idx]):
+                    delta = ea_pb_obj.level_scores[hi_idx] - ea_pb_obj.level_scores[lo_idx]
+                    diff = score - ea_pb_obj.level_scores[lo_idx]
+                    ea_score = (lo_idx + 1) + diff / delta
+
+    return ea_score
+
+
+def legacy_ea_pb_scores(perfs):
+    """Scored as process_performance() used to, once for ALL and once for the year"""
+
+    ea_scores = []
+    for perf in perfs:
+        for _ in range(2):
+            ea_pb_obj = get_rankings.ea_pb_award_score[perf.event][perf.gender + " " + perf.category]
+            smaller_score_better = get_rankings.known_events_lookup[perf.event][0]
+            ea_score = legacy_calculate_ea_pb_score(ea_pb_obj, perf.score, smaller_score_better)
+        ea_scores.append(ea_score)
+    return ea_scores
+
+
+def batch_ea_pb_scores(perf_lists):
+    for perf_list in perf_lists:
+        get_rankings.score_ea_pb_performances(perf_list)
+    return [perf.ea_pb_score for perf_list in perf_lists for perf in perf_list]
+
+
+def cached_ea_pb_scores(perf_lists):
+    """Scored as main() does for a cache loaded whole, before processing each list"""
+
+    performance_cache = {f'list{idx}' : perf_list for idx, perf_list in enumerate(perf_lists)}
+    crawl_queries = [types.SimpleNamespace(cache_key=cache_key) for cache_key in performance_cache]
+    get_rankings.ea_pb_scored_lists.clear()
+    with contextlib.redirect_stdout(io.StringIO()):
+        get_rankings.score_cached_ea_pb_performances(crawl_queries, performance_cache)
+    for perf_list in perf_lists:
+        get_rankings.score_ea_pb_performance_list(perf_list)
+    return [perf.ea_pb_score for perf_list in perf_lists for perf in perf_list]
+
+
+def make_ea_pb_performances(count, seed=1):
+    """Performances in every event and category with an EA PB score table, from
+    well below level 1 to beyond level 9, including exact level boundaries"""
+
+    rng = random.Random(seed)
+    score_sets = [score_set for event_sets in get_rankings.ea_pb_award_score.values()
+                            for score_set in event_sets.values()
+                  if score_set.event in get_rankings.known_events_lookup and score_set.category[0] in 'MW'
+                     and all(score_set.level_scores)]
+    perfs = []
+    for _ in range(count):
+        score_set = rng.choice(score_sets)
+        if rng.random() < 0.1:
+            score = rng.choice(score_set.level_scores)
+        else:
+            low, high = sorted([score_set.level_scores[0], score_set.level_scores[-1]])
+            score = rng.uniform(low * 0.7, high * 1.3)
+        gender, category = score_set.category.split(' ', 1)
+        perfs.append(get_rankings.Performance(score_set.event, score, category, gender, '', 2, 'Athlete',
+                                              date='1 Jan 20'))
+    return perfs
+
+
+def time_best_of(function, arg, repeats):
+    best = None
+    for _ in range(repeats):
+        start = time.perf_counter()
+        result = function(arg)
+        elapsed = time.perf_counter() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best, result
+
+
+def bench_html_parsing(repeats=3):
+    print('HTML table parsing: legacy regex get_html_content() v. single pass tree')
+    for filename in ['records.htm', 'eg_athlete_by_age_grade.htm']:
+        with open(filename, encoding='utf-8', errors='replace') as fd:
+            html_text = fd.read()
+        legacy_time, legacy_cells = time_best_of(legacy_table_cells, html_text, repeats)
+        tree_time, tree_cells = time_best_of(tree_table_cells, html_text, repeats)
+        # Tree finds tables in document order, legacy breadth first, so sort both.
+        # Legacy loses the rest of a row after an unclosed <td>, e.g. the Fixture and
+        # Source headings in records.htm, where the tree closes it as browsers do; so
+        # only expect each legacy row to be the start of the tree's row
+        first_cells = lambda table: repr([row[:1] for row in table])
+        lost_count = 0
+        agree = 'same results'
+        for legacy_table, tree_table in zip(sorted(legacy_cells, key=first_cells), sorted(tree_cells, key=first_cells)):
+            if legacy_table == tree_table:
+                continue
+            if len(legacy_table) == len(tree_table) and all(tree_row[:len(legacy_row)] == legacy_row
+                                                            for legacy_row, tree_row in zip(legacy_table, tree_table)):
+                lost_count += 1
+                agree = f'legacy loses cells after unclosed <td> in {lost_count} tables'
+            else:
+                agree = 'RESULTS DIFFER'
+                break
+        if len(legacy_cells) != len(tree_cells):
+            agree = 'RESULTS DIFFER'
+        cell_count = sum(len(row) for table in tree_cells for row in table)
+        print(f'  {filename}: {len(html_text)} chars, {len(tree_cells)} tables, {cell_count} cells: '
+              f'legacy {legacy_time * 1000:.1f} ms, tree {tree_time * 1000:.1f} ms, '
+              f'speedup x{legacy_time / tree_time:.1f}, {agree}')
+
+
+def bench_wava_tables(repeats=20):
+    print('Athlete profile results tables: legacy four level scan v. tree query')
+    with open('eg_athlete_by_age_grade.htm', encoding='utf-8', errors='replace') as fd:
+        html_text = fd.read()
+    legacy_time, legacy_tables = time_best_of(legacy_wava_tables, html_text, repeats)
+    tree_time, tree_tables = time_best_of(tree_wava_tables, html_text, repeats)
+    # Legacy misses tables nested deeper than four levels, e.g. best performances
+    # summary (not used, as lacks the expected headings)
+    if set(legacy_tables) <= set(tree_tables):
+        agree = f'tree finds {len(tree_tables) - len(legacy_tables)} more'
+    else:
+        agree = 'RESULTS DIFFER'
+    print(f'  {len(legacy_tables)} v. {len(tree_tables)} tables: legacy {legacy_time * 1000:.2f} ms, tree {tree_time * 1000:.2f} ms, '
+          f'speedup x{legacy_time / tree_time:.1f}, {agree}')
+
+
+def bench_runbritain_array(repeats=3):
+    print('Runbritain runners array: eval() and ast.literal_eval() v. streaming parser and JSON')
+    for row_count in [100, 2000, 20000]:
+        page_text = make_runbritain_page(row_count)
+        eval_time, eval_rows = time_best_of(legacy_runbritain_rows, page_text, repeats)
+        literal_time, literal_rows = time_best_of(literal_eval_runbritain_rows, page_text, repeats)
+        stream_time, stream_rows = time_best_of(streamed_runbritain_rows, page_text, repeats)
+        json_time, json_rows = time_best_of(json_runbritain_rows, page_text, repeats)
+        agree = 'same results' if eval_rows == literal_rows == stream_rows == json_rows else 'RESULTS DIFFER'
+        print(f'  {row_count} rows, {len(page_text)} chars: eval {eval_time * 1000:.1f} ms, '
+              f'literal_eval {literal_time * 1000:.1f} ms, streaming {stream_time * 1000:.1f} ms, '
+              f'JSON {json_time * 1000:.1f} ms (x{eval_time / json_time:.1f} v. eval), {agree}')
+
+
+def bench_record_tables(repeats=3):
+    print('Record tables: legacy list rescans v. indexed RecordTable')
+    for (count, athlete_count, max_records) in [(20000, 2000, 10), (20000, 2000, 100), (20000, 50, 20)]:
+        perfs = make_random_performances(count, athlete_count)
+        legacy_time, legacy_tables = time_best_of(lambda perfs: legacy_record_tables(perfs, max_records), perfs, repeats)
+        indexed_time, indexed_tables = time_best_of(lambda perfs: indexed_record_tables(perfs, max_records), perfs, repeats)
+        agree = 'same results' if legacy_tables == indexed_tables else 'RESULTS DIFFER'
+        print(f'  {count} performances, {athlete_count} athletes, top {max_records}: legacy {legacy_time * 1000:.1f} ms, '
+              f'indexed {indexed_time * 1000:.1f} ms, speedup x{legacy_time / indexed_time:.1f}, {agree}')
+
+
+def bench_batch_engine(repeats=3):
+    print('Record engines: incremental RecordTable v. batch pandas pass')
+    performance_count = 100000
+    perfs = [perf for perf in make_random_performances(performance_count, 2000) if not perf.invalid]
+    categories = ['ALL', 'U20', 'V40', 'V50']
+    for perf_idx, perf in enumerate(perfs):
+        perf.category = categories[perf_idx % len(categories)]
+
+    def run_engine(engine):
+        get_rankings.record.clear()
+        get_rankings.batch_rows.clear()
+        get_rankings.batch_tables.clear()
+        get_rankings.batch_table_idx.clear()
+        get_rankings.record_engine = engine
+        for perf in perfs:
+            get_rankings.process_performance_cat_and_all(perf, ['T'], 'record', 'ALL', False)
+        if engine == 'batch':
+            get_rankings.build_batch_record_tables(get_rankings.batch_tables)
+        return [[[id(perf) for perf in perf_list] for perf_list in table] for table in get_rankings.batch_tables]
+
+    incremental_time, _ = time_best_of(run_engine, 'incremental', repeats)
+    batch_time, batch_tables = time_best_of(run_engine, 'batch', repeats)
+    # Same tables considering each performance in turn, to compare with
+    record_tables = [get_rankings.RecordTable(table.max_records, table.smaller_score_better, table.compare_field)
+                     for table in get_rankings.batch_tables]
+    for table_idx, _, _, perf in get_rankings.batch_rows:
+        record_tables[table_idx].consider_performance(perf)
+    incremental_tables = [[[id(perf) for perf in perf_list] for perf_list in table] for table in record_tables]
+    differ_count = sum(1 for (a, b) in zip(incremental_tables, batch_tables) if a != b)
+    print(f'  {len(perfs)} performances, {len(batch_tables)} tables: incremental {incremental_time * 1000:.1f} ms, '
+          f'batch {batch_time * 1000:.1f} ms, {differ_count} tables differ (order dependent ties in incremental)')
+
+
+def bench_prefetch_pruning(first_year=2010, last_year=2021, prune_years=3, fetch_threads=8):
+    print('Pruned crawl: serial processing v. threaded prefetch first, with a fake fetch')
+    fetched_keys = []
+    fetched_lock = threading.Lock()
+
+    def fake_fetch_query(query, types, cached_perf_list=None):
+        with fetched_lock:
+            fetched_keys.append(query.cache_key)
+        # Some requests never find anyone, some start finding people part way through
+        rng = random.Random(query.yield_key)
+        if int(query.request_params['year']) < rng.choice([first_year, first_year + 5, last_year + 1, last_year + 1]):
+            return []
+        category = query.context['category']
+        age_group = rng.choice(['U20', 'V40', 'V50', 'V60']) if category == 'ALL' else category
+        return [get_rankings.Performance('5K', 1000.0, category, query.context['gender'], '', 0, 'Athlete Name',
+                                         age_group=age_group)]
+
+    def run_crawl(prefetch):
+        fetched_keys.clear()
+        get_rankings.query_yields.clear()
+        get_rankings.cache_keys_refreshed.clear()
+        performance_cache = {}
+        types = ['T', 'F', 'R', 'M']
+        queries = get_rankings.make_crawl_queries(238, first_year, last_year, True, True, False, types, False, False)
+        with contextlib.redirect_stdout(io.StringIO()):
+            if prefetch:
+                prefetch(queries, performance_cache, types)
+            for query in queries:
+                if get_rankings.query_pruned(query, performance_cache):
+                    get_rankings.note_query_pruned(query)
+                    continue
+                get_rankings.get_query_performances(query, performance_cache, types)
+        return len(fetched_keys), sorted(performance_cache), dict(get_rankings.query_yields)
+
+    def prefetch_unpruned(queries, performance_cache, types):
+        # What prefetching used to do: prune only on what was known before starting
+        get_rankings.prefetch_queries([query for query in queries if not get_rankings.query_pruned(query, performance_cache)],
+                                      performance_cache, types, fetch_threads, 4)
+
+    def prefetch_waves(queries, performance_cache, types):
+        get_rankings.prefetch_crawl_queries(queries, performance_cache, types, fetch_threads, 4)
+
+    real_fetch_query = get_rankings.fetch_query
+    get_rankings.fetch_query = fake_fetch_query
+    get_rankings.prune_empty_years = prune_years
+    try:
+        serial_count, serial_keys, serial_yields = run_crawl(None)
+        for name, prefetch in [('up-front prefetch', prefetch_unpruned), ('prefetch a year at a time', prefetch_waves)]:
+            count, keys, yields = run_crawl(prefetch)
+            agree = 'same lists' if (keys, yields) == (serial_keys, serial_yields) else 'LISTS DIFFER'
+            print(f'  {first_year}-{last_year}, prune after {prune_years} empty years: serial {serial_count} requests, '
+                  f'{name} with {fetch_threads} threads {count} requests, {agree}')
+    finally:
+        get_rankings.fetch_query = real_fetch_query
+        get_rankings.prune_empty_years = 0
+
+
+def bench_year_detection(count=200000, repeats=3):
+    print('New record year checks: date regex per check v. year parsed once')
+    perfs = make_parsed_performances(get_rankings.Performance, count)
+    legacy_time, legacy_count = time_best_of(lambda perfs: legacy_count_year_entries(perfs, 2024), perfs, repeats)
+    parsed_time, parsed_count = time_best_of(lambda perfs: parsed_count_year_entries(perfs, 2024), perfs, repeats)
+    agree = 'same results' if legacy_count == parsed_count else 'RESULTS DIFFER'
+    print(f'  {count} performances: regex {legacy_time * 1000:.1f} ms, parsed {parsed_time * 1000:.1f} ms, '
+          f'speedup x{legacy_time / parsed_time:.1f}, {agree}')
+
+
+def bench_ea_pb_scoring(count=200000, list_size=30, repeats=3):
+    print('EA PB award scores: level walk twice per performance v. precomputed tables in batches')
+    get_rankings.read_ea_pb_award_score_tables('EA_PB_Awards_tables.xlsx')
+    perfs = make_ea_pb_performances(count)
+    legacy_time, legacy_scores = time_best_of(legacy_ea_pb_scores, perfs, repeats)
+    perf_lists = [perfs[idx : idx + list_size] for idx in range(0, count, list_size)]
+    list_time, list_scores = time_best_of(batch_ea_pb_scores, perf_lists, repeats)
+    whole_time, whole_scores = time_best_of(cached_ea_pb_scores, perf_lists, repeats)
+    agree = 'same results' if legacy_scores == list_scores == whole_scores else 'RESULTS DIFFER'
+    print(f'  {count} performances: legacy {legacy_time * 1000:.1f} ms, '
+          f'batches of {list_size} {list_time * 1000:.1f} ms (x{legacy_time / list_time:.1f}), '
+          f'whole cache {whole_time * 1000:.1f} ms (x{legacy_time / whole_time:.1f}), {agree}')
+
+
+def bench_performance_memory(count=200000):
+    print('Performance objects: legacy dict and full strings v. slots, interning and IDs')
+    sizes = {}
+    for performance_class in [LegacyPerformance, get_rankings.Performance]:
+        tracemalloc.start()
+        perfs = make_parsed_performances(performance_class, count)
+        sizes[performance_class] = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        del perfs
+    legacy_size = sizes[LegacyPerformance]
+    compact_size = sizes[get_rankings.Performance]
+    print(f'  {count} performances: legacy {legacy_size / 1e6:.1f} MB, compact {compact_size / 1e6:.1f} MB, '
+          f'saving {(legacy_size - compact_size) / 1e6:.1f} MB ({100 * (1 - compact_size / legacy_size):.0f}%)')
+
+
+def bench_cache_memory(cache_file):
+    print(f'Loaded cache {cache_file}: legacy dict and full strings v. slots, interning and IDs')
+    with open(cache_file, 'rb') as fd:
+        header = pickle.load(fd)
+        if not isinstance(header, dict) or header.get('cache_schema_version') != get_rankings.cache_schema_version:
+            print('  Needs cache written by this version of get_rankings.py')
+            return
+        cache_bytes = fd.read()
+    tracemalloc.start()
+    performance_cache = pickle.Unpickler(io.BytesIO(cache_bytes)).load()
+    compact_size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+
+    # Same performances as legacy parsers left them, each with its own copy of the text
+    def fresh_str(value):
+        return (value + ' ')[:-1]
+    legacy_bytes = pickle.dumps({cache_key : [LegacyPerformance(fresh_str(perf.event), perf.score, fresh_str(perf.category),
+                                                                fresh_str(perf.gender), fresh_str(perf.original_special),
+                                                                perf.decimal_places, fresh_str(perf.athlete_name),
+                                                                perf.athlete_url, fresh_str(perf.date),
+                                                                fresh_str(perf.fixture_name), perf.fixture_url,
+                                                                fresh_str(perf.source), perf.wava, perf.age, perf.invalid)
+                                              for perf in perf_list]
+                                 for cache_key, perf_list in performance_cache.items()},
+                                protocol=pickle.HIGHEST_PROTOCOL)
+    tracemalloc.start()
+    legacy_cache = pickle.loads(legacy_bytes)
+    legacy_size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del legacy_cache
+    perf_count = sum(len(perf_list) for perf_list in performance_cache.values())
+    print(f'  {len(performance_cache)} entries, {perf_count} performances: legacy {legacy_size / 1e6:.1f} MB, '
+          f'compact {compact_size / 1e6:.1f} MB, saving {(legacy_size - compact_size) / 1e6:.1f} MB '
+          f'({100 * (1 - compact_size / legacy_size):.0f}%)')
+
+
+if __name__ == '__main__':
+    bench_html_parsing()
+    bench_wava_tables()
+    bench_runbritain_array()
+    bench_record_tables()
+    bench_batch_engine()
+    bench_prefetch_pruning()
+    bench_year_detection()
+    bench_ea_pb_scoring()
+    bench_performance_memory()
+    if len(sys.argv) > 1:
+        bench_cache_memory(sys.argv[1])
@@ -1,4 +1,4 @@
 REM This one updates the output report without re-requesting web data for this year,
 REM so it doesn't find new performances since the last 'update' run.
 REM Files provided in descending date order so duplicates in older sheets don't overwrite entries.
-python get_rankings.py --clubid 238 --cache cnc_cache.pkl --ea-pb-award-file EA_PB_Awards_tables.xlsx 2022_CnC_records.xlsx 2021_CnC_records.xlsx 2009_CnC_records.xlsx CnC_known_historical.xlsx
\ No newline at end of file
+python get_rankings.py --clubid 238 --cache cnc_cache.pkl --ttl-days none --ea-pb-award-file EA_PB_Awards_tables.xlsx 2022_CnC_records.xlsx 2021_CnC_records.xlsx 2009_CnC_records.xlsx CnC_known_historical.xlsx
\ No newline at end of file
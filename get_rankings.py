@@ -3,15 +3,27 @@
 
 # See/use requirements.txt for additional module dependencies
 import argparse
+import bisect
+import concurrent.futures
 import copy
 import datetime
+import gc
+import gzip
+import hashlib
+import json
 import openpyxl
+import operator
 import os
 import pandas
+import numpy
 import pickle
 import re
 import requests
+import sqlite3
 import sys
+import threading
+import time
+import urllib.parse
 
 if sys.version_info.major < 3:
     print('This script needs Python 3')
@@ -20,66 +32,606 @@ if sys.version_info.minor < 6:
     print('WARNING: this script assumes ordered dicts (Python 3.6+) when it builds cache keys, bad things may happen here')
 
 
+def intern_str(value):
+    """Share one copy of strings repeated across many performances"""
+    return sys.intern(value) if isinstance(value, str) else value
+
+
 class Performance():
+    """One performance by one athlete. Kept compact as the cache can hold hundreds of
+    thousands: no per-instance dict, repeated strings interned, and athlete and fixture
+    links stored as athlete ID and fixture site/query, with URLs rebuilt when needed."""
+    __slots__ = ['event', 'score', 'category', 'gender', 'original_special', 'decimal_places',
+                 'athlete_name', 'athlete_id', 'athlete_link', 'date', 'fixture_name', 'fixture_site',
+                 'fixture_ref', 'source', 'wava', 'age', 'age_group', 'invalid', 'ea_pb_score', 'date_ordinal', 'year', 'reason',
+                 'athlete_key', 'alt_sources']
+    transient_slots = {'athlete_key' : 0, 'alt_sources' : ()} # with defaults; only meaningful for this run, so not cached
+    interned_slots = ['event', 'category', 'gender', 'original_special', 'athlete_name', 'athlete_link',
+                      'date', 'fixture_name', 'fixture_ref', 'source', 'age_group']
 
     def __init__(self, event, score, category, gender, original_special, decimal_places, athlete_name, athlete_url='', date='',
-                       fixture_name='', fixture_url='', source='', wava=0.0, age=0, invalid=False, ea_pb_score=0.0):
-        self.event = event
+                       fixture_name='', fixture_url='', source='', wava=0.0, age=0, invalid=False, ea_pb_score=0.0,
+                       age_group=''):
+        self.event = intern_str(event)
         self.score = score # could be time in sec, distance in m or multievent points
-        self.category = category # e.g. U20 or ALL
-        self.gender = gender # W or M
-        self.original_special = original_special # for wind-assisted detail etc from club records
+        self.category = intern_str(category) # e.g. U20 or ALL
+        self.gender = intern_str(gender) # W or M
+        self.original_special = intern_str(original_special) # for wind-assisted detail etc from club records
         self.decimal_places = decimal_places # so we can use original precision which may imply electronic timing etc
-        self.athlete_name = athlete_name
+        self.athlete_name = intern_str(athlete_name)
         self.athlete_url = athlete_url
-        self.date = date
-        self.fixture_name = fixture_name
+        self.date = intern_str(date)
+        self.date_ordinal, self.year = parse_perf_date(self.date) # parsed once, as used a lot
+        self.fixture_name = intern_str(fixture_name)
         self.fixture_url = fixture_url
-        self.source = source
-        # Added later to support marathon WAVA list, cached performances may not have:
+        self.source = intern_str(source)
+        # Added later to support marathon WAVA list:
         self.wava = wava
         self.age = age
+        self.age_group = intern_str(age_group) # e.g. V45 or U17 from runbritain/Po10 ALL list row
         # Added so that Po10/Runbritain records could be removed (e.g. if athlete known to no longer be in club):
         self.invalid = invalid
-        # Added for England Athletics PB Award scheme, cached performances will not have
-        # but currently computed when used anyway:
+        # Added for England Athletics PB Award scheme, computed when used:
         self.ea_pb_score = ea_pb_score
+        for slot, default in self.transient_slots.items():
+            setattr(self, slot, default)
+
+    @property
+    def athlete_url(self):
+        if self.athlete_id:
+            return athlete_profile_url_prefixes[0] + str(self.athlete_id)
+        return self.athlete_link
+
+    @athlete_url.setter
+    def athlete_url(self, url):
+        # Po10 and runbritain profiles only differ by site, and Po10 preferred for output,
+        # so just keep athlete ID for those; anything else (e.g. from spreadsheet) kept as is
+        self.athlete_id = 0
+        self.athlete_link = ''
+        for prefix in athlete_profile_url_prefixes:
+            if url.startswith(prefix) and url[len(prefix):].isdigit():
+                self.athlete_id = int(url[len(prefix):])
+                return
+        if 'athleteid=' in url.lower():
+            # Hand-entered profile link, e.g. from spreadsheet with www. or http:
+            self.athlete_id = parse_athlete_profile_id(url)
+            if self.athlete_id:
+                return
+        self.athlete_link = intern_str(url)
+
+    @property
+    def fixture_url(self):
+        if self.fixture_site < 0:
+            return self.fixture_ref
+        return fixture_url_prefixes[self.fixture_site] + self.fixture_ref
+
+    @fixture_url.setter
+    def fixture_url(self, url):
+        # Many performances from same fixture, so query string part shared
+        for site_idx, prefix in enumerate(fixture_url_prefixes):
+            if url.startswith(prefix):
+                self.fixture_site = site_idx
+                self.fixture_ref = intern_str(url[len(prefix):])
+                return
+        self.fixture_site = -1
+        self.fixture_ref = intern_str(url)
+
+    def __copy__(self):
+        # Unlike pickling, keeps transient slots, e.g. for age group copies of a list
+        perf = Performance.__new__(Performance)
+        for slot in self.__slots__:
+            if hasattr(self, slot):
+                setattr(perf, slot, getattr(self, slot))
+        return perf
+
+    def __getstate__(self):
+        return {slot : getattr(self, slot) for slot in self.__slots__
+                if hasattr(self, slot) and slot not in self.transient_slots}
+
+    def __setstate__(self, state):
+        if isinstance(state, tuple):
+            # Default (dict, slots dict) form
+            state = {**(state[0] or {}), **state[1]}
+        if 'athlete_id' not in state:
+            # Old cache from before slots (schema version 1), with full URLs and maybe
+            # without fields added later, so construct afresh
+            self.__init__(**{name : value for name, value in state.items() if name in performance_init_args})
+            return
+        for slot, value in state.items():
+            if slot in self.transient_slots:
+                continue
+            setattr(self, slot, intern_str(value) if slot in self.interned_slots else value)
+        for slot, default in self.transient_slots.items():
+            setattr(self, slot, default)
+        # Any fields added since this was pickled are filled in by migrate_performance()
+
+
+performance_init_args = Performance.__init__.__code__.co_varnames[1 : Performance.__init__.__code__.co_argcount]
+
 
 class Trophy():
     """A Cambridge and Coleridge annual award"""
-    def __init__(self, tag, title, artefact, approach, notes=''):
+    def __init__(self, tag, title, artefact, approach, notes='', eligibility=None):
         self.tag = tag
         self.title = title
         self.artefact = artefact
         self.approach = approach # if 'Auto' then can be generated here
         self.notes = notes
+        self.eligibility = eligibility # TrophyEligibility if 'Auto'
         self.record_table = None
 
 
+class TrophyEligibility():
+    """Which performances an automatic trophy is decided from, and how they compare"""
+    def __init__(self, events, genders, categories, collection, min_age=0):
+        self.events = events # Po10 event codes
+        self.genders = genders
+        self.categories = categories # category performance is considered in, e.g. 'ALL' for overall
+        self.collection = collection # 'record' compares score, or 'wava' or 'ea_pb' their scores
+        self.min_age = min_age # e.g. 35 for masters
+
+
+class RecordTable():
+    """Best performances for one record table, best first, as a list of performance
+    lists allowing for ties (or the same performance from different sources). Only
+    the best entry for each athlete is kept, and no more than max_records entries.
+    Entries are found by bisecting on score, and athletes through an index of the
+    entry they appear in, so the table is never rescanned or resorted. Athletes are
+    told apart by athlete key (see resolve_athlete_keys()) rather than name."""
+
+    def __init__(self, max_records, smaller_score_better, compare_field):
+        self.max_records = max_records
+        self.smaller_score_better = smaller_score_better
+        self.compare_field = compare_field # e.g. 'score' or 'wava'
+        self.get_value = operator.attrgetter(compare_field)
+        self.perf_lists = []
+        self.sort_keys = [] # parallel to perf_lists, ascending so best first
+        self.athlete_sort_keys = {} # athlete key to sort key of the entry they appear in
+
+    def __len__(self):
+        return len(self.perf_lists)
+
+    def __iter__(self):
+        return iter(self.perf_lists)
+
+    def __getitem__(self, idx):
+        return self.perf_lists[idx]
+
+    def sort_key(self, perf):
+        value = self.get_value(perf)
+        return value if self.smaller_score_better else -value
+
+    def delete_entry(self, idx):
+        del self.perf_lists[idx]
+        del self.sort_keys[idx]
+
+    def append_entry(self, perf_list):
+        """Add entry that belongs after all those already in table, e.g. when whole
+        table computed in one go by batch engine"""
+
+        sort_key = self.sort_key(perf_list[0])
+        self.perf_lists.append(perf_list)
+        self.sort_keys.append(sort_key)
+        for perf in perf_list:
+            self.athlete_sort_keys[perf.athlete_key] = sort_key
+
+    def consider_performance(self, perf):
+        """Add this performance if it belongs in the table, replacing any worse entry
+        by the same athlete, and dropping the worst entry if the table gets too long"""
+
+        sort_key = self.sort_key(perf)
+        if len(self.perf_lists) >= self.max_records and sort_key > self.sort_keys[-1]:
+            # Not good enough; for a tie we do add, as club records sometimes showed two
+            # record-holders, and a chance to line up data from different sources in
+            # the output to show agreement where they match
+            return
+
+        athlete_key = perf.athlete_key
+        idx = bisect.bisect_left(self.sort_keys, sort_key)
+        same_score_seen = idx < len(self.sort_keys) and self.sort_keys[idx] == sort_key
+        if same_score_seen:
+            # Same record with different source, or a tie with new person
+            # Prefer Po10 over Runbritain, and don't include both as share source data
+            existing_perf_list = self.perf_lists[idx]
+            for perf_idx, existing_perf in enumerate(existing_perf_list):
+                if existing_perf.athlete_key == athlete_key:
+                    if perf.invalid:
+                        # Manual anti-record to delete entry we don't want
+                        del existing_perf_list[perf_idx]
+                        del self.athlete_sort_keys[athlete_key]
+                        if not existing_perf_list:
+                            self.delete_entry(idx)
+                    elif source_pref_score(existing_perf.source) < source_pref_score(perf.source):
+                        # E.g. replace existing Runbritain one with Po10, or prefer newer file
+                        # assuming provided in ascending date order; otherwise e.g. don't
+                        # add Runbritain score if already there from Po10
+                        existing_perf_list[perf_idx] = perf
+                    return
+
+        # Ensure athlete only appears with their top score
+        prev_sort_key = self.athlete_sort_keys.get(athlete_key)
+        if prev_sort_key is not None:
+            if prev_sort_key < sort_key:
+                # Already have a better performance by this athlete
+                return
+            # Otherwise this betters their previous entry, which must come later in table
+            prev_idx = bisect.bisect_left(self.sort_keys, prev_sort_key)
+            prev_perf_list = self.perf_lists[prev_idx]
+            prev_perf_list[:] = [existing_perf for existing_perf in prev_perf_list if existing_perf.athlete_key != athlete_key]
+            if not prev_perf_list:
+                # Usual case: no tie, that score was for only one athlete
+                self.delete_entry(prev_idx)
+
+        if same_score_seen:
+            # Could be manual record to put alongside Po10 say
+            self.perf_lists[idx].append(perf)
+        else:
+            self.perf_lists.insert(idx, [perf])
+            self.sort_keys.insert(idx, sort_key)
+        self.athlete_sort_keys[athlete_key] = sort_key
+
+        # Keep list at max required length
+        while len(self.perf_lists) > self.max_records:
+            for dropped_perf in self.perf_lists[-1]:
+                del self.athlete_sort_keys[dropped_perf.athlete_key]
+            self.delete_entry(-1)
+
+
 class HtmlBlock():
-    def __init__(self, tag=''):
+    """Element in tree parsed from HTML page; inner_text is the raw HTML between
+    its opening and closing tags, sliced from the page only when needed"""
+    __slots__ = ['tag', 'attribs_unparsed', 'parsed_attribs', 'children', 'source_text', 'content_start', 'content_end']
+
+    def __init__(self, tag='', attribs=None, source_text='', content_start=0, content_end=0, attribs_unparsed=''):
         self.tag = tag
-        self.inner_text = ''
-        self.attribs = {}
+        self.attribs_unparsed = attribs_unparsed
+        self.parsed_attribs = attribs # None until needed, most attributes never looked at
+        self.children = () # list once opened to hold children, most elements are leaves and never need one
+        self.source_text = source_text
+        self.content_start = content_start
+        self.content_end = content_end
+
+    @property
+    def attribs(self):
+        if self.parsed_attribs is None:
+            self.parsed_attribs = {}
+            for attrib_match in html_attrib_regex.finditer(self.attribs_unparsed):
+                quoted_value = attrib_match.group(2) or ''
+                self.parsed_attribs[attrib_match.group(1)] = quoted_value.strip('"\'')
+        return self.parsed_attribs
+
+    @attribs.setter
+    def attribs(self, value):
+        self.parsed_attribs = value
+
+    @property
+    def inner_text(self):
+        return self.source_text[self.content_start : self.content_end]
+
+    def find_all(self, tag, class_=None, recursive=True, stop_at=None):
+        """Elements with this tag (and class if given) inside this one in document
+        order, at any depth or only immediate children if not recursive; not
+        looking inside elements with tag stop_at if given"""
+        found = []
+        for block in self.children:
+            if block.tag == tag and (class_ is None or class_ in block.attribs.get('class', '').split()):
+                found.append(block)
+            if recursive and block.children and block.tag != stop_at:
+                found.extend(block.find_all(tag, class_, recursive, stop_at))
+        return found
+
+
+class WebQuery():
+    """A single page request to Po10 or runbritain, with the details needed to
+    parse and then process what comes back"""
+    def __init__(self, kind, url, request_params, report_string_base, context, rebuild_cache=False, data_year=None):
+        self.kind = kind # e.g. 'po10_rankings', selects parser in query_parsers
+        self.url = url
+        self.request_params = request_params
+        self.cache_key = make_cache_key(url, request_params)
+        self.report_string_base = report_string_base
+        self.context = context # dict of e.g. year, gender, category passed to parser
+        self.rebuild_cache = rebuild_cache # if True ignore any cached result
+        # Year results are for, deciding how long cached result stays fresh; None for ever
+        self.data_year = data_year
+        if data_year is None and 'year' in request_params:
+            self.data_year = int(request_params['year'])
+        self.validators = None # ETag, Last-Modified and hash of page once fetched
+        # Same request for any year, to look up how many results it has given before
+        self.yield_key = None
+        if 'year' in request_params:
+            self.yield_key = make_cache_key(url, {key : value for key, value in request_params.items() if key != 'year'})
+
+
+class RawPageStore():
+    """Compressed copies of the raw web pages we have fetched, so performances can be
+    parsed again (e.g. after fixing a parser) without fetching everything again.
+    Page files are named by hash of content so identical pages are stored once;
+    index maps cache key to page hash and details needed to parse it again."""
+    def __init__(self, directory):
+        self.directory = directory
+        self.index_file = os.path.join(directory, 'index.pkl')
+        self.lock = threading.Lock()
+        try:
+            with open(self.index_file, 'rb') as fd:
+                self.index = pickle.load(fd)
+            print(f'Raw page store index retrieved from {self.index_file} with {len(self.index)} pages')
+        except IOError:
+            print(f"Raw page store index {self.index_file} can't be opened, starting new store")
+            self.index = {}
+
+    def page_path(self, page_hash):
+        return os.path.join(self.directory, 'pages', page_hash[:2], page_hash + '.htm.gz')
+
+    def save_page(self, query, page_text):
+        page_bytes = page_text.encode('utf-8')
+        page_hash = hashlib.sha256(page_bytes).hexdigest()
+        path = self.page_path(page_hash)
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            temp_path = path + f'.{threading.get_ident()}.tmp'
+            with gzip.open(temp_path, 'wb') as fd:
+                fd.write(page_bytes)
+            os.replace(temp_path, path)
+        with self.lock:
+            self.index[query.cache_key] = {'hash'    : page_hash,
+                                           'kind'    : query.kind,
+                                           'context' : query.context,
+                                           'fetched' : time.time()}
+
+    def load_page(self, cache_key):
+        entry = self.index.get(cache_key)
+        if entry is None:
+            return None
+        with gzip.open(self.page_path(entry['hash']), 'rb') as fd:
+            return fd.read().decode('utf-8')
+
+    def save_index(self):
+        os.makedirs(self.directory, exist_ok=True)
+        temp_file = self.index_file + '.tmp'
+        with self.lock:
+            with open(temp_file, 'wb') as fd:
+                pickle.dump(self.index, fd)
+            os.replace(temp_file, self.index_file)
+        print(f'Raw page store index written to {self.index_file}')
+
+class SqlitePerformanceCache():
+    """Cache of performances from web pages kept in SQLite database, one row per
+    cache key, as alternative to one big pickle file. Entries are only loaded when
+    asked for, and only those updated this run are written back."""
+    def __init__(self, db_file):
+        self.db_file = db_file
+        self.connection = sqlite3.connect(db_file)
+        self.connection.execute('CREATE TABLE IF NOT EXISTS performances '
+                                '(cache_key TEXT PRIMARY KEY, perf_list BLOB NOT NULL)')
+        self.connection.execute('CREATE TABLE IF NOT EXISTS query_yields '
+                                '(yield_key TEXT, year INTEGER, perf_count INTEGER, PRIMARY KEY (yield_key, year))')
+        self.connection.execute('CREATE TABLE IF NOT EXISTS fetch_latency '
+                                '(host TEXT PRIMARY KEY, page_count INTEGER, total_sec REAL)')
+        self.connection.execute('CREATE TABLE IF NOT EXISTS fetch_times '
+                                '(cache_key TEXT PRIMARY KEY, fetch_time REAL)')
+        self.connection.execute('CREATE TABLE IF NOT EXISTS page_validators '
+                                '(cache_key TEXT PRIMARY KEY, etag TEXT, last_modified TEXT, page_hash TEXT)')
+        # Athlete IDs by name only kept with cache if written since they were
+        self.athlete_ids_kept = self.connection.execute(
+            "SELECT name FROM sqlite_master WHERE type = 'table' AND name = 'athlete_ids'").fetchone() is not None
+        self.connection.execute('CREATE TABLE IF NOT EXISTS athlete_ids '
+                                '(athlete_name TEXT PRIMARY KEY, athlete_id INTEGER)')
+        self.loaded = {} # cache key to performance list, or None if not in database
+        self.updated_keys = {}
+        print(f'Cache database {db_file} opened')
+        self.migrate()
+
+    def migrate(self):
+        """Bring all rows up to current cache schema in one transaction if database
+        was written by older version; schema version kept as SQLite user_version"""
+        db_version = self.connection.execute('PRAGMA user_version').fetchone()[0]
+        if db_version >= cache_schema_version:
+            return
+        with self.connection:
+            rows = self.connection.execute('SELECT cache_key, perf_list FROM performances').fetchall()
+            if rows and db_version == 0:
+                db_version = 1 # written before schema version was recorded
+            migrated_rows = []
+            for cache_key, blob in rows:
+                perf_list = pickle.loads(blob)
+                migrate_perf_list(perf_list, db_version)
+                migrated_rows.append((pickle.dumps(perf_list, protocol=pickle.HIGHEST_PROTOCOL), cache_key))
+            self.connection.executemany('UPDATE performances SET perf_list = ? WHERE cache_key = ?', migrated_rows)
+            self.connection.execute(f'PRAGMA user_version = {cache_schema_version}')
+        if rows:
+            print(f'Migrated {len(rows)} cache entries in {self.db_file} from schema version {db_version} to {cache_schema_version}')
+
+    def get(self, cache_key, default=None):
+        if cache_key not in self.loaded:
+            row = self.connection.execute('SELECT perf_list FROM performances WHERE cache_key = ?',
+                                          (cache_key,)).fetchone()
+            self.loaded[cache_key] = None if row is None else pickle.loads(row[0])
+        perf_list = self.loaded[cache_key]
+        return default if perf_list is None else perf_list
+
+    def __getitem__(self, cache_key):
+        perf_list = self.get(cache_key)
+        if perf_list is None:
+            raise KeyError(cache_key)
+        return perf_list
+
+    def __setitem__(self, cache_key, perf_list):
+        self.loaded[cache_key] = perf_list
+        self.updated_keys[cache_key] = True
+
+    def __contains__(self, cache_key):
+        if cache_key in self.loaded:
+            return self.loaded[cache_key] is not None
+        # Without loading it
+        return self.connection.execute('SELECT 1 FROM performances WHERE cache_key = ?', (cache_key,)).fetchone() is not None
+
+    def __len__(self):
+        return len(self.keys())
+
+    def keys(self):
+        db_keys = [row[0] for row in self.connection.execute('SELECT cache_key FROM performances')]
+        db_key_set = set(db_keys)
+        return db_keys + [cache_key for cache_key in self.updated_keys if cache_key not in db_key_set]
+
+    def save(self):
+        """Write entries updated since last save, all in one transaction"""
+        with self.connection:
+            self.connection.executemany('INSERT OR REPLACE INTO performances (cache_key, perf_list) VALUES (?, ?)',
+                                        ((cache_key, pickle.dumps(self.loaded[cache_key], protocol=pickle.HIGHEST_PROTOCOL))
+                                         for cache_key in self.updated_keys))
+        print(f'{len(self.updated_keys)} updated cache entries written to {self.db_file}')
+        self.updated_keys = {}
+
+    def load_crawl_history(self):
+        global athlete_ids_loaded
+        for yield_key, year, perf_count in self.connection.execute('SELECT yield_key, year, perf_count FROM query_yields'):
+            query_yields.setdefault(yield_key, {})[year] = perf_count
+        for host, page_count, total_sec in self.connection.execute('SELECT host, page_count, total_sec FROM fetch_latency'):
+            fetch_latency[host] = [page_count, total_sec]
+        for cache_key, fetch_time in self.connection.execute('SELECT cache_key, fetch_time FROM fetch_times'):
+            fetch_times[cache_key] = fetch_time
+        for cache_key, etag, last_modified, page_hash in self.connection.execute(
+                'SELECT cache_key, etag, last_modified, page_hash FROM page_validators'):
+            page_validators[cache_key] = {'etag' : etag, 'last_modified' : last_modified, 'hash' : page_hash}
+        if self.athlete_ids_kept:
+            athlete_ids_by_name.update(self.connection.execute('SELECT athlete_name, athlete_id FROM athlete_ids'))
+            athlete_ids_loaded = True
+
+    def save_crawl_history(self):
+        with self.connection:
+            self.connection.executemany('INSERT OR REPLACE INTO query_yields (yield_key, year, perf_count) VALUES (?, ?, ?)',
+                                        ((yield_key, year, perf_count) for yield_key, years in query_yields.items()
+                                                                       for year, perf_count in years.items()))
+            self.connection.executemany('INSERT OR REPLACE INTO fetch_latency (host, page_count, total_sec) VALUES (?, ?, ?)',
+                                        ((host, page_count, total_sec) for host, (page_count, total_sec) in fetch_latency.items()))
+            self.connection.executemany('INSERT OR REPLACE INTO fetch_times (cache_key, fetch_time) VALUES (?, ?)',
+                                        fetch_times.items())
+            self.connection.executemany('INSERT OR REPLACE INTO page_validators (cache_key, etag, last_modified, page_hash) VALUES (?, ?, ?, ?)',
+                                        ((cache_key, validators['etag'], validators['last_modified'], validators['hash'])
+                                         for cache_key, validators in page_validators.items()))
+            self.connection.executemany('INSERT OR REPLACE INTO athlete_ids (athlete_name, athlete_id) VALUES (?, ?)',
+                                        athlete_ids_by_name.items())
+
+    def import_pickle_cache(self, pickle_file):
+        """One-off copy of all entries from old-style pickled cache dict"""
+        pickled_cache = read_pickle_cache(pickle_file)
+        for cache_key, perf_list in pickled_cache.items():
+            self[cache_key] = perf_list
+        self.save()
+        self.save_crawl_history()
+        print(f'Imported {len(pickled_cache)} cache entries from {pickle_file}')
+
 
 # The collections of records of different types:
 record = {} # dict of age groups, each dict of events, each dict of genders, then ordered list of performance lists (allowing for ties)
 wava   = {} # dict of events, each dict of years and 0 for all years, then similar ordered list of performance lists
 ea_pb  = {} # dict of buckets (e.g. throws or sprints), then similar ordered list of performance lists
 agm    = {} # dict of years, then AGM prize tags, then similar ordered list of performance lists
+agm_trophy_index = {} # (event, gender, category, collection) to 'Auto' trophies a performance there may win
+agm_year = None # year trophies are being decided for
 
 max_records_all = 10 # max number of records for each event/gender, including all age groups
 max_records_age_group = 3 # Similarly per age group
 max_wavas_all = 20  # All-time WAVA list
 max_wavas_year = 5 # WAVA list for specific year
 wava_athlete_ids_done = {}
+wava_source = 'profile' # 'profile' to fetch age grades from Po10, 'local' to compute them, or 'verify' for both
+age_factors = {} # dict of genders, each dict of events, each dict of age to age factor
+age_standards = {} # dict of genders, each dict of events to open class standard in seconds
+wava_verify_diffs = [] # (local minus Po10 age grade, Po10 performance) when verifying
+po10_mode = 'age-groups' # or 'coalesced' to fetch ALL rankings only and find junior age groups from that
+runbritain_mode = 'age-groups' # or 'coalesced' to fetch ALL list only and find age groups from that, or 'verify'
+runbritain_verify_perfs = {} # (year, gender, event, category) to performances found each way when verifying
+cache_keys_refreshed = {} # cache keys fetched from web during this run, so no need to fetch again
+fetch_times = {} # cache key to time fetched from web, kept with cache to decide when it's due to be fetched again
+page_validators = {} # cache key to dict of ETag, Last-Modified and hash of page, kept with cache to spot unchanged pages
+cache_file_time = None # time cache was last written when loaded, taken as fetch time of entries from before fetch times were kept
+freshness_ttl_days = [1, 7, 365] # days cached results stay fresh: current year, previous year, older; empty for ever
+query_yields = {} # request for any year to dict of year to number of performances found, kept with cache
+prune_empty_years = 0 # skip requests that have given no results for this many years running, 0 for never
+pruned_query_count = 0
+record_engine = 'incremental' # or 'batch' to compute record tables in one go at end
+batch_rows = [] # dict per performance considered for a record table, in order, for batch engine
+batch_tables = [] # RecordTable objects referred to by batch_rows
+batch_table_idx = {} # id of RecordTable to index in batch_tables
+ingested_perfs = {} # (athlete key, event, category, date ordinal, score) to (performance considered for records, its top contributor)
+duplicate_perf_count = 0 # performances not considered again as already found from another source
+# Record tables saved with cache, so a run only recomputes those reached by results that have changed
+record_state_file = None # None to compute all record tables afresh every run
+record_state_version = 4 # increased when saved record tables can't be used by newer code
+record_contributors = [] # stack of cache keys (or input files) whose performances are being processed, outermost first
+contributor_tables = {} # cache key (or input file) to IDs of record tables its performances reached this run
+contributor_links = {} # rankings list cache key to others with some same performances, so change to one affects others
+contributor_counts = {} # rankings list cache key to what it added to performance_count
+clean_tables = {} # IDs of record tables restored from saved state, which aren't recomputed
+discovering_tables = False # True when just finding which tables changed results reach
+discovered_tables = {} # IDs of tables found that way
+input_file_key_prefix = 'file:' # input files are noted as contributors like cache keys, with this prefix
+# Performance fields that record tables depend on, leaving out those worked out afresh each run (e.g. EA PB score);
+# athlete key too, as that depends on other lists, so stable_athlete_key() is added to these
+perf_fingerprint_fields = operator.attrgetter('event', 'score', 'category', 'gender', 'original_special', 'decimal_places',
+                                              'athlete_name', 'athlete_id', 'athlete_link', 'date', 'fixture_name',
+                                              'fixture_site', 'fixture_ref', 'source', 'wava', 'age', 'age_group', 'invalid')
 max_trophy_entries = 3
 max_ea_pbs_all = max_wavas_all
 max_ea_pbs_year = max_wavas_year
 ea_pb_limit_perf_fraction = 0.25   # Improvement beyond level 9 we use for 'level 10'
+ea_pb_array_min_perfs = 200 # score this many or more performances with same table as array in one go
+ea_pb_scored_lists = {} # id of cached performance list to the list, once its EA PB scores have been worked out
 
 powerof10_root_url = 'https://thepowerof10.info'
 runbritain_root_url = 'https://www.runbritainrankings.com'
+# URLs that performances store compactly; first athlete one is preferred form for output
+athlete_profile_url_prefixes = [powerof10_root_url + '/athletes/profile.aspx?athleteid=',
+                                runbritain_root_url + '/runners/profile.aspx?athleteid=']
+athlete_profile_hosts = ['thepowerof10.info', 'runbritainrankings.com'] # as found in hand-entered links
+athlete_ids_by_name = {} # normalised athlete name to the one athlete ID seen with it, or 0 if more than one
+athlete_ids_loaded = False # True if athlete_ids_by_name was kept with cache, so cached lists needn't all be read for it
+athlete_name_keys = {} # normalised athlete name to negative athlete key, for athletes not known by ID
+normalised_athlete_names = {} # athlete name as given to normalised form
+fixture_url_prefixes = [powerof10_root_url + '/results/results.aspx?',
+                        runbritain_root_url + '/results/results.aspx?']
+
+# Concurrent fetching: limit parallel requests to any one site to be polite
+host_semaphores = {}
+host_semaphores_lock = threading.Lock()
+
+# Web fetching: keep-alive connections reused per site, and retries if server or
+# connection has a problem, so long trawls don't quietly lose results
+http_sessions = threading.local() # requests.Session per site, separate for each thread
+fetch_timeout_sec = 30.0
+fetch_max_retries = 3
+fetch_backoff_sec = 2.0  # doubled on each further retry
+fetch_stats = {'Requests'  : 0,
+               'Retries'   : 0,
+               'Failures'  : 0,
+               'Unchanged' : 0, # pages already cached that hadn't changed
+               'Changed'   : 0,
+               'New'       : 0}
+fetch_stats_lock = threading.Lock()
+fetch_latency = {} # host to [pages fetched, total seconds], kept with cache to estimate run time
+max_requests = 0 # stop after fetching this many pages if not zero
+pages_requested = 0
+fetch_offline = False # if True don't use the network at all
+raw_page_store = None # RawPageStore if we're keeping copies of raw pages
+sqlite_cache_extensions = ('.sqlite', '.db') # cache file names like this use SqlitePerformanceCache
+# Performance cache schema, increased when cached objects need migrating:
+#   1: original pickled objects with full URLs
+#   2: slots, with athlete and fixture IDs rather than URLs
+#   3: year parsed from date
+#   4: date ordinal parsed from date as well
+#   5: runbritain age group kept for local age grading
+#   6: date ordinal 0 if day not known
+cache_schema_version = 6
+
+# Checkpoints of cache written during long trawls, so results fetched so far aren't lost
+# if run interrupted, and run can be resumed without fetching them again
+checkpoint_cache_file = None # None if not checkpointing
+checkpoint_every_keys = 200 # new cache entries, or 0 for no limit
+checkpoint_every_sec = 300.0 # or 0 for no limit
+keys_since_checkpoint = 0
+last_checkpoint_time = 0.0
 
 common_table_attribs = 'border="2" style="width:100%"'
 
@@ -331,6 +883,9 @@ runbritain_category_lookup = {}
 for (category, min_age, max_age) in runbritain_categories:
     runbritain_category_lookup[category] = (min_age, max_age)
 
+# Runbritain rows also give this for athletes not in any of those
+runbritain_senior_ages = (20, 34)
+
 age_category_lookup = {}
 for age in range(1, 120):
     for (category, min_age, max_age) in runbritain_categories:
@@ -340,34 +895,44 @@ for age in range(1, 120):
     if age not in age_category_lookup:
         age_category_lookup[age] = 'SEN'
 
+# Events and categories automatic AGM trophies are decided from
+agm_junior_categories = ['U13', 'U15', 'U17', 'U20']
+agm_ea_pb_categories = ['ALL'] + agm_junior_categories # those with EA PB score tables
+agm_sprint_events = ['60', '100', '200', '300', '400']
+agm_middle_events = ['600', '800', '1500', '3000', '3000SC', '3000SCW']
+agm_throw_events = [event for (event, _, _, _, _, _) in known_events if event[:2] in ['SP', 'DT', 'HT', 'JT']]
+agm_multi_events = [event for (event, _, _, _, type, _) in known_events if type == 'M']
+agm_walk_events = ['MileW', '1500W', '2000W', '3000W', '5000W', '5MW', '10000W', '10KW']
+masters_min_age = 35
+
 # As initially taken from 2025_CnC_rolls_of_honour.xlsx:
 cnc_trophies = [
-    Trophy('M_Mar_overall',         'Marathon Trophy - Best Performance Male',                                     'C&C trophy',                   'Auto', 'Marathon results only'                ),
-    Trophy('W_Mar_overall',         'Marathon Trophy - Best Performance Female',                                   'C&C trophy',                   'Auto', 'Marathon results only'                ),
-    Trophy('Vet_Mar_wava',          'Marathon Trophy - Best Performance Masters',                                  'The Howard Cup',               'Auto', 'Marathon results only'                ),
-    Trophy('M_HM_overall',          'Half Marathon - Best Performance Male',                                       'Huddleston Trophy',            'Auto', 'Half Marathon results only'           ),
-    Trophy('W_HM_overall',          'Half Marathon - Best Performance Female',                                     'C&C Trophy',                   'Auto', 'Half Marathon results only'           ),
-    Trophy('Vet_HM_wava',           'Half Marathon - Best Performance Masters',                                    'C&C Cup',                      'Auto', 'Half Marathon results only'           ),
-    Trophy('M_10K_overall',         '10k Road race - Best Performance Male',                                       'C&C Trophy',                   'Auto', '10k Road Races only'                  ),
-    Trophy('W_10K_overall',         '10k Road race - Best Performance Female',                                     'C&C Trophy',                   'Auto', '10k Road Races only'                  ),
-    Trophy('Vet_10K_wava',          '10k Road race - Best Performance Masters',                                    'C&C Trophy',                   'Auto', '10k Road Races only'                  ),
-    Trophy('M_5K_overall',          '5k Road race - Best Performance Male',                                        'The Peter Howard Trophy',      'Auto', '5k Road Races only'                   ),
-    Trophy('W_5K_overall',          '5k Road race - Best Performance female',                                      'The Vice-Presidents Cup',      'Auto', '5k Road Races only'                   ),
-    Trophy('Vet_5K_wava',           '5k Road race - Best Performance Veterans',                                    'The Wilding Challenge Trophy', 'Auto', '5k Road Races only'                   ),
-    Trophy('M_Sprint_ea_pb',        'Best Performance Sprints - Male',                                             'C&C Shield',                   'Auto', '60, 100, 200, 300 and 400 flat sprint'),
-    Trophy('W_Sprint_ea_pb',        'Best Performance Sprints - Female',                                           'C&C Shield',                   'Auto', '60, 100, 200, 300 and 400 flat sprint'),
-    Trophy('M_Middle_ea_pb',        'Best Performance Middle Distance - Male',                                     'C&C Shield',                   'Auto', '600, 800, 1500, 3000, 3000SC'         ),
-    Trophy('W_Middle_ea_pb',        'Best Performance Middle Distance - Female',                                   'C&C Shield',                   'Auto', '600, 800, 1500, 3000, 3000SC'         ),
-    Trophy('VertJ_ea_pb',           'Best Performance Vertical Jumps',                                             'RHA Trophy',                   'Auto', 'High Jump and Pole Vault'             ),
-    Trophy('HorizJ_ea_pb',          'Best Performance Long and Triple jump',                                       'Derek Hulyer Cup',             'Auto', 'Long Jump and T'                      ),
-    Trophy('MU15plus_Hurdle_ea_pb', 'Best Performance Hurdles - Male U15 - Seniors',                               'The George Hibberd Trophy',    'Auto', '60mH, 80mH, 100mH, 110mH'             ),
-    Trophy('WU15plus_Hurdle_ea_pb', 'Best Performance Hurdles - Female U15 - Seniors',                             'The George Hibberd Trophy',    'Auto', '60mH, 75mH, 80mH, 100mH'              ),
-    Trophy('MU13_Hurdle_ea_pb',     'Best Performance Hurdles - Under 13 Boys ',                                   'The East Cambs Trophy',        'Auto', '60mH, 75mH'                           ),
-    Trophy('WU13_Hurdle_ea_pb',     'Best Performance Hurdles - Under 13 Girls',                                   'The C&C Trophy',               'Auto', '60mH, 70mH'                           ),
-    Trophy('Sen_Throws_ea_pb',      'Best Performance - Senior Throws (U20/senior equipment)',                     'The Bramford Cup',             'Auto', 'Discus, Shot, Javelin, Hammer'        ),
-    Trophy('Jun_Throws_ea_pb',      'Best Performance - Junior Throws (U13/U15/U17 equipment)',                    'The George Smith Cup',         'Auto', 'Discus, Shot, Javelin, Hammer'        ),
-    Trophy('M_Multi_ea_pb',         'Best Performance Multi-events - Male',                                        'The Gillingham Cup',           'Auto', 'Pentathlon, Heptathlon, Decathlon'    ),
-    Trophy('W_Multi_ea_pb',         'Best Performance Multi-events - Female',                                      'The Bill Oliver Cup',          'Auto', 'Pentathlon, Heptathlon'               ),
+    Trophy('M_Mar_overall',         'Marathon Trophy - Best Performance Male',                                     'C&C trophy',                   'Auto', 'Marathon results only',                 TrophyEligibility(['Mar'], ['M'], ['ALL'], 'record')),
+    Trophy('W_Mar_overall',         'Marathon Trophy - Best Performance Female',                                   'C&C trophy',                   'Auto', 'Marathon results only',                 TrophyEligibility(['Mar'], ['W'], ['ALL'], 'record')),
+    Trophy('Vet_Mar_wava',          'Marathon Trophy - Best Performance Masters',                                  'The Howard Cup',               'Auto', 'Marathon results only',                 TrophyEligibility(['Mar'], ['M', 'W'], ['ALL'], 'wava', masters_min_age)),
+    Trophy('M_HM_overall',          'Half Marathon - Best Performance Male',                                       'Huddleston Trophy',            'Auto', 'Half Marathon results only',            TrophyEligibility(['HM'], ['M'], ['ALL'], 'record')),
+    Trophy('W_HM_overall',          'Half Marathon - Best Performance Female',                                     'C&C Trophy',                   'Auto', 'Half Marathon results only',            TrophyEligibility(['HM'], ['W'], ['ALL'], 'record')),
+    Trophy('Vet_HM_wava',           'Half Marathon - Best Performance Masters',                                    'C&C Cup',                      'Auto', 'Half Marathon results only',            TrophyEligibility(['HM'], ['M', 'W'], ['ALL'], 'wava', masters_min_age)),
+    Trophy('M_10K_overall',         '10k Road race - Best Performance Male',                                       'C&C Trophy',                   'Auto', '10k Road Races only',                   TrophyEligibility(['10K'], ['M'], ['ALL'], 'record')),
+    Trophy('W_10K_overall',         '10k Road race - Best Performance Female',                                     'C&C Trophy',                   'Auto', '10k Road Races only',                   TrophyEligibility(['10K'], ['W'], ['ALL'], 'record')),
+    Trophy('Vet_10K_wava',          '10k Road race - Best Performance Masters',                                    'C&C Trophy',                   'Auto', '10k Road Races only',                   TrophyEligibility(['10K'], ['M', 'W'], ['ALL'], 'wava', masters_min_age)),
+    Trophy('M_5K_overall',          '5k Road race - Best Performance Male',                                        'The Peter Howard Trophy',      'Auto', '5k Road Races only',                    TrophyEligibility(['5K'], ['M'], ['ALL'], 'record')),
+    Trophy('W_5K_overall',          '5k Road race - Best Performance female',                                      'The Vice-Presidents Cup',      'Auto', '5k Road Races only',                    TrophyEligibility(['5K'], ['W'], ['ALL'], 'record')),
+    Trophy('Vet_5K_wava',           '5k Road race - Best Performance Veterans',                                    'The Wilding Challenge Trophy', 'Auto', '5k Road Races only',                    TrophyEligibility(['5K'], ['M', 'W'], ['ALL'], 'wava', masters_min_age)),
+    Trophy('M_Sprint_ea_pb',        'Best Performance Sprints - Male',                                             'C&C Shield',                   'Auto', '60, 100, 200, 300 and 400 flat sprint', TrophyEligibility(agm_sprint_events, ['M'], agm_ea_pb_categories, 'ea_pb')),
+    Trophy('W_Sprint_ea_pb',        'Best Performance Sprints - Female',                                           'C&C Shield',                   'Auto', '60, 100, 200, 300 and 400 flat sprint', TrophyEligibility(agm_sprint_events, ['W'], agm_ea_pb_categories, 'ea_pb')),
+    Trophy('M_Middle_ea_pb',        'Best Performance Middle Distance - Male',                                     'C&C Shield',                   'Auto', '600, 800, 1500, 3000, 3000SC',          TrophyEligibility(agm_middle_events, ['M'], agm_ea_pb_categories, 'ea_pb')),
+    Trophy('W_Middle_ea_pb',        'Best Performance Middle Distance - Female',                                   'C&C Shield',                   'Auto', '600, 800, 1500, 3000, 3000SC',          TrophyEligibility(agm_middle_events, ['W'], agm_ea_pb_categories, 'ea_pb')),
+    Trophy('VertJ_ea_pb',           'Best Performance Vertical Jumps',                                             'RHA Trophy',                   'Auto', 'High Jump and Pole Vault',              TrophyEligibility(['HJ', 'PV'], ['M', 'W'], agm_ea_pb_categories, 'ea_pb')),
+    Trophy('HorizJ_ea_pb',          'Best Performance Long and Triple jump',                                       'Derek Hulyer Cup',             'Auto', 'Long Jump and T',                       TrophyEligibility(['LJ', 'TJ'], ['M', 'W'], agm_ea_pb_categories, 'ea_pb')),
+    Trophy('MU15plus_Hurdle_ea_pb', 'Best Performance Hurdles - Male U15 - Seniors',                               'The George Hibberd Trophy',    'Auto', '60mH, 80mH, 100mH, 110mH',              TrophyEligibility(['80HU15M', '100HU17M', '110HU20M', '110H'], ['M'], ['ALL', 'U15', 'U17', 'U20'], 'ea_pb')),
+    Trophy('WU15plus_Hurdle_ea_pb', 'Best Performance Hurdles - Female U15 - Seniors',                             'The George Hibberd Trophy',    'Auto', '60mH, 75mH, 80mH, 100mH',               TrophyEligibility(['75HU15W', '80HU17W', '100HW'], ['W'], ['ALL', 'U15', 'U17', 'U20'], 'ea_pb')),
+    Trophy('MU13_Hurdle_ea_pb',     'Best Performance Hurdles - Under 13 Boys ',                                   'The East Cambs Trophy',        'Auto', '60mH, 75mH',                            TrophyEligibility(['75HU13M'], ['M'], ['U13'], 'ea_pb')),
+    Trophy('WU13_Hurdle_ea_pb',     'Best Performance Hurdles - Under 13 Girls',                                   'The C&C Trophy',               'Auto', '60mH, 70mH',                            TrophyEligibility(['70HU13W'], ['W'], ['U13'], 'ea_pb')),
+    Trophy('Sen_Throws_ea_pb',      'Best Performance - Senior Throws (U20/senior equipment)',                     'The Bramford Cup',             'Auto', 'Discus, Shot, Javelin, Hammer',         TrophyEligibility(agm_throw_events, ['M', 'W'], ['ALL', 'U20'], 'ea_pb')),
+    Trophy('Jun_Throws_ea_pb',      'Best Performance - Junior Throws (U13/U15/U17 equipment)',                    'The George Smith Cup',         'Auto', 'Discus, Shot, Javelin, Hammer',         TrophyEligibility(agm_throw_events, ['M', 'W'], ['U13', 'U15', 'U17'], 'ea_pb')),
+    Trophy('M_Multi_ea_pb',         'Best Performance Multi-events - Male',                                        'The Gillingham Cup',           'Auto', 'Pentathlon, Heptathlon, Decathlon',     TrophyEligibility(agm_multi_events, ['M'], agm_ea_pb_categories, 'ea_pb')),
+    Trophy('W_Multi_ea_pb',         'Best Performance Multi-events - Female',                                      'The Bill Oliver Cup',          'Auto', 'Pentathlon, Heptathlon',                TrophyEligibility(agm_multi_events, ['W'], agm_ea_pb_categories, 'ea_pb')),
     Trophy('',                      'Best Performance Track and Field - Male',                                     'W Mitchell Hall Cup',          'Committee Selection'   ),
     Trophy('',                      'Best Performance Track and Field - Female',                                   'The Simpson cup',              'Committee Selection'   ),
     Trophy('',                      'Best Performance Track and Field - Veteran male',                             'The George Smith trophy',      'Committee Selection'   ),
@@ -376,8 +941,8 @@ cnc_trophies = [
     Trophy('',                      'Best Masters Performance of the Season (all disciplines)',                    'The Veteran Shield',           'Committee Selection'   ),
     Trophy('',                      'Best Performance of the season - Wheelchair/Frame Runner/Disability athlete', 'C&C trophy',                   'Committee Selection'   ),
     Trophy('',                      'Contribution to the club',                                                    'C&C trophy',                   'Committee Selection'   ),
-    Trophy('Jun_Walk_overall',      'Race Walking - Junior',                                                       '',                             'Auto'                  ),
-    Trophy('Sen_Walk_overall',      'Race Walking - Senior',                                                       '',                             'Auto'                  ),
+    Trophy('Jun_Walk_overall',      'Race Walking - Junior',                                                       '',                             'Auto', '',                                      TrophyEligibility(agm_walk_events, ['M', 'W'], agm_junior_categories, 'ea_pb')), # EA PB to compare distances
+    Trophy('Sen_Walk_overall',      'Race Walking - Senior',                                                       '',                             'Auto', '',                                      TrophyEligibility(agm_walk_events, ['M', 'W'], ['ALL'], 'ea_pb')),
     Trophy('',                      'Glyn Smith Award',                                                            '',                             'Committee Selection'   ),
     Trophy('',                      'Keith Davidson Award',                                                        '',                             'Committee Selection'   ),
     Trophy('',                      'EYAL Team Manager Award - Male',                                              '',                             'Team Manager Selection'),
@@ -401,62 +966,215 @@ ea_pb_award_score = {}
 num_ea_pb_levels  = 9
 
 class EaPbAwardScoreSet():
-    def __init__(self, bucket, event, category, level_scores):
+    def __init__(self, bucket, event, category, level_scores, smaller_score_better):
         self.bucket = bucket # e.g. Sprint or Endurance
         self.event = event # Po10 event e.g. '400H'
         self.category = category # age/gender e.g. 'W U20'
         self.level_scores = level_scores # list of 9 numeric values for level 1 to level 9
+        self.smaller_score_better = smaller_score_better # event time/distance/height
+        # Interpolation table worked out once: performances as keys that go up with
+        # level (times negated), and the span from level 9 to 'level 10' limit
+        key_sign = -1.0 if smaller_score_better else 1.0
+        self.level_key_list = [key_sign * float(level_score) for level_score in level_scores]
+        self.level_keys = numpy.array(self.level_key_list, dtype=float)
+        self.worst_defined = level_scores[0]
+        best_defined = level_scores[num_ea_pb_levels - 1]
+        if smaller_score_better:
+            self.level_10_span = best_defined - best_defined * (1 - ea_pb_limit_perf_fraction)
+        else:
+            self.level_10_span = best_defined * (1 + ea_pb_limit_perf_fraction) - best_defined
+
+
+
+# Single pass through HTML to build tree of elements: tags, comments, or raw text
+# elements like <script> whose content must not be parsed as tags
+# Tag attributes may not contain '<' so typos like </center</td> do not swallow the next tag
+html_attrib_regex = re.compile(r'([^\s=/]+)(?:\s*=\s*("[^"]*"|\'[^\']*\'|[^\s>]*))?')
+html_void_tags = {'area', 'base', 'br', 'col', 'embed', 'hr', 'img', 'input', 'link', 'meta', 'param', 'source', 'wbr'}
+html_raw_text_tags = {'script', 'style'}
+html_raw_text_close_regex = {tag : re.compile(r'</' + tag + r'\s*>', flags=re.IGNORECASE) for tag in html_raw_text_tags}
+# Opening one of these implicitly closes any open element in the set, as browsers do
+html_implicit_close = {'td' : {'td', 'th'},
+                       'th' : {'td', 'th'},
+                       'tr' : {'td', 'th', 'tr'}}
+# Looking for an element to close implicitly stops at these, e.g. a cell only closes cells in its own row
+html_implicit_close_boundary = {'td' : {'tr', 'table'},
+                                'th' : {'tr', 'table'},
+                                'tr' : {'table'}}
+# Tags rankings and profile pages are read with; leaving others (e.g. <b>, <center>)
+# out of the tree lets the regex skip them, which is most of the tags on a page.
+# Links are found in the few cells that need them with get_html_content()
+html_table_tags = ('table', 'tr', 'td', 'th')
+html_token_regexes = {} # tuple of tags (or None for all) to regex finding only those, built when first needed
+
+
+def get_html_token_regex(tags):
+    """Regex finding comments, raw text elements and tags given, or all tags if
+    None; an element with only text inside is found whole, saving a token"""
+
+    token_regex = html_token_regexes.get(tags)
+    if token_regex is None:
+        # Tag names ignore case only where they are, as whole regex ignoring case is much slower
+        if tags is None:
+            tag_names = '[a-zA-Z][a-zA-Z0-9]*'
+            leaf_names = '(?!(?i:' + '|'.join(sorted(html_void_tags | html_raw_text_tags)) + r')(?![a-zA-Z0-9]))' + tag_names
+            leaf_text = '[^<]*'
+        else:
+            tag_names = '(?i:' + '|'.join(sorted(set(tags) | html_raw_text_tags)) + ')'
+            # Not tables or rows, which only hold cells and would be scanned to the end in vain
+            leaf_names = '(?i:' + ('|'.join(sorted(set(tags) - html_void_tags - html_raw_text_tags - {'table', 'tr'})) or '(?!)') + ')'
+            # Text may include tags left out, e.g. <td><b>name</b></td> is still found whole
+            leaf_text = r'[^<]*(?:<(?!/?' + tag_names + r'(?![a-zA-Z0-9])|!--)[^<]*)*'
+        token_regex = re.compile(r'<(?:!--.*?-->'
+                                 r'|(' + leaf_names + r')(?![a-zA-Z0-9])([^<>]*)>(' + leaf_text + r')</(?i:\1)\s*>'
+                                 r'|(/?)(' + tag_names + r')(?![a-zA-Z0-9])([^<>]*)>)',
+                                 flags=re.DOTALL)
+        html_token_regexes[tags] = token_regex
+    return token_regex
+
+
+def parse_html(html_text, tags=None):
+    """Build tree of HtmlBlock elements from HTML text in a single pass, returning
+    root block that contains everything; only elements with the tags given, if any"""
+
+    # Tree has no reference cycles, so no point in the garbage collector scanning
+    # everything else held (e.g. performance cache) as the many blocks are made
+    gc_was_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        return parse_html_blocks(html_text, tags)
+    finally:
+        if gc_was_enabled:
+            gc.enable()
+
+
+def parse_html_blocks(html_text, tags):
+    """Tree of HtmlBlock elements for parse_html()"""
+
+    text_length = len(html_text)
+    root = HtmlBlock('', {}, html_text, 0, text_length)
+    root.children = []
+    open_blocks = [root]
+    open_tags = [''] # parallel to open_blocks, for quick search
+    top_block = root
+    top_tag = ''
+    skip_until = 0
+    for match in get_html_token_regex(tags).finditer(html_text):
+        leaf_tag, attribs_unparsed, _, closing, tag, open_attribs_unparsed = match.groups()
+        start = match.start()
+        if start < skip_until:
+            # Inside raw text element
+            continue
+        if leaf_tag is not None:
+            tag = leaf_tag.lower()
+        elif tag is None:
+            # Comment
+            continue
+        else:
+            tag = tag.lower()
+            if closing:
+                # Closing tag: close the matching open element, and any left open inside it
+                if tag == top_tag:
+                    # Usual case, closes innermost element
+                    top_block.content_end = start
+                    open_blocks.pop()
+                    open_tags.pop()
+                elif tag in open_tags:
+                    depth = len(open_tags) - 1 - open_tags[::-1].index(tag)
+                    for block in open_blocks[depth:]:
+                        block.content_end = start
+                    del open_blocks[depth:]
+                    del open_tags[depth:]
+                else:
+                    # Stray closing tag with nothing open to match, ignore
+                    continue
+                top_block = open_blocks[-1]
+                top_tag = open_tags[-1]
+                continue
+            attribs_unparsed = open_attribs_unparsed
+
+        boundary = html_implicit_close_boundary.get(tag)
+        if boundary is not None and top_tag not in boundary:
+            implicitly_closed = html_implicit_close[tag]
+            if top_tag in implicitly_closed:
+                # Usual case, e.g. unclosed <td> directly before next one
+                top_block.content_end = start
+                open_blocks.pop()
+                open_tags.pop()
+            else:
+                for depth in range(len(open_tags) - 2, 0, -1):
+                    if open_tags[depth] in implicitly_closed:
+                        for block in open_blocks[depth:]:
+                            block.content_end = start
+                        del open_blocks[depth:]
+                        del open_tags[depth:]
+                        break
+                    if open_tags[depth] in boundary:
+                        break
+            top_block = open_blocks[-1]
+            top_tag = open_tags[-1]
+
+        if leaf_tag is not None:
+            # Whole element with only text inside, nothing to open
+            top_block.children.append(HtmlBlock(tag, None, html_text, match.start(3), match.end(3), attribs_unparsed))
+            continue
 
+        end = match.end()
+        block = HtmlBlock(tag, None, html_text, end, end, attribs_unparsed)
+        top_block.children.append(block)
 
+        if tag in html_raw_text_tags:
+            # Skip to closing tag, ignoring anything that looks like tags before it
+            close_match = html_raw_text_close_regex[tag].search(html_text, end)
+            if close_match is None:
+                block.content_end = text_length
+                skip_until = text_length
+            else:
+                block.content_end = close_match.start()
+                skip_until = close_match.end()
+        elif tag not in html_void_tags and not attribs_unparsed.endswith('/'):
+            block.children = []
+            open_blocks.append(block)
+            open_tags.append(tag)
+            top_block = block
+            top_tag = tag
 
-def get_html_content(html_text, html_tag):
-    """Extracts instances of text data enclosed by required tag"""
+    for block in open_blocks[1:]:
+        # Never closed
+        block.content_end = text_length
 
-    open_regex = re.compile(r'<' + html_tag + r'(.*?)>', flags=re.DOTALL)
-    close_regex = re.compile(r'</' + html_tag + r'>')
+    return root
 
-    contents = []
-    offset = 0
-    nesting_depth = 0
-    inside_tag_block = False
-    block_content_start_idx = -1
 
-    while True:
-        open_match = open_regex.search(html_text, pos=offset)
-        close_match = close_regex.search(html_text, pos=offset)
-        if close_match is None:
-            if ((open_match is not None) and (nesting_depth == 0)) or (nesting_depth > 0):
-                print(f'WARNING: no match for closing tag "{html_tag}"')
-            break
-        if open_match is not None and (open_match.start() < close_match.start()):
-            if inside_tag_block:
-                nesting_depth += 1
-            else:
-                block_content_start_idx = open_match.end()
-                inside_tag_block = True
-                attribs_unparsed = open_match.group(1)
-                attrib_pairs = attribs_unparsed.split(' ')
-                content = HtmlBlock(html_tag)
-                for attrib_pair in attrib_pairs:
-                    key, _, quoted_value = attrib_pair.partition('=')
-                    if not (key or quoted_value):
-                        continue
-                    unquoted_value = quoted_value.replace('"', '')
-                    content.attribs[key] = unquoted_value
-            offset = open_match.end()
+def get_html_content(html_text, html_tag):
+    """Extracts instances of text data enclosed by required tag, not including any
+    nested inside those found"""
+
+    contents = []
+    pending = list(reversed(parse_html(html_text).children))
+    while pending:
+        block = pending.pop()
+        if block.tag == html_tag:
+            contents.append(block)
         else:
-            if nesting_depth > 0:
-                # keep searching for tag that closes original opening tag
-                nesting_depth -= 1
-            else:
-                content.inner_text = html_text[block_content_start_idx : close_match.start()]
-                contents.append(content)
-                inside_tag_block = False
-            offset = close_match.end()
+            pending.extend(reversed(block.children))
 
     return contents
 
 
+def get_table_rows(table):
+    """Rows belonging to table, but not those of any table nested in it"""
+
+    return table.find_all('tr', stop_at='table')
+
+
+def get_row_cells(row):
+    """Cells of table row, but not those of any table nested in them; not only
+    immediate children as some pages wrap cells in e.g. <div>"""
+
+    return row.find_all('td', stop_at='table')
+
+
 def debold(bold_tagged_string):
     return bold_tagged_string.replace('<b>', '').replace('</b>', '')
 
@@ -508,14 +1226,97 @@ def make_numeric_score_from_performance_string(perf):
 
 
 def construct_performance(event, gender, category, perf, name, url, date, fixture_name, fixture_url,
-                          source, age_grade='0.0', age=0):
+                          source, age_grade='0.0', age=0, age_group=''):
     score, original_dp, original_special, invalid = make_numeric_score_from_performance_string(perf)
     wava = float(age_grade)
     perf = Performance(event, score, category, gender, original_special, original_dp, name, url, 
-                        date, fixture_name, fixture_url, source, wava=wava, age=age, invalid=invalid)
+                        date, fixture_name, fixture_url, source, wava=wava, age=age, invalid=invalid,
+                        age_group=age_group)
     return perf
 
 
+def parse_athlete_profile_id(url):
+    """Athlete ID from a Po10 or runbritain profile link in any form, or 0 if not one"""
+
+    parts = urllib.parse.urlsplit(url.strip())
+    host = parts.netloc.lower()
+    if not any(host == site or host.endswith('.' + site) for site in athlete_profile_hosts):
+        return 0
+    params = {name.lower() : value for name, value in urllib.parse.parse_qsl(parts.query)}
+    athlete_id = params.get('athleteid', '')
+    return int(athlete_id) if athlete_id.isdigit() else 0
+
+
+def normalise_athlete_name(name):
+    """Same form for names differing only in case or spacing, e.g. spreadsheet v. Po10"""
+
+    normalised = normalised_athlete_names.get(name)
+    if normalised is None:
+        normalised = ' '.join(name.split()).casefold()
+        normalised_athlete_names[name] = normalised
+    return normalised
+
+
+def note_athlete_ids(perfs):
+    """Note the Po10/runbritain athlete ID seen with each name, or 0 once different
+    athletes have been seen with it"""
+
+    for perf in perfs:
+        if perf.athlete_id:
+            name = normalise_athlete_name(perf.athlete_name)
+            known_id = athlete_ids_by_name.setdefault(name, perf.athlete_id)
+            if known_id != perf.athlete_id:
+                # Different athletes with same name, so name alone can't tell which
+                athlete_ids_by_name[name] = 0
+
+
+def resolve_athlete_keys(perfs):
+    """Give each performance an integer athlete key, used to tell athletes apart in
+    record tables: the Po10/runbritain athlete ID if known, else the ID seen with that
+    name elsewhere if only one, else a negative key shared by all with that name"""
+
+    note_athlete_ids(perfs)
+    for perf in perfs:
+        if perf.athlete_id:
+            perf.athlete_key = perf.athlete_id
+        else:
+            perf.athlete_key = get_athlete_name_key(normalise_athlete_name(perf.athlete_name))
+
+
+def get_athlete_name_key(name):
+    """Athlete key for someone only known by (normalised) name"""
+
+    athlete_key = athlete_ids_by_name.get(name)
+    if not athlete_key:
+        athlete_key = athlete_name_keys.get(name)
+        if athlete_key is None:
+            athlete_key = -1 - len(athlete_name_keys)
+            athlete_name_keys[name] = athlete_key
+    return athlete_key
+
+
+def stable_athlete_key(perf):
+    """Athlete key as it can be kept from one run to the next: the ID if known, else
+    the normalised name, as negative keys depend on the order names are first seen"""
+
+    return perf.athlete_key if perf.athlete_key > 0 else normalise_athlete_name(perf.athlete_name)
+
+
+def note_cached_athlete_ids(crawl_queries, performance_cache):
+    """Note athlete IDs of all cached rankings lists before any is processed, so a
+    row with no profile link gets the same key whichever list the athlete's ID is
+    first seen in. Only needed if the cache was written before athlete IDs by name
+    were kept with it, as reading every list defeats loading SQLite entries lazily;
+    keys are resolved as each list is read. Lists only fetched as they're processed
+    (serial fetching without saved record state) can still be resolved before the
+    ID for a name is seen."""
+
+    for query in crawl_queries:
+        perf_list = performance_cache.get(query.cache_key, None)
+        if perf_list:
+            note_athlete_ids(perf_list)
+
+
 def source_pref_score(source):
     if source.startswith('Po10'):
         score = 2
@@ -528,11 +1329,47 @@ def source_pref_score(source):
     return score
 
 
+def ingest_performance(perf):
+    """True if performance is new so should go on to record processing, or False if
+    the same one has already been considered from another source (e.g. runbritain
+    and Po10 both list most road races), in which case that source is just noted"""
+    global duplicate_perf_count
+
+    if not perf.date_ordinal:
+        # Can't be sure it's the same performance without a date
+        return True
+    key = (perf.athlete_key, perf.event, perf.category, perf.date_ordinal, perf.score)
+    contributor = record_contributors[0] if record_contributors else None
+    kept_perf, kept_contributor = ingested_perfs.get(key, (None, None))
+    if kept_perf is None:
+        ingested_perfs[key] = (perf, contributor)
+        return True
+
+    duplicate_perf_count += 1
+    if record_state_file and contributor != kept_contributor:
+        # Change to either list can change what the other contributes
+        contributor_links.setdefault(contributor, set()).add(kept_contributor)
+        contributor_links.setdefault(kept_contributor, set()).add(contributor)
+    sources = (kept_perf.source,) + kept_perf.alt_sources
+    if source_pref_score(perf.source) <= source_pref_score(kept_perf.source):
+        # Record tables would keep the one they already have anyway
+        if perf.source not in sources:
+            kept_perf.alt_sources += (perf.source,)
+        return False
+    # Preferred source found later, which replaces the other in record tables as usual
+    perf.alt_sources = tuple(source for source in sources if source != perf.source)
+    ingested_perfs[key] = (perf, contributor)
+    return True
+
+
 def process_perf_for_cats_and_ea_pb(perf, types, year, do_agm):
     """Consider a record both for specific age/gender category and overall,
     and also for EA PB Award records"""
 
+    if not discovering_tables and not ingest_performance(perf):
+        return
     process_performance_cat_and_all(perf, types, 'record', year, do_agm)
+    # EA PB score already worked out for whole list, see score_ea_pb_performances()
     process_performance(perf, types, 'ea_pb', 'ALL', do_agm)
     process_performance(perf, types, 'ea_pb', str(year), do_agm)
 
@@ -568,6 +1405,9 @@ def process_performance(perf, types, collection_choice, year, do_agm):
         # e.g. Track event but only want Road
         return
     if collection_choice == 'record':
+        max_records = max_records_all if perf.category == 'ALL' else max_records_age_group
+        smaller_score_better = known_events_lookup[perf.event][0]
+        compare_field = 'score'
         collection = record
         if perf.category not in collection:
             collection[perf.category] = {}
@@ -576,300 +1416,444 @@ def process_performance(perf, types, collection_choice, year, do_agm):
             collection[perf.category][perf.event] = {}
         if perf.gender not in collection[perf.category][perf.event]:
             # First performance by this gender in this event so start new list
-            collection[perf.category][perf.event][perf.gender] = []
+            collection[perf.category][perf.event][perf.gender] = RecordTable(max_records, smaller_score_better, compare_field)
         record_list = record[perf.category][perf.event][perf.gender]
-        max_records = max_records_all if perf.category == 'ALL' else max_records_age_group
-        smaller_score_better = known_events_lookup[perf.event][0]
-        compare_field = 'score'
+        table_id = ('record', perf.category, perf.event, perf.gender)
     elif collection_choice == 'wava':
+        max_records = max_wavas_all if year == 'ALL' else max_wavas_year
+        smaller_score_better = False # WAVA bigger the better always
+        compare_field = 'wava'
         collection = wava
         if perf.event not in collection:
             collection[perf.event] = {}
         if year not in collection[perf.event]:
-            collection[perf.event][year] = []
+            collection[perf.event][year] = RecordTable(max_records, smaller_score_better, compare_field)
         record_list = collection[perf.event][year]
-        max_records = max_wavas_all if year == 'ALL' else max_wavas_year
-        smaller_score_better = False # WAVA bigger the better always
-        compare_field = 'wava'
+        table_id = ('wava', perf.event, year)
     elif collection_choice == 'ea_pb':
-        if perf.event not in ea_pb_award_score:
-            # No score tables loaded or event doesn't fit scheme
-            return
-        ea_pb_event = ea_pb_award_score[perf.event]
-        gender_age_cat = perf.gender + " " + perf.category
-        if gender_age_cat not in ea_pb_event:
-            # No score defined
+        ea_pb_obj = get_ea_pb_award_score_set(perf)
+        if ea_pb_obj is None:
+            # No score tables loaded or event/category doesn't fit scheme
             return
-        ea_pb_obj = ea_pb_event[gender_age_cat]
-        smaller_score_better = known_events_lookup[perf.event][0] # Event time/distance/height
-        perf.ea_pb_score = calculate_ea_pb_score(ea_pb_obj, perf.score, smaller_score_better)
-        smaller_score_better = False # Now EA PB Score not event time/distance/height
+        smaller_score_better = False # EA PB Score not event time/distance/height
         compare_field = 'ea_pb_score'
+        max_records = max_ea_pbs_all if year == 'ALL' else max_ea_pbs_year
         collection = ea_pb
         if ea_pb_obj.bucket not in collection:
             collection[ea_pb_obj.bucket] = {}
         if year not in collection[ea_pb_obj.bucket]:
-            collection[ea_pb_obj.bucket][year] = []
+            collection[ea_pb_obj.bucket][year] = RecordTable(max_records, smaller_score_better, compare_field)
         record_list = collection[ea_pb_obj.bucket][year]
-        max_records = max_ea_pbs_all if year == 'ALL' else max_ea_pbs_year
+        table_id = ('ea_pb', ea_pb_obj.bucket, year)
     else:
         raise ValueError(f"Unexpected collection_choice {collection_choice}")
 
-    consider_performance_for_record(perf, record_list, max_records, smaller_score_better, compare_field)
-
-    if do_agm:
-        for trophy in cnc_trophies:
-            if performance_fits_trophy(trophy, perf, compare_field):
-                consider_performance_for_record(perf, trophy.record_table, max_trophy_entries, smaller_better, compare_field)
+    if table_computed(table_id):
+        if record_engine == 'batch':
+            add_batch_row(perf, record_list, compare_field)
+        else:
+            record_list.consider_performance(perf)
+
+    if do_agm and year != 'ALL' and perf.year == agm_year:
+        # Once per performance and collection, e.g. not again for all-time EA PB table
+        for trophy in agm_trophy_index.get((perf.event, perf.gender, perf.category, collection_choice), []):
+            if performance_fits_trophy(trophy, perf) and table_computed(('agm', trophy.tag)):
+                trophy.record_table.consider_performance(perf)
+
+
+def add_batch_row(perf, record_list, compare_field):
+    """Note performance for batch engine to consider for this record table later; table
+    and value noted now as performance category and EA PB score reused for other tables"""
+
+    table_idx = batch_table_idx.get(id(record_list))
+    if table_idx is None:
+        table_idx = len(batch_tables)
+        batch_table_idx[id(record_list)] = table_idx
+        batch_tables.append(record_list)
+    value = record_list.get_value(perf)
+    batch_rows.append((table_idx, perf.category, value if record_list.smaller_score_better else -value, perf))
+
+
+def make_batch_dataframe():
+    """One row per performance considered for each record table, in order"""
+
+    table_idxs, categories, sort_keys, perfs = zip(*batch_rows)
+    df = pandas.DataFrame({'table'       : table_idxs,
+                           'order'       : range(len(batch_rows)),
+                           'event'       : [perf.event for perf in perfs],
+                           'gender'      : [perf.gender for perf in perfs],
+                           'category'    : categories,
+                           'score'       : [perf.score for perf in perfs],
+                           'wava'        : [perf.wava for perf in perfs],
+                           'ea_pb_score' : [perf.ea_pb_score for perf in perfs],
+                           'athlete'     : [perf.athlete_key for perf in perfs],
+                           'source'      : [perf.source for perf in perfs],
+                           'sort_key'    : sort_keys,
+                           'invalid'     : [perf.invalid for perf in perfs],
+                           'perf'        : perfs})
+    source_prefs = {source : source_pref_score(source) for source in df['source'].unique()}
+    df['source_pref'] = df['source'].map(source_prefs)
+    df['max_records'] = df['table'].map(pandas.Series([table.max_records for table in batch_tables]))
+    return df
 
 
-def consider_performance_for_record(perf, record_list, max_records, smaller_score_better, compare_field):
-    """Check if this performance belongs on list for a specific record and add if
-    so, while keeping list at no more than allowed length by deleting worst remaining
-    performance(s)"""
+def build_batch_record_tables(target_tables):
+    """Compute all record tables noted in batch_rows in one vectorised pass, filling
+    target_tables (parallel to batch_tables). Same result as considering each
+    performance in turn, provided invalid anti-records come after the performances
+    they cancel, as the club spreadsheets are processed last. Unlike considering them
+    in turn, the result doesn't depend on order otherwise: that can lose a place if a
+    table shrinks after an athlete improves to tie with another entry, having
+    already turned away a performance that would now fit."""
 
-    add_record = False
-    if len(record_list) < max_records:
-        # We don't have enough records for this event yet so add
-        add_record = True
-    else:
-        prev_worst_score = getattr(record_list[-1][0], compare_field)
-        # For a tie, now adding new record, as club records sometimes showed two
-        # record-holders; and a chance to line up data from different sources in
-        # the output to show agreement where they match
-        if smaller_score_better:
-            if getattr(perf, compare_field) <= prev_worst_score: add_record = True
+    if not batch_rows:
+        return
+    df = make_batch_dataframe()
+    valid_df = df[~df['invalid']]
+
+    # Each athlete only appears with their best score in each table
+    athlete_groups = valid_df.groupby(['table', 'athlete'], sort=False)['sort_key']
+    valid_df = valid_df[valid_df['sort_key'] == athlete_groups.transform('min')]
+
+    # Athlete keeps place among ties from when they first got that score, but the
+    # performance shown is the first one from the most preferred source (e.g. Po10)
+    valid_df = valid_df.assign(position=valid_df.groupby(['table', 'athlete'], sort=False)['order'].transform('min'))
+    valid_df = valid_df.sort_values(['table', 'athlete', 'source_pref', 'order'], ascending=[True, True, False, True])
+    valid_df = valid_df.drop_duplicates(['table', 'athlete'])
+
+    # Top N distinct scores per table, ties sharing a place
+    dense_rank = valid_df.groupby('table', sort=False)['sort_key'].rank(method='dense')
+    valid_df = valid_df[dense_rank <= valid_df['max_records']]
+    valid_df = valid_df.sort_values(['table', 'sort_key', 'position'])
+
+    for table_idx, table_df in valid_df.groupby('table', sort=False):
+        record_list = target_tables[table_idx]
+        for _, tie_df in table_df.groupby('sort_key', sort=False):
+            record_list.append_entry(tie_df['perf'].tolist())
+
+    for row in df[df['invalid']].itertuples():
+        # Anti-records remove entries so must be done in order
+        target_tables[row.table].consider_performance(row.perf)
+
+
+def performance_fits_trophy(trophy, perf):
+    """Consider if a performance fits with a club trophy, beyond event, gender,
+    category and collection already matched through agm_trophy_index"""
+    return perf.age >= trophy.eligibility.min_age
+
+
+def index_agm_trophies(year):
+    """Start record table for each automatic AGM trophy, and index trophies by the
+    event, gender, category and collection of performances that may win them, so
+    each performance only goes to those it can affect"""
+
+    global agm_year
+    agm_year = year
+    agm_trophy_index.clear()
+    for trophy in cnc_trophies:
+        if trophy.approach != 'Auto':
+            continue
+        eligibility = trophy.eligibility
+        if eligibility.collection == 'record':
+            smaller_score_better_set = {known_events_lookup[event][0] for event in eligibility.events}
+            if len(smaller_score_better_set) != 1:
+                raise ValueError(f'Trophy {trophy.tag} compares scores of events that are not all times or all distances')
+            smaller_score_better = smaller_score_better_set.pop()
+            compare_field = 'score'
+        elif eligibility.collection == 'wava':
+            smaller_score_better = False
+            compare_field = 'wava'
+        elif eligibility.collection == 'ea_pb':
+            smaller_score_better = False
+            compare_field = 'ea_pb_score'
         else:
-            if getattr(perf, compare_field) >= prev_worst_score: add_record = True
-
-    if add_record:
-        same_score_seen = False
-        tie_same_name_managed = False
-        for existing_perf_list in record_list:
-            if getattr(existing_perf_list[0], compare_field) == getattr(perf, compare_field):
-                same_score_seen = True
-                # Same record with different source, or a tie with new person
-                # Prefer Po10 over Runbritain, and don't include both as share source data
-                for perf_idx, existing_perf in enumerate(existing_perf_list):
-                    if existing_perf.athlete_name == perf.athlete_name:
-                        if getattr(perf, 'invalid', False): # Po10 caches may predate this
-                            # Manual anti-record to delete entry we don't want
-                            del existing_perf_list[perf_idx]
-                            tie_same_name_managed = True
-                            break
-                        existing_source_score = source_pref_score(existing_perf.source)
-                        this_source_score = source_pref_score(perf.source)
-                        if existing_source_score >= this_source_score:
-                            # E.g. don't add Runbritain score if already there from Po10
-                            tie_same_name_managed = True
-                            break
-                        else:
-                            # E.g. replace existing Runbritain one with Po10, or prefer newer file
-                            # assuming provided in ascending date order
-                            existing_perf_list[perf_idx] = perf
-                            tie_same_name_managed = True
-                            break
-                if not tie_same_name_managed:
-                    # Could be manual record to put alongside Po10 say
-                    existing_perf_list.append(perf)
-                break
-        if not same_score_seen:
-            record_list.append([perf])
-            record_list.sort(key=lambda x: getattr(x[0], compare_field), reverse=not smaller_score_better)
-
-        # Ensure new name only appears with their top score
-        lowest_rec_idx_for_this_name = len(record_list) # i.e. not found yet
-        rec_idx = 0
-        while rec_idx < len(record_list):
-            perf_idx = 0
-            while perf_idx < len(record_list[rec_idx]):
-                existing_record_name = record_list[rec_idx][perf_idx].athlete_name
-                if existing_record_name == perf.athlete_name:
-                    if rec_idx > lowest_rec_idx_for_this_name:
-                        # Avoid same person appearing multiple times, allowing for ties,
-                        # but nice to show multiple sources for identical performance
-                        del record_list[rec_idx][perf_idx]
-                        continue
-                    elif rec_idx < lowest_rec_idx_for_this_name:
-                        # Found best performance by this name so far
-                        lowest_rec_idx_for_this_name = rec_idx
-                    else:
-                        # Someone else, ignore
-                        pass
-                perf_idx += 1
-            if not record_list[rec_idx]:
-                # Usual case after a deletion: no tie, that score was for only one athlete
-                del record_list[rec_idx]
-            else:
-                rec_idx += 1
-        # Keep list at max required length 
-        del record_list[max_records :]
+            raise ValueError(f"Unexpected trophy collection {eligibility.collection}")
+        trophy.record_table = RecordTable(max_trophy_entries, smaller_score_better, compare_field)
+        agm.setdefault(str(year), {})[trophy.tag] = trophy.record_table
+        for event in eligibility.events:
+            for gender in eligibility.genders:
+                for category in eligibility.categories:
+                    agm_trophy_index.setdefault((event, gender, category, eligibility.collection), []).append(trophy)
 
 
-def performance_fits_trophy(trophy, perf, compare_field):
-    """Consider if a performance fits with a club trophy"""
-    return False
+def get_ea_pb_award_score_set(perf):
+    """EA PB award score table for this performance's event and category, or None"""
 
+    ea_pb_event = ea_pb_award_score.get(perf.event)
+    if ea_pb_event is None:
+        return None
+    return ea_pb_event.get(perf.gender + " " + perf.category)
+
+
+def calculate_ea_pb_score(ea_pb_obj, score):
+    """EA PB award score for one performance score, same sums as the array version
+    but quicker for just a few"""
+
+    key = -score if ea_pb_obj.smaller_score_better else score
+    level_keys = ea_pb_obj.level_key_list
+    if key < level_keys[0]:
+        if ea_pb_obj.smaller_score_better:
+            return (1.0 / score) / (1.0 / ea_pb_obj.worst_defined)
+        return score / ea_pb_obj.worst_defined
+    if key >= level_keys[num_ea_pb_levels - 1]:
+        return num_ea_pb_levels + (key - level_keys[num_ea_pb_levels - 1]) / ea_pb_obj.level_10_span
+    lo_idx = bisect.bisect_right(level_keys, key) - 1
+    return (lo_idx + 1) + (key - level_keys[lo_idx]) / (level_keys[lo_idx + 1] - level_keys[lo_idx])
+
+
+def calculate_ea_pb_scores(ea_pb_obj, scores):
+    """EA PB award scores for array of performance scores in one event/category"""
 
-def calculate_ea_pb_score(ea_pb_obj, score, smaller_score_better):
     # The England Athletics PB Awards scheme gives an integer score to different
     # performance attainments, but we need a continuous (decimal) score for close
     # comparisons, so have to intepolate between the levels defined
-
-    worst_defined = ea_pb_obj.level_scores[0]
-    best_defined = ea_pb_obj.level_scores[num_ea_pb_levels - 1]
-
-    if smaller_score_better:
-        if score > worst_defined:
-            # Below Level 1
-            reciprocal_score = 1.0 / score # So long time gives small number
-            reciprocal_worst = 1.0 / worst_defined # Normalised to 1.0 for Level 1
-            ea_score = reciprocal_score / reciprocal_worst
-        elif score <= best_defined:
-            # At or above Level 9, ramp to "Level 10" at safe limit performance
-            limit_score = best_defined * (1 - ea_pb_limit_perf_fraction)
-            fraction_to_limit = (best_defined - score) / (best_defined - limit_score)
-            ea_score = num_ea_pb_levels + fraction_to_limit
+    scores = numpy.asarray(scores, dtype=float)
+    keys = -scores if ea_pb_obj.smaller_score_better else scores
+    level_keys = ea_pb_obj.level_keys
+
+    with numpy.errstate(divide='ignore', invalid='ignore'):
+        # Between levels: interpolate from level at or below
+        lo_idx = numpy.clip(numpy.searchsorted(level_keys, keys, side='right') - 1, 0, num_ea_pb_levels - 2)
+        ea_scores = (lo_idx + 1) + (keys - level_keys[lo_idx]) / (level_keys[lo_idx + 1] - level_keys[lo_idx])
+
+        # At or above Level 9, ramp to "Level 10" at safe limit performance
+        above = keys >= level_keys[num_ea_pb_levels - 1]
+        ea_scores[above] = num_ea_pb_levels + (keys[above] - level_keys[num_ea_pb_levels - 1]) / ea_pb_obj.level_10_span
+
+        below = keys < level_keys[0]
+        if ea_pb_obj.smaller_score_better:
+            # Below Level 1, reciprocal so long time gives small number, normalised to 1.0 for Level 1
+            ea_scores[below] = (1.0 / scores[below]) / (1.0 / ea_pb_obj.worst_defined)
         else:
-            for lo_idx in range(0, num_ea_pb_levels - 1):
-                hi_idx = lo_idx + 1
-                if (score <= ea_pb_obj.level_scores[lo_idx] and 
-                       score > ea_pb_obj.level_scores[hi_idx]):
-                    delta = ea_pb_obj.level_scores[lo_idx] - ea_pb_obj.level_scores[hi_idx]
-                    diff = ea_pb_obj.level_scores[lo_idx] - score
-                    ea_score = (lo_idx + 1) + diff / delta
-    else:
-        if score < worst_defined:
             # Below Level 1, do smooth ramp to "Level 0" at zero
-            ea_score = score / worst_defined
-        elif score >= best_defined:
-            # At or above Level 9, ramp to "Level 10" at a safe limit performance
-            limit_score = best_defined * (1 + ea_pb_limit_perf_fraction)
-            fraction_to_limit = (score - best_defined) / (limit_score - best_defined)
-            ea_score = num_ea_pb_levels + fraction_to_limit
-        else:
-            for lo_idx in range(0, num_ea_pb_levels - 1):
-                hi_idx = lo_idx + 1
-                if (score >= ea_pb_obj.level_scores[lo_idx] and 
-                       score < ea_pb_obj.level_scores[hi_idx]):
-                    delta = ea_pb_obj.level_scores[hi_idx] - ea_pb_obj.level_scores[lo_idx]
-                    diff = score - ea_pb_obj.level_scores[lo_idx]
-                    ea_score = (lo_idx + 1) + diff / delta
+            ea_scores[below] = scores[below] / ea_pb_obj.worst_defined
 
-    return ea_score
+    return ea_scores
 
 
-def process_po10_wava(reqd_perf, performance_cache, types, rebuild_wava, do_agm):
-    """Consider a performance for WAVA record tables"""
+def score_ea_pb_performances(perfs):
+    """Set EA PB award score of each performance that has a score table, scoring
+    all those sharing a table in one go"""
 
-    athlete_id_match = re.search(r'athleteid=([0-9]+)', reqd_perf.athlete_url)
-    athlete_id = athlete_id_match.group(1)
+    perfs_by_score_set = {}
+    for perf in perfs:
+        ea_pb_obj = get_ea_pb_award_score_set(perf)
+        if ea_pb_obj is not None:
+            perfs_by_score_set.setdefault(ea_pb_obj, []).append(perf)
 
-    request_params = {'athleteid'   : athlete_id,
-                      'viewby'      : 'agegraded'}
+    for ea_pb_obj, score_set_perfs in perfs_by_score_set.items():
+        if len(score_set_perfs) < ea_pb_array_min_perfs:
+            # Not worth setting up arrays
+            for perf in score_set_perfs:
+                perf.ea_pb_score = calculate_ea_pb_score(ea_pb_obj, float(perf.score))
+            continue
+        ea_scores = calculate_ea_pb_scores(ea_pb_obj, [perf.score for perf in score_set_perfs])
+        for perf, ea_score in zip(score_set_perfs, ea_scores.tolist()):
+            perf.ea_pb_score = ea_score
 
-    url = powerof10_root_url + '/athletes/profile.aspx'
-    cache_key = make_cache_key(url, request_params)
 
-    if athlete_id in wava_athlete_ids_done:
-        # We already have all performances for this athlete, even if cache rebuilt this time
-        use_cache = True
-    else:
-        use_cache = not rebuild_wava
-        wava_athlete_ids_done[athlete_id] = True
+def score_ea_pb_performance_list(perf_list):
+    """Set EA PB award scores of cached performance list, unless already done this run"""
 
-    if use_cache:
-        perf_list = performance_cache.get(cache_key, None)
-    else:
-        perf_list = None
+    if id(perf_list) not in ea_pb_scored_lists:
+        score_ea_pb_performances(perf_list)
+        ea_pb_scored_lists[id(perf_list)] = perf_list
 
-    report_string_base = f'PowerOf10 WAVA list for {reqd_perf.athlete_name} ID {athlete_id} '
-    if perf_list is None:
-        perf_list = []
-        try:
-            page_response = requests.get(url, request_params)
-        except requests.exceptions.ConnectionError:
-            print(report_string_base + ' ConnectionError')
-            return
 
-        print(report_string_base + f'page return status {page_response.status_code}')
+def score_cached_ea_pb_performances(crawl_queries, performance_cache):
+    """Set EA PB award scores of all cached rankings lists in one batch, quicker than
+    list by list as there are many more performances for each score table; lists
+    fetched as they're processed are still scored then"""
 
-        if page_response.status_code != 200:
-            print(f'HTTP error code fetching page: {page_response.status_code}')
+    perf_lists = [performance_cache.get(query.cache_key, None) for query in crawl_queries]
+    perf_lists = [perf_list for perf_list in perf_lists if perf_list and id(perf_list) not in ea_pb_scored_lists]
+    score_ea_pb_performances([perf for perf_list in perf_lists for perf in perf_list])
+    for perf_list in perf_lists:
+        ea_pb_scored_lists[id(perf_list)] = perf_list
+    print(f'EA PB award scores worked out for {len(perf_lists)} cached rankings lists')
+
+
+def process_po10_wava(reqd_perf, performance_cache, types, rebuild_wava, do_agm):
+    """Consider a performance for WAVA record tables"""
+
+    if not reqd_perf.athlete_id:
+        # No Po10 profile link for this athlete, so no age-graded profile page to get
+        return
+    query = make_po10_wava_query(reqd_perf, rebuild_wava)
+    wava_athlete_ids_done[query.request_params['athleteid']] = True
+    push_record_contributor(query.cache_key)
+    try:
+        perf_list = get_query_performances(query, performance_cache, types)
+        if perf_list is None:
             return
 
-        input_text = page_response.text
-        tables = get_html_content(input_text, 'table')
-        second_level_tables = []
-        for table in tables:
-            nested_tables = get_html_content(table.inner_text, 'table')
-            second_level_tables.extend(nested_tables)
-        third_level_tables = []
-        for table in second_level_tables:
-            nested_tables = get_html_content(table.inner_text, 'table')
-            third_level_tables.extend(nested_tables)
-        fourth_level_tables = []
-        for table in third_level_tables:
-            nested_tables = get_html_content(table.inner_text, 'table')
-            fourth_level_tables.extend(nested_tables)
-        all_tables = tables
-        all_tables.extend(second_level_tables)
-        all_tables.extend(third_level_tables)
-        all_tables.extend(fourth_level_tables) # Think it is actually in here
-
-        for table in all_tables:
-            if 'class' not in table.attribs or table.attribs['class'] != 'alternatingrowspanel':
+        for perf in perf_list:
+            # Only match performance of interest this time, as athlete may have
+            # performances logged when running for a different club
+            if reqd_perf.date_ordinal != perf.date_ordinal:
                 continue
-            rows = get_html_content(table.inner_text, 'tr')
-            if len(rows) < 2:
+            elif not perf.date_ordinal and reqd_perf.date != perf.date:
+                # Day not known for either, so only the same if dates given the same way
                 continue
-            # Looks like we've found the table of results or something similar
-            process_one_athlete_results_table(reqd_perf, rows, perf_list)
+            else:
+                # Found performance we were looking for this time
+                if wava_source == 'verify':
+                    note_wava_verification(reqd_perf, perf)
+                process_performance(perf, types, 'wava', 'ALL', do_agm)
+                process_performance(perf, types, 'wava', str(perf.year), do_agm)
+                performance_count['Po10-WAVA'] += 1
+                break
+    finally:
+        record_contributors.pop()
 
-        performance_cache[cache_key] = perf_list
 
-    for perf in perf_list:
-        # Only match performance of interest this time, as athlete may have
-        # performances logged when running for a different club
-        if reqd_perf.date != perf.date:
+def process_local_wava(reqd_perf, types, do_agm):
+    """Consider a runbritain performance for WAVA record tables, age-graded here
+    from factor tables instead of fetching the athlete's profile page"""
+
+    graded = compute_local_wava(reqd_perf)
+    if graded is None:
+        return
+    perf = copy.copy(reqd_perf)
+    perf.wava, perf.age = graded
+    perf.category = 'ALL' # as for performances from profile page
+    process_performance(perf, types, 'wava', 'ALL', do_agm)
+    process_performance(perf, types, 'wava', str(perf.year), do_agm)
+    performance_count['Local-WAVA'] += 1
+
+
+def get_youngest_factor_age(age_group, factors):
+    """Youngest age in runbritain age group that we have an age factor for, or 0"""
+    if age_group == 'SEN':
+        (min_age, max_age) = runbritain_senior_ages
+    else:
+        (min_age, max_age) = runbritain_category_lookup.get(age_group, (0, 0))
+    for age in range(min_age, max_age + 1):
+        if age in factors:
+            return age
+    return 0
+
+
+def compute_local_wava(perf):
+    """Age grade percentage and age used, or None if not possible. Runbritain only
+    gives the age group, so we grade as if the athlete were the youngest age in
+    it; that never overstates the age grade, but can be a few percent below the
+    Po10 figure for someone at the top of their age group."""
+
+    factors = age_factors.get(perf.gender, {}).get(perf.event)
+    standard = age_standards.get(perf.gender, {}).get(perf.event)
+    if not factors or not standard or perf.score <= 0:
+        return None
+    age = get_youngest_factor_age(perf.age_group or perf.category, factors)
+    if not age:
+        return None
+    wava = round(100.0 * standard / (perf.score * factors[age]), 2) # as shown by Po10
+    return wava, age
+
+
+def note_wava_verification(reqd_perf, po10_perf):
+    graded = compute_local_wava(reqd_perf)
+    if graded is None:
+        print(f'WARNING: no local age grade for {reqd_perf.athlete_name} {reqd_perf.event} {reqd_perf.date}')
+        return
+    wava_verify_diffs.append((graded[0] - po10_perf.wava, po10_perf))
+
+
+def report_wava_verification():
+    if not wava_verify_diffs:
+        print('No age grades verified')
+        return
+    abs_diffs = [abs(diff) for diff, perf in wava_verify_diffs]
+    worst_diff, worst_perf = max(wava_verify_diffs, key=lambda diff_perf: abs(diff_perf[0]))
+    close_count = sum(1 for diff in abs_diffs if diff <= 1.0)
+    print(f'Local age grades v. Po10 for {len(abs_diffs)} performances: mean difference {sum(abs_diffs) / len(abs_diffs):.2f}%, '
+          f'{close_count} within 1%, worst {worst_diff:+.2f}% for {worst_perf.athlete_name} {worst_perf.event} '
+          f'{worst_perf.date} (age {worst_perf.age})')
+
+
+def make_po10_wava_query(reqd_perf, rebuild_wava):
+    """Request for the age-graded profile page of the athlete responsible for
+    a performance"""
+
+    athlete_id = str(reqd_perf.athlete_id)
+
+    request_params = {'athleteid'   : athlete_id,
+                      'viewby'      : 'agegraded'}
+
+    url = powerof10_root_url + '/athletes/profile.aspx'
+
+    if athlete_id in wava_athlete_ids_done:
+        # We already have all performances for this athlete, even if cache rebuilt this time
+        rebuild_cache = False
+    else:
+        rebuild_cache = rebuild_wava
+
+    report_string_base = f'PowerOf10 WAVA list for {reqd_perf.athlete_name} ID {athlete_id} '
+    context = {'gender'       : reqd_perf.gender,
+               'athlete_name' : reqd_perf.athlete_name,
+               'athlete_url'  : reqd_perf.athlete_url}
+    # Profile only changes for year of this performance if it's recent
+    return WebQuery('po10_wava', url, request_params, report_string_base, context, rebuild_cache, reqd_perf.year)
+
+
+def parse_po10_wava_page(input_text, types, gender, athlete_name, athlete_url):
+    """Extract road performances with age grades from athlete profile page"""
+
+    perf_list = []
+    # Results table is nested several levels down in page layout tables, so find
+    # it from tables alone, then only its own rows and cells
+    page = parse_html(input_text, ('table',))
+    for table in page.find_all('table', class_='alternatingrowspanel'):
+        rows = get_table_rows(parse_html(table.inner_text, html_table_tags))
+        if len(rows) < 2:
             continue
-        else:
-            # Found performance we were looking for this time
-            year = get_perf_year(perf.date)
-            process_performance(perf, types, 'wava', 'ALL', do_agm)
-            process_performance(perf, types, 'wava', str(year), do_agm)
-            performance_count['Po10-WAVA'] += 1
-            break
+        # Looks like we've found the table of results or something similar
+        process_one_athlete_results_table(gender, athlete_name, athlete_url, rows, perf_list)
+
+    return perf_list
 
 
-# PowerOf10 dates always have form "1 Jan 1980" or "11 Jan 1989"
-regex_po10_date = re.compile(r'([0-9][0-9]?) ([A-Z][a-z][a-z]) ([0-9][0-9])')
+# PowerOf10 dates always have form "1 Jan 80" or "11 Jan 89", spreadsheets
+# may have same with 4-digit year
+regex_po10_date = re.compile(r'([0-9][0-9]?) ([A-Z][a-z][a-z]) ([0-9]{4}|[0-9][0-9])\b')
 regex_4digits = re.compile(r'([0-9]{4})')
+month_numbers = {'Jan' : 1, 'Feb' : 2, 'Mar' : 3, 'Apr' : 4, 'May' : 5, 'Jun' : 6,
+                 'Jul' : 7, 'Aug' : 8, 'Sep' : 9, 'Oct' : 10, 'Nov' : 11, 'Dec' : 12}
 
-def get_perf_year(perf_date_str):
-    # Return useful numeric year from whatever string we have
-    # Can't make this Performance method now because of cached objects on disk
+def parse_perf_date(perf_date_str):
+    """Return date ordinal (as datetime.date.toordinal()) and numeric year from whatever
+    string we have; done once for each performance when constructed or when old cache
+    migrated, so later comparisons are just integers. If the day isn't known the
+    ordinal is 0, so it isn't taken to be the same date as anything."""
 
     # Mostly Po10/RunBritain
     match_obj = regex_po10_date.match(perf_date_str)
     if match_obj:
-        year_2digit = match_obj.group(3) # e.g. 24 for 2024
-        return 2000 + int(year_2digit)
+        year = int(match_obj.group(3))
+        if year < 100:
+            year += 2000 # e.g. 24 for 2024
+        month = month_numbers.get(match_obj.group(2))
+        if month:
+            try:
+                return datetime.date(year, month, int(match_obj.group(1))).toordinal(), year
+            except ValueError:
+                pass # e.g. 31 Jun, just use year
+        return 0, year
     # Manual records should at least have 4-digit number date
     match_obj = regex_4digits.search(perf_date_str)
     if match_obj:
-        return int(match_obj.group(1))
+        return 0, int(match_obj.group(1))
     # If we get to here, we found nothing useful
     print(f"WARNING: unparseable date found: {perf_date_str}")
-    return 1900
+    return 0, 1900
 
 
-def process_one_athlete_results_table(example_perf, rows, perf_list):
+def process_one_athlete_results_table(gender, athlete_name, athlete_url, rows, perf_list):
     """Go through table of performances for a single athlete, especially intended
     to pick out age grades"""
     
     heading_row = rows.pop(0)
-    cells = get_html_content(heading_row.inner_text, 'td')
+    cells = get_row_cells(heading_row)
     heading_idx = {}
     for i, cell in enumerate(cells):
         heading = debold(cell.inner_text)
@@ -880,7 +1864,7 @@ def process_one_athlete_results_table(example_perf, rows, perf_list):
             return
         
     for row in rows:
-        cells = get_html_content(row.inner_text, 'td')
+        cells = get_row_cells(row)
         event = cells[heading_idx['Event']].inner_text
         if event not in wava_events:
             continue
@@ -898,8 +1882,8 @@ def process_one_athlete_results_table(example_perf, rows, perf_list):
         age_str = cells[heading_idx['Age']].inner_text.strip()
         age = 0 if not age_str else int(age_str)
         source = 'Po10'
-        perf = construct_performance(event, example_perf.gender, 'ALL', performance, 
-                                     example_perf.athlete_name, example_perf.athlete_url,
+        perf = construct_performance(event, gender, 'ALL', performance, 
+                                     athlete_name, athlete_url,
                                      date, fixture_name, fixture_url, source, age_grade=age_grade, age=age)
         perf_list.append(perf)
 
@@ -910,7 +1894,7 @@ def process_one_rankings_table(rows, gender, category, source, perf_list, types)
     while True:
         if row_idx >= len(rows): return
         
-        cells = get_html_content(rows[row_idx].inner_text, 'td')
+        cells = get_row_cells(rows[row_idx])
 
         if state == "seeking_title":
             if 'class' not in rows[row_idx].attribs or rows[row_idx].attribs['class'] != 'rankinglisttitle':
@@ -927,6 +1911,10 @@ def process_one_rankings_table(rows, gender, category, source, perf_list, types)
                 for i, cell in enumerate(cells):
                     heading = debold(cell.inner_text)
                     heading_idx[heading] = i
+                # Unheaded column after name gives age group, e.g. U17, blank for senior
+                age_group_idx = heading_idx['Name'] + 1
+                if age_group_idx >= len(cells) or debold(cells[age_group_idx].inner_text).strip():
+                    age_group_idx = None
                 state = "seeking_results"
         elif state == "seeking_results":
             if 'class' not in rows[row_idx].attribs or not rows[row_idx].attribs['class'].startswith('rlr'):
@@ -943,7 +1931,11 @@ def process_one_rankings_table(rows, gender, category, source, perf_list, types)
                     anchor = get_html_content(venue_link.inner_text, 'a')
                     fixture_name = anchor[0].inner_text
                     fixture_url = powerof10_root_url + anchor[0].attribs["href"]
-                    perf = construct_performance(event, gender, category, performance, name, url, date, fixture_name, fixture_url, source)
+                    age_group = ''
+                    if age_group_idx is not None and age_group_idx < len(cells):
+                        age_group = cells[age_group_idx].inner_text.strip() or 'SEN'
+                    perf = construct_performance(event, gender, category, performance, name, url, date, fixture_name, fixture_url, source,
+                                                 age_group=age_group)
                     perf_list.append(perf)
         else:
             # unknown state
@@ -951,12 +1943,10 @@ def process_one_rankings_table(rows, gender, category, source, perf_list, types)
         row_idx += 1
 
 
-def process_one_po10_year_gender(club_id, year, gender, category, performance_cache,
-                                  rebuild_cache, first_claim_only, types, do_agm):
-    """Process gender/age category rankings from powerof10 for specified year
-       for ALL events in one go (returned page has table per event, different
-       from runbritain)"""
-    
+def make_po10_query(club_id, year, gender, category, first_claim_only, rebuild_cache):
+    """Request for powerof10 rankings for a gender/age category and year, for ALL
+       events in one go (returned page has table per event, different from runbritain)"""
+
     request_params = {'clubid'         : str(club_id),
                       'agegroups'      : category,
                       'sex'            : gender,
@@ -965,55 +1955,80 @@ def process_one_po10_year_gender(club_id, year, gender, category, performance_ca
                       'limits'         : 'n'} # y faster for debug but don't want to miss rarely performed events so 'n' for completeness
 
     url = powerof10_root_url + '/rankings/rankinglists.aspx'
-    cache_key = make_cache_key(url, request_params)
-    if rebuild_cache:
-        perf_list = None
-    else:
-        perf_list = performance_cache.get(cache_key, None)
-
     report_string_base = f'PowerOf10 club {club_id} year {year} gender {gender} category {category} '
-    if perf_list is None:
-        perf_list = []
-        try:
-            page_response = requests.get(url, request_params)
-        except requests.exceptions.ConnectionError:
-            print(report_string_base + ' ConnectionError')
-            return
+    context = {'year'     : year,
+               'gender'   : gender,
+               'category' : category}
+    return WebQuery('po10_rankings', url, request_params, report_string_base, context, rebuild_cache)
 
-        print(report_string_base + f'page return status {page_response.status_code}')
 
-        if page_response.status_code != 200:
-            print(f'HTTP error code fetching page: {page_response.status_code}')
-            return
+def parse_po10_rankings_page(input_text, types, year, gender, category):
+    """Extract performances from powerof10 rankings page"""
 
-        input_text = page_response.text
-        source = f'Po10 {year}'
+    perf_list = []
+    source = f'Po10 {year}'
 
-        tables = get_html_content(input_text, 'table')
-        second_level_tables = []
-        for table in tables:
-            nested_tables = get_html_content(table.inner_text, 'table')
-            second_level_tables.extend(nested_tables)
-        
-        for table in second_level_tables: # table of interest always a child table?
-            rows = get_html_content(table.inner_text, 'tr')
-            if len(rows) < 3:
-                continue
-            if 'class' not in rows[0].attribs or rows[0].attribs['class'] != 'rankinglisttitle':
-                continue
-            if 'class' not in rows[1].attribs or rows[1].attribs['class'] != 'rankinglistheadings':
-                continue
-            # Looks like we've found the table of results
-            process_one_rankings_table(rows, gender, category, source, perf_list, types)
+    page = parse_html(input_text, html_table_tags)
+    for table in page.find_all('table'): # usually a child table, but may be at any depth
+        rows = get_table_rows(table)
+        if len(rows) < 3:
+            continue
+        if 'class' not in rows[0].attribs or rows[0].attribs['class'] != 'rankinglisttitle':
+            continue
+        if 'class' not in rows[1].attribs or rows[1].attribs['class'] != 'rankinglistheadings':
+            continue
+        # Looks like we've found the table of results
+        process_one_rankings_table(rows, gender, category, source, perf_list, types)
 
-        performance_cache[cache_key] = perf_list
-    else:
-        print(report_string_base + f'{len(perf_list)} performances from cache')
+    return perf_list
 
+
+def process_one_po10_year_gender(query, performance_cache, types, do_agm):
+    """Process gender/age category rankings from powerof10 for specified year"""
+
+    perf_list = get_query_performances(query, performance_cache, types)
+    if perf_list is None:
+        return
+
+    score_ea_pb_performance_list(perf_list)
     for perf in perf_list:
-        process_perf_for_cats_and_ea_pb(perf, types, year, do_agm)
+        process_perf_for_cats_and_ea_pb(perf, types, query.context['year'], do_agm)
         performance_count['Po10'] += 1
 
+    if po10_mode == 'coalesced' and query.context['category'] == 'ALL':
+        process_po10_junior_age_groups(query, perf_list, performance_cache, types, do_agm)
+
+
+def process_po10_junior_age_groups(query, perf_list, performance_cache, types, do_agm):
+    """Junior age group rankings found from age group column of ALL rankings, in
+    the order they would have been fetched separately; only fetched separately if
+    that column is missing (e.g. cached before it was kept)"""
+
+    if any(not perf.age_group for perf in perf_list):
+        print(query.report_string_base + 'has no age groups, fetching junior age groups separately')
+        for category in powerof10_categories:
+            if category == 'ALL':
+                continue
+            age_group_query = make_po10_query(query.request_params['clubid'], query.context['year'], query.context['gender'],
+                                              category, query.request_params['firstclaimonly'] == 'y', query.rebuild_cache)
+            process_crawl_query(age_group_query, performance_cache, types, False, False, do_agm)
+        return
+
+    for category in powerof10_categories:
+        if category == 'ALL':
+            continue
+        age_group_perfs = []
+        for perf in perf_list:
+            if perf.age_group != category:
+                continue
+            age_group_perf = copy.copy(perf)
+            age_group_perf.category = category
+            age_group_perfs.append(age_group_perf)
+        score_ea_pb_performances(age_group_perfs)
+        for age_group_perf in age_group_perfs:
+            process_perf_for_cats_and_ea_pb(age_group_perf, types, query.context['year'], do_agm)
+            performance_count['Po10'] += 1
+
 
 def make_cache_key(url, request_params):
     """Make unique string for web request to use as dict key for cache of previous
@@ -1025,10 +2040,8 @@ def make_cache_key(url, request_params):
     return cache_key
 
 
-def process_one_runbritain_year_gender(club_id, year, gender, category, event, performance_cache,
-                                        rebuild_cache, first_claim_only, types, do_wava, rebuild_wava,
-                                        do_agm):
-    """Get rankings for a single event, age group, gender etc from runbritain; this is
+def make_runbritain_query(club_id, year, gender, category, event, first_claim_only, rebuild_cache):
+    """Request for runbritain rankings for a single event, age group, gender etc; this is
     where such detailed rankings tables are fetched from when requested from powerof10."""
 
     request_params = {'clubid'         : str(club_id),
@@ -1050,68 +2063,704 @@ def process_one_runbritain_year_gender(club_id, year, gender, category, event, p
         request_params['agemax'] = str(max_age)
 
     url = runbritain_root_url + '/rankings/rankinglist.aspx'
-    cache_key = make_cache_key(url, request_params)
-
-    if rebuild_cache:
-        perf_list = None
-    else:
-        perf_list = performance_cache.get(cache_key, None)
-
     report_string_base = f'Runbritain club {club_id} year {year} gender {gender} category {category} event {event} '
-
-    if perf_list is None:
-        perf_list = []
+    context = {'year'     : year,
+               'gender'   : gender,
+               'category' : category,
+               'event'    : event}
+    return WebQuery('runbritain_rankings', url, request_params, report_string_base, context, rebuild_cache)
+
+
+# Javascript array of arrays of literal values like the runbritain 'runners' array, e.g.
+#   [['1', '75:57', '', '<a href=\"/runners/profile.aspx?athleteid=69655\">Name</a>', ...], ...]
+# matched one whole row at a time, then values picked out of the row
+js_value_pattern = r"""'(?:[^'\\]|\\.)*'|"(?:[^"\\]|\\.)*"|[^\s,\[\]'"]+"""
+js_array_start_regex = re.compile(r'\s*\[')
+js_array_row_regex = re.compile(r'\s*\[((?:\s*(?:' + js_value_pattern + r')\s*,)*\s*(?:' + js_value_pattern + r')?\s*)\]', flags=re.DOTALL)
+js_array_separator_regex = re.compile(r'\s*([,\]])')
+js_value_regex = re.compile(r"""('(?:[^'\\]|\\.)*')|("(?:[^"\\]|\\.)*")|([^\s,\[\]'"]+)""", flags=re.DOTALL)
+js_escape_regex = re.compile(r'\\(.)', flags=re.DOTALL)
+js_escapes = {'n' : '\n', 't' : '\t', 'r' : '\r'}
+js_bare_values = {'null' : None, 'true' : True, 'false' : False}
+
+def js_value(single_quoted, double_quoted, bare):
+    """Python value from Javascript literal, only strings, numbers, null, true, false"""
+
+    if bare:
+        if bare in js_bare_values:
+            return js_bare_values[bare]
         try:
-            page_response = requests.get(url, request_params)
-        except requests.exceptions.ConnectionError:
-            print(report_string_base + ' ConnectionError')
+            return int(bare)
+        except ValueError:
+            return float(bare) # ValueError if not a number either
+    quoted_body = (single_quoted or double_quoted)[1:-1]
+    # Newlines in strings become spaces as array text used to have them replaced before eval()
+    quoted_body = quoted_body.replace('\n', ' ').replace('\r', '')
+    if '\\' not in quoted_body:
+        return quoted_body
+    return js_escape_regex.sub(lambda match: js_escapes.get(match.group(1), match.group(1)), quoted_body)
+
+
+def iter_js_array_rows(text, pos=0):
+    """Yield rows of Javascript array of arrays of literal values starting at text[pos],
+    one tuple per row as parsed, without evaluating anything"""
+
+    match = js_array_start_regex.match(text, pos)
+    if match is None:
+        raise ValueError(f'Javascript array does not start with [ at position {pos}')
+    pos = match.end()
+    while True:
+        row_match = js_array_row_regex.match(text, pos)
+        if row_match is not None:
+            yield tuple(js_value(*value) for value in js_value_regex.findall(row_match.group(1)))
+            pos = row_match.end()
+        separator_match = js_array_separator_regex.match(text, pos)
+        if separator_match is None:
+            raise ValueError(f'Unexpected text in Javascript array at position {pos}: {text[pos : pos + 30]!r}')
+        pos = separator_match.end()
+        if separator_match.group(1) == ']':
             return
+        if row_match is None:
+            raise ValueError(f'Expected row of Javascript array at position {pos}')
+
+
+# Same array with only single quoted strings (no unescaped " in them) and bare values,
+# as runbritain gives, can be turned into JSON by swapping quotes
+js_single_quoted_pattern = r"""'[^'"\\]*(?:\\.[^'"\\]*)*'"""
+js_json_value_pattern = r"""(?:""" + js_single_quoted_pattern + r"""|[^\s,\[\]'"]+)"""
+js_json_row_pattern = r'\[\s*(?:' + js_json_value_pattern + r'(?:\s*,\s*' + js_json_value_pattern + r')*)?\s*,?\s*\]'
+js_json_array_regex = re.compile(r'\s*\[\s*(?:' + js_json_row_pattern + r'(?:\s*,\s*' + js_json_row_pattern + r')*)?\s*,?\s*\]',
+                                 flags=re.DOTALL)
+
+def js_array_rows(text, pos=0):
+    """List of rows of Javascript array of arrays of literal values starting at
+    text[pos], one tuple per row; decoded as JSON when it can be, which is quicker
+    than eval(), else parsed a row at a time by iter_js_array_rows()"""
+
+    match = js_json_array_regex.match(text, pos)
+    if match is not None:
+        # Newlines in strings become spaces as array text used to have them replaced before eval()
+        array_text = match.group(0).replace('\n', ' ').replace('\r', '')
+        # Escaped backslashes first, so any \' left is an escaped quote; other quotes delimit strings
+        array_text = array_text.replace('\\\\', '\\u005c').replace("\\'", '\\u0027').replace("'", '"')
+        try:
+            return [tuple(row) for row in json.loads(array_text, strict=False)]
+        except ValueError:
+            pass # e.g. escapes or numbers JSON lacks, like \x41 or 010
+    return list(iter_js_array_rows(text, pos))
 
-        print(report_string_base + f'page return status {page_response.status_code}')
 
-        if page_response.status_code != 200:
-            print(f'HTTP error code fetching page: {page_response.status_code}')
-            return
+runbritain_array_regex = re.compile(r'runners =\s*(?=\[)')
 
-        input_text = page_response.text
-        results_array_regex = re.compile(r'runners =\s*(\[.*?\]);', flags=re.DOTALL)
-        array_match = results_array_regex.search(input_text)
+def parse_runbritain_page(input_text, types, year, gender, category, event):
+    """Extract performances from the Javascript array of results in runbritain
+    rankings page"""
 
-        if array_match is None:
-            print('No data found')
-        else:
-            source = f'Runbritain {year}'
-            array_str = array_match.group(1)
-            array_str = array_str.replace('\n', ' ').replace('\r', '')
-            results_array = eval(array_str)
-            for result in results_array:
-                if not result[6] : continue # No name, could be second performance by same person
-                anchor = get_html_content(result[6], 'a')
-                name = anchor[0].inner_text
-                url = runbritain_root_url + anchor[0].attribs["href"]
-                perf = result[1] # Chip time
-                if not perf:
-                    perf = result[3] # Gun time
-                date = result[10]
-                venue_link = result[9]
-                anchor = get_html_content(venue_link, 'a')
-                fixture_name = anchor[0].inner_text
-                fixture_url = runbritain_root_url + anchor[0].attribs["href"]
-                perf = construct_performance(event, gender, category, perf, name, url, date, fixture_name, fixture_url, source)
-                perf_list.append(perf)
-
-        performance_cache[cache_key] = perf_list
+    perf_list = []
+    array_match = runbritain_array_regex.search(input_text)
+
+    if array_match is None:
+        print('No data found')
     else:
-        print(report_string_base + f'{len(perf_list)} performances from cache')
+        source = f'Runbritain {year}'
+        for result in js_array_rows(input_text, array_match.end()):
+            if not result[6] : continue # No name, could be second performance by same person
+            anchor = get_html_content(result[6], 'a')
+            name = anchor[0].inner_text
+            url = runbritain_root_url + anchor[0].attribs["href"]
+            perf = result[1] # Chip time
+            if not perf:
+                perf = result[3] # Gun time
+            date = result[10]
+            venue_link = result[9]
+            anchor = get_html_content(venue_link, 'a')
+            fixture_name = anchor[0].inner_text
+            fixture_url = runbritain_root_url + anchor[0].attribs["href"]
+            perf = construct_performance(event, gender, category, perf, name, url, date, fixture_name, fixture_url, source,
+                                         age_group=result[7])
+            perf_list.append(perf)
+
+    return perf_list
+
+
+def process_one_runbritain_year_gender(query, performance_cache, types, do_wava, rebuild_wava, do_agm):
+    """Process rankings for a single event, age group, gender etc from runbritain"""
+
+    perf_list = get_query_performances(query, performance_cache, types)
+    if perf_list is None:
+        return
     
+    category = query.context['category']
+    # Coalesced ALL list may be fetched just for age groups
+    all_relevant = category != 'ALL' or event_relevant_to_category(query.context['event'], query.context['gender'], 'ALL')
+    age_group_perfs = {} # age group to performances, if finding them from coalesced ALL list
+    if all_relevant:
+        score_ea_pb_performance_list(perf_list)
     for perf in perf_list:
-        process_perf_for_cats_and_ea_pb(perf, types, year, do_agm)
-        performance_count['Runbritain'] += 1
+        if all_relevant:
+            process_perf_for_cats_and_ea_pb(perf, types, query.context['year'], do_agm)
+            performance_count['Runbritain'] += 1
+        if category == 'ALL' and runbritain_mode == 'coalesced':
+            age_group = get_coalesced_category(perf)
+            if age_group:
+                age_group_perfs.setdefault(age_group, []).append(perf)
+        elif runbritain_mode == 'verify':
+            note_runbritain_verification(query, perf)
         if do_wava and perf.event in wava_events:
             # Done in runbritain processing because po10 overall (all events)
             # rankings by year don't reliably include 5K
-            process_po10_wava(perf, performance_cache, types, rebuild_wava, do_agm)
+            if wava_source == 'local':
+                process_local_wava(perf, types, do_agm)
+            else:
+                process_po10_wava(perf, performance_cache, types, rebuild_wava, do_agm)
+
+    # Same order as if each age group had been fetched separately, as ties in
+    # record tables can depend on order
+    for (age_group, _, _) in runbritain_categories:
+        age_group_copies = []
+        for perf in age_group_perfs.get(age_group, []):
+            age_group_perf = copy.copy(perf)
+            age_group_perf.category = age_group
+            age_group_copies.append(age_group_perf)
+        score_ea_pb_performances(age_group_copies)
+        for age_group_perf in age_group_copies:
+            process_perf_for_cats_and_ea_pb(age_group_perf, types, query.context['year'], do_agm)
+            performance_count['Runbritain'] += 1
+
+
+def get_coalesced_category(perf):
+    """Runbritain age group that performance from ALL list would have been found in
+    by age group query, or None"""
+
+    age_group = perf.age_group
+    if age_group == 'ALL' or age_group not in runbritain_category_lookup:
+        return None
+    if not event_relevant_to_category(perf.event, perf.gender, age_group):
+        return None
+    return age_group
+
+
+def note_runbritain_verification(query, perf):
+    """Note performance found by age group query, or where ALL list would put it,
+    so they can be compared at the end"""
+
+    if query.context['category'] == 'ALL':
+        category = get_coalesced_category(perf)
+        if not category:
+            return
+        which = 'coalesced'
+    else:
+        category = query.context['category']
+        which = 'age group'
+    key = (query.context['year'], query.context['gender'], query.context['event'], category)
+    perf_key = (perf.athlete_key, perf.score, perf.date_ordinal)
+    runbritain_verify_perfs.setdefault(key, {'coalesced' : {}, 'age group' : {}})[which][perf_key] = perf
+
+
+def report_runbritain_verification(max_examples=10):
+    mismatches = []
+    for key, found in runbritain_verify_perfs.items():
+        for which, other in [('coalesced', 'age group'), ('age group', 'coalesced')]:
+            for perf_key, perf in found[which].items():
+                if perf_key not in found[other]:
+                    mismatches.append(f'{key[0]} {key[1]} {key[3]} {perf.event} {perf.athlete_name} {perf.date} '
+                                      f'only in {which} results (age group in ALL list: {perf.age_group or "none"})')
+    print(f'Runbritain coalesced v. age group queries: {len(runbritain_verify_perfs)} age group lists, '
+          f'{len(mismatches)} performances differ')
+    for mismatch in mismatches[:max_examples]:
+        print(f'  {mismatch}')
+
+
+query_parsers = {'po10_rankings'       : parse_po10_rankings_page,
+                 'runbritain_rankings' : parse_runbritain_page,
+                 'po10_wava'           : parse_po10_wava_page}
+
+
+class RequestBudgetSpent(Exception):
+    """Raised when we would go over the --max-requests number of pages fetched"""
+    pass
+
+
+def count_page_request():
+    global pages_requested
+    with fetch_stats_lock:
+        if max_requests and pages_requested >= max_requests:
+            raise RequestBudgetSpent()
+        pages_requested += 1
+
+
+def note_fetch_latency(url, elapsed_sec):
+    host = urllib.parse.urlsplit(url).netloc
+    with fetch_stats_lock:
+        latency = fetch_latency.setdefault(host, [0, 0.0])
+        latency[0] += 1
+        latency[1] += elapsed_sec
+
+
+def fetch_query(query, types, cached_perf_list=None):
+    """Fetch and parse one page, returning list of performances or None if failed.
+    If we have cached performances for it, they are returned as they are if the
+    server says the page hasn't changed, or it's identical anyway. Validators to
+    spot that next time are left in query, to keep with cache in main thread."""
+
+    if not fetch_offline:
+        count_page_request()
+    validators = page_validators.get(query.cache_key) if cached_perf_list is not None else None
+    # Can't be told it's unchanged if the raw page store needs a copy of it
+    request_validators = validators if not raw_page_store or query.cache_key in raw_page_store.index else None
+    start_time = time.time()
+    page_response = fetch_page(query.url, query.request_params, query.report_string_base, request_validators)
+    if page_response is None:
+        return None
+    note_fetch_latency(query.url, time.time() - start_time)
+
+    if page_response.status_code == 304:
+        count_fetch_stat('Unchanged')
+        query.validators = validators
+        return cached_perf_list
+    # Servers that ignore conditional requests may still send the same page again
+    page_hash = hashlib.sha256(page_response.text.encode('utf-8')).hexdigest()
+    new_validators = {'etag'          : page_response.headers.get('ETag'),
+                      'last_modified' : page_response.headers.get('Last-Modified'),
+                      'hash'          : page_hash}
+    if validators and validators['hash'] == page_hash:
+        count_fetch_stat('Unchanged')
+        if raw_page_store:
+            raw_page_store.save_page(query, page_response.text)
+        query.validators = new_validators
+        return cached_perf_list
+    count_fetch_stat('New' if cached_perf_list is None else 'Changed')
+
+    if raw_page_store:
+        raw_page_store.save_page(query, page_response.text)
+
+    parser = query_parsers[query.kind]
+    perf_list = parser(page_response.text, types, **query.context)
+    query.validators = new_validators
+    return perf_list
+
+
+def reparse_raw_pages(performance_cache, types):
+    """Rebuild cached performances by parsing raw pages again, without using the network"""
+
+    reparsed_count = 0
+    for cache_key, entry in raw_page_store.index.items():
+        parser = query_parsers.get(entry['kind'])
+        if parser is None:
+            # E.g. club page, not performances
+            continue
+        page_text = raw_page_store.load_page(cache_key)
+        performance_cache[cache_key] = parser(page_text, types, **entry['context'])
+        cache_keys_refreshed[cache_key] = True
+        reparsed_count += 1
+    print(f'Reparsed {reparsed_count} raw pages from store')
+
+
+def get_http_session(host):
+    """Get session for this site and thread, so connection kept alive between requests"""
+
+    sessions = getattr(http_sessions, 'by_host', None)
+    if sessions is None:
+        sessions = {}
+        http_sessions.by_host = sessions
+    session = sessions.get(host)
+    if session is None:
+        session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=1)
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        sessions[host] = session
+    return session
+
+
+def count_fetch_stat(stat_name):
+    with fetch_stats_lock:
+        fetch_stats[stat_name] += 1
+
+
+def fetch_page(url, request_params, report_string_base, validators=None):
+    """Get web page, reusing connection to same site, and retrying with exponential
+    backoff if connection fails or server has an error (5xx). Returns None if
+    we couldn't get the page. If validators from previous fetch are given, asks
+    server to reply 304 with no page if it hasn't changed since."""
+
+    if fetch_offline:
+        print(report_string_base + 'not fetched, working offline')
+        return None
+
+    headers = {}
+    if validators and validators['etag']:
+        headers['If-None-Match'] = validators['etag']
+    if validators and validators['last_modified']:
+        headers['If-Modified-Since'] = validators['last_modified']
+    session = get_http_session(urllib.parse.urlsplit(url).netloc)
+    for attempt in range(fetch_max_retries + 1):
+        if attempt > 0:
+            delay = fetch_backoff_sec * (2 ** (attempt - 1))
+            print(report_string_base + f'retry {attempt} of {fetch_max_retries} in {delay:.1f}s')
+            count_fetch_stat('Retries')
+            time.sleep(delay)
+        count_fetch_stat('Requests')
+        try:
+            page_response = session.get(url, params=request_params, headers=headers, timeout=fetch_timeout_sec)
+        except (requests.exceptions.ConnectionError, requests.exceptions.Timeout,
+                requests.exceptions.ChunkedEncodingError) as e:
+            print(report_string_base + f' {e.__class__.__name__}')
+            continue
+
+        print(report_string_base + f'page return status {page_response.status_code}')
+
+        if page_response.status_code >= 500:
+            # Server having a bad moment, worth trying again
+            continue
+        if page_response.status_code not in [200, 304]:
+            print(f'HTTP error code fetching page: {page_response.status_code}')
+            count_fetch_stat('Failures')
+            return None
+        return page_response
+
+    print(report_string_base + f'FAILED after {fetch_max_retries + 1} attempts')
+    count_fetch_stat('Failures')
+    return None
+
+
+def query_stale(query):
+    """True if any cached result for this query should be fetched again, because we've
+    been told to or because it's older than allowed for the year it's for; recent
+    years' results change as new ones come in, older years' hardly ever"""
+
+    if query.cache_key in cache_keys_refreshed:
+        return False
+    if query.rebuild_cache:
+        return True
+    if query.data_year is None or not freshness_ttl_days:
+        return False
+    years_ago = max(0, datetime.date.today().year - query.data_year)
+    ttl_days = freshness_ttl_days[min(years_ago, len(freshness_ttl_days) - 1)]
+    fetch_time = fetch_times.get(query.cache_key, cache_file_time)
+    return fetch_time is not None and time.time() - fetch_time > ttl_days * 24 * 3600
+
 
+def get_query_performances(query, performance_cache, types):
+    """Get list of performances for this query from cache if we can, or from
+    the web if we have to; returns None if we failed to get them at all"""
+
+    cached_perf_list = performance_cache.get(query.cache_key, None)
+    if query_stale(query):
+        perf_list = None
+    else:
+        perf_list = cached_perf_list
+
+    if perf_list is None:
+        perf_list = fetch_query(query, types, cached_perf_list)
+        if perf_list is None:
+            # Better to use old results than none at all
+            perf_list = cached_perf_list
+            if perf_list is not None:
+                print(query.report_string_base + f'using {len(perf_list)} old performances from cache')
+                resolve_athlete_keys(perf_list)
+            return perf_list
+        if perf_list is not cached_perf_list:
+            performance_cache[query.cache_key] = perf_list
+        cache_keys_refreshed[query.cache_key] = True
+        fetch_times[query.cache_key] = time.time()
+        page_validators[query.cache_key] = query.validators
+        note_cache_updated(performance_cache)
+    elif query.kind != 'po10_wava':
+        print(query.report_string_base + f'{len(perf_list)} performances from cache')
+
+    note_query_yield(query, perf_list)
+    resolve_athlete_keys(perf_list)
+    return perf_list
+
+
+def note_query_yield(query, perf_list):
+    """Keep number of performances found for rankings request, to prune requests that keep finding none"""
+    if query.yield_key:
+        query_yields.setdefault(query.yield_key, {})[int(query.request_params['year'])] = len(perf_list)
+
+
+def fetch_query_host_limited(query, types, max_per_host, cached_perf_list):
+    """Fetch one page from worker thread, but only allowing so many concurrent
+    requests to the same site"""
+
+    host = urllib.parse.urlsplit(query.url).netloc
+    with host_semaphores_lock:
+        if host not in host_semaphores:
+            host_semaphores[host] = threading.BoundedSemaphore(max_per_host)
+        semaphore = host_semaphores[host]
+    with semaphore:
+        return fetch_query(query, types, cached_perf_list)
+
+
+def prefetch_queries(queries, performance_cache, types, fetch_threads, max_per_host):
+    """Fetch in parallel any pages that the (serial) processing would otherwise have
+    to fetch one at a time. Results go into the cache, so processing order and the
+    output are exactly as they would be without this."""
+
+    queries_to_fetch = []
+    cache_keys_seen = {}
+    for query in queries:
+        if query.cache_key in cache_keys_seen or query.cache_key in cache_keys_refreshed:
+            continue
+        cache_keys_seen[query.cache_key] = True
+        if not query_stale(query) and query.cache_key in performance_cache:
+            continue
+        queries_to_fetch.append((query, performance_cache.get(query.cache_key, None)))
+
+    if not queries_to_fetch:
+        return
+
+    print(f'Fetching {len(queries_to_fetch)} pages with {fetch_threads} threads, max {max_per_host} per site')
+    with concurrent.futures.ThreadPoolExecutor(max_workers=fetch_threads) as executor:
+        future_queries = {}
+        for query, cached_perf_list in queries_to_fetch:
+            future = executor.submit(fetch_query_host_limited, query, types, max_per_host, cached_perf_list)
+            future_queries[future] = (query, cached_perf_list)
+        budget_spent = False
+        try:
+            for future in concurrent.futures.as_completed(future_queries):
+                try:
+                    perf_list = future.result()
+                except RequestBudgetSpent:
+                    # Still keep pages other threads have got
+                    budget_spent = True
+                    continue
+                if perf_list is None:
+                    # Failed, will get another go when processed
+                    continue
+                query, cached_perf_list = future_queries[future]
+                if perf_list is not cached_perf_list:
+                    performance_cache[query.cache_key] = perf_list
+                # Known for lists processed before this one, as if it had been cached
+                note_athlete_ids(perf_list)
+                cache_keys_refreshed[query.cache_key] = True
+                fetch_times[query.cache_key] = time.time()
+                page_validators[query.cache_key] = query.validators
+                note_cache_updated(performance_cache)
+        except KeyboardInterrupt:
+            # Only wait for fetches under way, not all those queued, before checkpoint
+            executor.shutdown(wait=True, cancel_futures=True)
+            raise
+    if budget_spent:
+        raise RequestBudgetSpent()
+
+
+def make_crawl_queries(club_id, first_year, last_year, do_po10, do_runbritain, first_claim_only,
+                       types, rebuild_final_year, rebuild_prefinal_year):
+    """List all the Po10 and runbritain rankings requests for the whole run, in the
+    order that they should be processed"""
+
+    queries = []
+    for year in range(first_year, last_year + 1):
+        # E.g. to rebuild in Jan 2024 want last results from 2023 so year before too,
+        # but later in year it's safe to only rebuild 2024
+        rebuild_cache = ((rebuild_final_year    and (year == last_year    )) or
+                         (rebuild_prefinal_year and (year == last_year - 1))   )
+        for gender in ['W', 'M']:
+            if do_po10:
+                # Coalesced: juniors found from ALL rankings
+                for category in (['ALL'] if po10_mode == 'coalesced' else powerof10_categories):
+                    queries.append(make_po10_query(club_id, year, gender, category,
+                                                   first_claim_only, rebuild_cache))
+            if do_runbritain:
+                for (event, _, _, runbritain, type, categories) in known_events: # debug [('Mar', True, 3, True, 'R')]:
+                    if not runbritain: continue
+                    if type not in types: continue
+                    categories = [category for (category, _, _) in runbritain_categories # debug [('ALL', 0, 0), ('V50', 50, 54)]
+                                  if event_relevant_to_category(event, gender, category)]
+                    if runbritain_mode == 'coalesced' and categories:
+                        # Age groups taken from ALL list instead
+                        categories = ['ALL']
+                    elif runbritain_mode == 'verify' and categories and 'ALL' not in categories:
+                        # ALL list still needed to compare age groups with, but not used for records
+                        categories = ['ALL'] + categories
+                    for category in categories:
+                        queries.append(make_runbritain_query(club_id, year, gender, category, event,
+                                                             first_claim_only, rebuild_cache))
+    return queries
+
+
+def refetch_lists_without_age_groups(crawl_queries, performance_cache):
+    """Coalesced runbritain ALL lists cached before age groups were kept from the
+    rows can't be split into age groups, so have to be fetched again"""
+
+    refetch_count = 0
+    for query in crawl_queries:
+        if query.kind != 'runbritain_rankings' or query.context['category'] != 'ALL' or query.rebuild_cache:
+            continue
+        perf_list = performance_cache.get(query.cache_key, None)
+        if perf_list and not any(perf.age_group for perf in perf_list):
+            query.rebuild_cache = True
+            refetch_count += 1
+    if refetch_count:
+        print(f'{refetch_count} cached runbritain lists have no age groups, fetching again')
+
+
+def prefetch_crawl_queries(crawl_queries, performance_cache, types, fetch_threads, max_per_host):
+    """Prefetch rankings lists, skipping those that processing will prune. Pruning
+    a year depends on the years before it, and an age group on its ALL list, so if
+    pruning this goes a year at a time, ALL lists first, noting what each wave
+    found as processing would; otherwise it would fetch pages that processing
+    then uses instead of pruning, and the output would depend on --fetch-threads."""
+
+    if prune_empty_years <= 0:
+        prefetch_queries(crawl_queries, performance_cache, types, fetch_threads, max_per_host)
+        return
+    waves = {}
+    for query in crawl_queries:
+        wave_key = (int(query.request_params.get('year', 0)), query.context.get('category') != 'ALL')
+        waves.setdefault(wave_key, []).append(query)
+    for wave_key in sorted(waves):
+        wave_queries = []
+        for query in waves[wave_key]:
+            if query_pruned(query, performance_cache):
+                note_query_pruned(query)
+            else:
+                wave_queries.append(query)
+        prefetch_queries(wave_queries, performance_cache, types, fetch_threads, max_per_host)
+        for query in wave_queries:
+            # Yields of lists not fetched since they were last read are kept with cache
+            if query.yield_key and (query.cache_key in cache_keys_refreshed or
+                                    int(query.request_params['year']) not in query_yields.get(query.yield_key, {})):
+                perf_list = performance_cache.get(query.cache_key, None)
+                if perf_list is not None:
+                    note_query_yield(query, perf_list)
+
+
+def query_pruned(query, performance_cache):
+    """True to skip this request as the same request has given no results for the
+    last few years it was made, e.g. V85 steeplechase. Never for the current year,
+    whose results are still coming in, or if we have anything cached for it, which
+    is used or fetched again as usual. Skipped years are noted in the yields, and
+    once as many years running have been skipped as it takes to prune, the request
+    is made again in case that has changed. Checked as we go, so a crawl of many
+    years learns from the earlier ones."""
+
+    if prune_empty_years <= 0 or not query.yield_key:
+        return False
+    year = int(query.request_params['year'])
+    if year >= datetime.date.today().year:
+        return False
+    years = query_yields.get(query.yield_key)
+    if not years:
+        return False
+    previous_counts = [years[y] for y in sorted((y for y in years if y < year), reverse=True)]
+    skipped_count = 0 # years running most recently skipped
+    while skipped_count < len(previous_counts) and previous_counts[skipped_count] is None:
+        skipped_count += 1
+    if skipped_count >= prune_empty_years:
+        return False
+    known_counts = [count for count in previous_counts if count is not None][:prune_empty_years]
+    if len(known_counts) < prune_empty_years or any(known_counts):
+        return False
+    if query.context['category'] != 'ALL':
+        # Someone may have just moved into this age group, which we can see if we
+        # already have the ALL list; none to look at for age group only events
+        all_ages_query = make_all_ages_query(query)
+        all_ages_perfs = performance_cache.get(all_ages_query.cache_key, None) or []
+        if any(perf.age_group == query.context['category'] for perf in all_ages_perfs):
+            return False
+    return performance_cache.get(query.cache_key, None) is None
+
+
+def note_query_pruned(query):
+    """Keep that this request was skipped for its year (None, as number of
+    performances not known), so pruning can tell when to try it again"""
+    query_yields.setdefault(query.yield_key, {}).setdefault(int(query.request_params['year']), None)
+
+
+def make_all_ages_query(query):
+    """Same request as this one, but for ALL age groups"""
+
+    club_id = query.request_params['clubid']
+    first_claim_only = query.request_params['firstclaimonly'] == 'y'
+    if query.kind == 'po10_rankings':
+        return make_po10_query(club_id, query.context['year'], query.context['gender'], 'ALL', first_claim_only, False)
+    return make_runbritain_query(club_id, query.context['year'], query.context['gender'], 'ALL', query.context['event'],
+                                 first_claim_only, False)
+
+
+def plan_crawl(crawl_queries, performance_cache, do_wava, rebuild_wava, fetch_threads, max_per_host, default_latency_sec=1.0):
+    """Report what requests a run would make without making any: each is a cache
+    hit, stale (cached but to be fetched again), a miss, or pruned as far as we
+    can tell before starting. Age grade profile requests can only be listed for
+    runbritain results already cached."""
+
+    queries = list(crawl_queries)
+    if do_wava:
+        queries.extend(make_wava_queries(crawl_queries, performance_cache, rebuild_wava))
+    plan_counts = {} # kind to dict of classification to count
+    host_fetches = {} # host to number of pages to fetch
+    cache_keys_seen = {}
+    for query in queries:
+        if query.cache_key in cache_keys_seen:
+            continue
+        cache_keys_seen[query.cache_key] = True
+        if query_pruned(query, performance_cache):
+            classification = 'pruned'
+        elif query.cache_key in cache_keys_refreshed:
+            classification = 'hit' # fetched by interrupted run we're resuming
+        elif performance_cache.get(query.cache_key, None) is None:
+            classification = 'miss'
+        elif query_stale(query):
+            classification = 'stale'
+        else:
+            classification = 'hit'
+        kind_counts = plan_counts.setdefault(query.kind, {'hit' : 0, 'stale' : 0, 'miss' : 0, 'pruned' : 0})
+        kind_counts[classification] += 1
+        if classification in ['stale', 'miss']:
+            host = urllib.parse.urlsplit(query.url).netloc
+            host_fetches[host] = host_fetches.get(host, 0) + 1
+
+    print(f'Crawl plan: {len(cache_keys_seen)} distinct requests ({len(queries) - len(cache_keys_seen)} duplicates)')
+    for kind, kind_counts in plan_counts.items():
+        print(f'  {kind}:' + ''.join(f' {classification} {count}' for classification, count in kind_counts.items()))
+    if do_wava:
+        print('  (plus age grade profiles for athletes in runbritain results not yet fetched)')
+
+    # Sites fetched from in parallel, but only so many at once from each
+    parallel = max(fetch_threads, 1)
+    total_sec = 0.0
+    longest_host_sec = 0.0
+    for host, fetch_count in host_fetches.items():
+        page_count, latency_total_sec = fetch_latency.get(host, [0, 0.0])
+        if page_count:
+            latency_sec = latency_total_sec / page_count
+            latency_str = f'measured {latency_sec:.2f}s per page'
+        else:
+            latency_sec = default_latency_sec
+            latency_str = f'assumed {latency_sec:.2f}s per page (not measured yet)'
+        host_sec = fetch_count * latency_sec
+        total_sec += host_sec
+        longest_host_sec = max(longest_host_sec, host_sec / min(parallel, max_per_host))
+        print(f'  {host}: {fetch_count} pages to fetch, {latency_str}')
+    estimate_sec = max(total_sec / parallel, longest_host_sec)
+    print(f'Pages to fetch: {sum(host_fetches.values())}, estimated time {datetime.timedelta(seconds=round(estimate_sec))}')
+
+
+def make_wava_queries(crawl_queries, performance_cache, rebuild_wava):
+    """List athlete profile requests needed for age grades, as far as we can tell
+    from the runbritain results we already have"""
+
+    if wava_source == 'local':
+        return []
+    athlete_queries = {} # athlete ID to query for their most recent performance, which decides freshness
+    for crawl_query in crawl_queries:
+        if crawl_query.kind != 'runbritain_rankings':
+            continue
+        perf_list = performance_cache.get(crawl_query.cache_key, None)
+        if perf_list is None:
+            continue
+        for perf in perf_list:
+            if perf.event not in wava_events or not perf.athlete_id:
+                continue
+            query = make_po10_wava_query(perf, rebuild_wava)
+            athlete_id = query.request_params['athleteid']
+            if athlete_id in athlete_queries and athlete_queries[athlete_id].data_year >= query.data_year:
+                continue
+            athlete_queries[athlete_id] = query
+    return list(athlete_queries.values())
 
 
 def format_sexagesimal(value, num_numbers, decimal_places):
@@ -1270,6 +2919,25 @@ def output_records(output_file, first_year, last_year, club_id, do_po10, do_runb
         complete_bulk_part.extend(section_contents_part)
         complete_bulk_part.extend(section_bulk_part)
 
+    if agm_year is not None:
+        section_bulk_part = []
+        anchor = f'agm_{agm_year}'
+        subtitle = f'AGM trophies: {agm_year} [experimental]'
+        main_contents_part.append(f'<tr>\n<td colspan="2"><center><b><a href="#{anchor}">{subtitle}</a></b></center</td>\n</tr>\n')
+        section_bulk_part.append(f'<h2><a name="{anchor}" />{subtitle}</h2>\n\n')
+        for trophy in cnc_trophies:
+            if trophy.record_table is None:
+                continue
+            section_bulk_part.append(f'<h3><a name="agm_{agm_year}_{trophy.tag.lower()}" />{trophy.title}</h3>\n\n')
+            details = [detail for detail in [trophy.artefact, trophy.notes] if detail]
+            if details:
+                section_bulk_part.append(f'<p><em>{", ".join(details)}</em></p>\n')
+            if len(trophy.record_table):
+                output_record_table(section_bulk_part, trophy.record_table, trophy.eligibility.collection)
+            else:
+                section_bulk_part.append('<p>No eligible performances found.</p>\n')
+        complete_bulk_part.extend(section_bulk_part)
+
     if new_records_this_year:
         section_bulk_part = []
         anchor = f'new_best_{last_year}'
@@ -1375,7 +3043,10 @@ def output_record_table(bulk_part, record_list, type):
                 bulk_part.append(f'  <td><a href="{perf.fixture_url}" target=”_blank”>{perf.fixture_name}</a></td>\n')
             else:
                 bulk_part.append(f'  <td>{perf.fixture_name}</td>\n')
-            bulk_part.append(f'  <td>{perf.source}</td>\n')
+            if perf.alt_sources:
+                bulk_part.append(f'  <td>{perf.source} (also {", ".join(perf.alt_sources)})</td>\n')
+            else:
+                bulk_part.append(f'  <td>{perf.source}</td>\n')
             bulk_part.append('</tr>\n')
     bulk_part.append('</table>\n\n')
 
@@ -1398,7 +3069,7 @@ def add_best_record_if_new_this_year(new_records_last_year, record_list, interes
         interest_year_performances = []
         older_year_record_count = 0
         for perf in perf_list: # May be ties with same score or different sources
-            perf_year = get_perf_year(perf.date)
+            perf_year = perf.year
             if perf_year == interest_year:
                 interest_year_performances.append(perf)
             elif perf_year > interest_year:
@@ -1513,6 +3184,8 @@ def process_one_club_record_excel_worksheet(input_file, worksheet, types):
         source = 'Historical worksheet: ' + input_file + ':' + worksheet.title
         perf = construct_performance(event, gender, category, perf_str, name, name_url,
                             date, fixture, fixture_url, source)
+        # Crawl done by now, so name matched to athlete ID if seen there and no URL given
+        resolve_athlete_keys([perf])
         process_performance_cat_and_all(perf, types, 'record', 'ALL', do_agm)
     
         performance_count['File(s)'] += 1
@@ -1569,13 +3242,20 @@ def get_po10_club_name(club_id):
     request_params = {'clubid'   : str(club_id)}
 
     url = powerof10_root_url + '/clubs/club.aspx'
-    try:
-        page_response = requests.get(url, request_params)
-    except requests.exceptions.ConnectionError:
-        print('WARNING: failed to get club name from powerof10')
-        return 'n/a'
-
-    h2_headings = get_html_content(page_response.text, 'h2')
+    query = WebQuery('po10_club', url, request_params, 'PowerOf10 club page ', {})
+    page_text = None
+    if fetch_offline and raw_page_store:
+        page_text = raw_page_store.load_page(query.cache_key)
+    if page_text is None:
+        page_response = fetch_page(url, request_params, query.report_string_base)
+        if page_response is None:
+            print('WARNING: failed to get club name from powerof10')
+            return 'n/a'
+        page_text = page_response.text
+        if raw_page_store:
+            raw_page_store.save_page(query, page_text)
+
+    h2_headings = get_html_content(page_text, 'h2')
     if len(h2_headings) != 1:
         print('WARNING: club page no longer has club name as only h2 heading, skipped')
         return 'n/a'
@@ -1662,7 +3342,9 @@ def read_ea_pb_award_score_tables(ea_pb_award_file):
             score, original_dp, original_special, invalid = make_numeric_score_from_performance_string(perf)
             level_scores[level_idx] = score
 
-        score_set = EaPbAwardScoreSet(bucket, event, category, level_scores)
+        known_event = known_events_lookup.get(event)
+        smaller_score_better = known_event[0] if known_event else False
+        score_set = EaPbAwardScoreSet(bucket, event, category, level_scores, smaller_score_better)
         if event not in ea_pb_award_score:
             ea_pb_award_score[event] = {}
         ea_pb_award_score[event][category] = score_set
@@ -1671,61 +3353,783 @@ def read_ea_pb_award_score_tables(ea_pb_award_file):
     print(f'... processed {rows_completed} rows from EA PB Awards tables')
 
 
+def migrate_performance(perf, from_version):
+    """Fill in fields added to Performance since cache schema version given"""
+
+    if from_version < 6:
+        # Date ordinal added in version 4, and 0 if day not known since version 6
+        perf.date_ordinal, perf.year = parse_perf_date(perf.date)
+    if from_version < 5:
+        # Runbritain age group only known from query now, so none for 'ALL' results
+        from_age_group_query = perf.category in runbritain_category_lookup and perf.category != 'ALL'
+        perf.age_group = perf.category if from_age_group_query else ''
+
+
+def migrate_perf_list(perf_list, from_version):
+    # Files without header may have pre-slots objects, which were constructed afresh
+    # when unpickled, or slots objects from before the header was added, so they
+    # get the full migration either way
+    for perf in perf_list:
+        migrate_performance(perf, from_version)
+
+
+def read_pickle_cache(cache_file):
+    """Unpickle whole cache dict, migrating performances if written by older version.
+    Cache dict is preceded by header giving schema version, except in original
+    (version 1) files, and may be followed by history of query yields, fetch
+    latencies, fetch times and page validators, and athlete IDs by name"""
+    global athlete_ids_loaded
+
+    with open(cache_file, 'rb') as fd:
+        header = pickle.load(fd)
+        if isinstance(header, dict) and 'cache_schema_version' in header:
+            file_version = header['cache_schema_version']
+            performance_cache = pickle.load(fd)
+            try:
+                for yield_key, years in pickle.load(fd).items():
+                    query_yields.setdefault(yield_key, {}).update(years)
+                fetch_latency.update(pickle.load(fd))
+                fetch_times.update(pickle.load(fd))
+                page_validators.update(pickle.load(fd))
+                athlete_ids_by_name.update(pickle.load(fd))
+                athlete_ids_loaded = True
+            except EOFError:
+                pass # written before yields, latency, fetch times, page validators or athlete IDs were kept
+        else:
+            file_version = 1 # or 2, written before header was added
+            performance_cache = header
+    if file_version < cache_schema_version:
+        for perf_list in performance_cache.values():
+            migrate_perf_list(perf_list, file_version)
+        print(f'Migrated {len(performance_cache)} cache entries from schema version {file_version} to {cache_schema_version}')
+    return performance_cache
+
+
+def read_age_factor_tables(age_factor_file):
+    """Age factors and open class standards for local age grading, e.g. as copied from
+    the WMA/UKA road tables: one worksheet with columns 'gender', 'age' and one for each
+    WAVA event, a row per gender and age giving factors, and a row per gender with
+    age 'OC' giving the open class standard times"""
+
+    print(f"Opening file for age grading factor tables: {age_factor_file}")
+    workbook = openpyxl.load_workbook(filename=age_factor_file)
+    if len(workbook.worksheets) > 1:
+        raise ValueError(f"Expected an Excel workbook with only one worksheet for age factor tables")
+
+    reqd_headings = ['gender', 'age']
+    reqd_headings.extend(event.lower() for event in wava_events)
+
+    df = get_table_by_find_check_headings(workbook.worksheets[0], reqd_headings)
+    if df is None:
+        raise ValueError(f"Unable to read age factors from {age_factor_file}")
+
+    rows_completed = 0
+    for row_idx, row in df.iterrows():
+        excel_row_number = row_idx + 1
+        gender = row['gender']
+        gender = str(gender).upper().strip() if gender else ''
+        age = row['age']
+        age = str(age).upper().strip() if age is not None else ''
+        if not gender and not age:
+            # Assume blank row, quietly ignore
+            continue
+        gender = 'W' if gender == 'F' else gender
+        if gender not in ['M', 'W']:
+            print(f'WARNING: gender not M or W at row {excel_row_number}')
+            continue
+        if age != 'OC' and not age.isdigit():
+            print(f'WARNING: age not a number or OC at row {excel_row_number}')
+            continue
+        for event in wava_events:
+            value = row[event.lower()]
+            if value is None or str(value).strip() == '':
+                continue
+            if age == 'OC':
+                # Standard may be given as time string or seconds
+                score, original_dp, original_special, invalid = make_numeric_score_from_performance_string(str(value).strip())
+                age_standards.setdefault(gender, {})[event] = score
+            else:
+                age_factors.setdefault(gender, {}).setdefault(event, {})[int(age)] = float(value)
+        rows_completed += 1
+
+    print(f'... processed {rows_completed} rows from age factor tables')
+
+
+def load_performance_cache(cache_file):
+    """Open SQLite cache if file name says so, otherwise unpickle whole cache dict"""
+
+    global cache_file_time
+    cache_file_time = os.path.getmtime(cache_file) if os.path.exists(cache_file) else time.time()
+    if cache_file.endswith(sqlite_cache_extensions):
+        performance_cache = SqlitePerformanceCache(cache_file)
+        performance_cache.load_crawl_history()
+    else:
+        try:
+            performance_cache = read_pickle_cache(cache_file)
+            print(f'Cached web results retrieved from {cache_file}')
+        except IOError:
+            print(f"Cache file {cache_file} can't be opened, starting new cache")
+            performance_cache = {}
+    for cache_key in performance_cache.keys():
+        # Entries from before fetch times were kept; saved with this time so they
+        # still age, as the cache file time changes every time it's written
+        fetch_times.setdefault(cache_key, cache_file_time)
+    return performance_cache
+
+
+def save_performance_cache(performance_cache, cache_file):
+    if isinstance(performance_cache, SqlitePerformanceCache):
+        try:
+            performance_cache.save()
+            performance_cache.save_crawl_history()
+        except sqlite3.Error as e:
+            print(f"Cache database {cache_file} can't be written, any new web results this time not cached: {e}")
+        return
+    try:
+        # Write whole file then rename, so an interruption can't leave a broken cache
+        temp_file = cache_file + '.tmp'
+        with open(temp_file, 'wb') as fd:
+            pickle.dump({'cache_schema_version' : cache_schema_version}, fd)
+            pickle.dump(performance_cache, fd)
+            pickle.dump(query_yields, fd)
+            pickle.dump(fetch_latency, fd)
+            pickle.dump(fetch_times, fd)
+            pickle.dump(page_validators, fd)
+            pickle.dump(athlete_ids_by_name, fd)
+        os.replace(temp_file, cache_file)
+        print(f'Cached web results written to {cache_file}')
+    except IOError:
+        print(f"Cache file {cache_file} can't be written, any new web results this time not cached")
+
+
+def note_cache_updated(performance_cache):
+    """Count new cache entry, and write checkpoint if there have been enough of them
+    or enough time has passed since the last one"""
+
+    global keys_since_checkpoint
+    if not checkpoint_cache_file:
+        return
+    keys_since_checkpoint += 1
+    if ((checkpoint_every_keys and keys_since_checkpoint >= checkpoint_every_keys) or
+        (checkpoint_every_sec and time.time() - last_checkpoint_time >= checkpoint_every_sec)):
+        write_checkpoint(performance_cache)
+
+
+def write_checkpoint(performance_cache):
+    """Save cache so far, and which cache keys have been refreshed this run so that
+    an interrupted run can be resumed"""
+
+    global keys_since_checkpoint, last_checkpoint_time
+    save_performance_cache(performance_cache, checkpoint_cache_file)
+    resume_file = make_resume_file_name(checkpoint_cache_file)
+    temp_file = resume_file + '.tmp'
+    with open(temp_file, 'wb') as fd:
+        pickle.dump(cache_keys_refreshed, fd)
+    os.replace(temp_file, resume_file)
+    if raw_page_store and not fetch_offline:
+        raw_page_store.save_index()
+    print(f'Checkpoint written after {len(cache_keys_refreshed)} cache entries refreshed this run')
+    keys_since_checkpoint = 0
+    last_checkpoint_time = time.time()
+
+
+def process_crawl_query(query, performance_cache, types, do_wava, rebuild_wava, do_agm):
+    """Process one Po10 or runbritain rankings list"""
+
+    push_record_contributor(query.cache_key)
+    try:
+        if query.kind == 'po10_rankings':
+            process_one_po10_year_gender(query, performance_cache, types, do_agm)
+        else:
+            process_one_runbritain_year_gender(query, performance_cache, types, do_wava, rebuild_wava, do_agm)
+    finally:
+        record_contributors.pop()
+
+
+def process_crawl_queries(crawl_queries, performance_cache, types, do_wava, rebuild_wava, do_agm,
+                          process_keys=None, saved_counts=None):
+    """Process rankings lists in order, or if process_keys given only those lists: the
+    record tables others reach are unchanged from saved record state, so those are
+    just read for athlete IDs and counted as before. Returns cache keys of lists not pruned."""
+    global pruned_query_count
+
+    crawl_keys = {}
+    for query in crawl_queries:
+        if query_pruned(query, performance_cache):
+            print(query.report_string_base + 'skipped as no results in previous years')
+            note_query_pruned(query)
+            pruned_query_count += 1
+            continue
+        crawl_keys[query.cache_key] = True
+        if process_keys is None or query.cache_key in process_keys:
+            counts_before = dict(performance_count)
+            process_crawl_query(query, performance_cache, types, do_wava, rebuild_wava, do_agm)
+            contributor_counts[query.cache_key] = {name : count - counts_before.get(name, 0)
+                                                   for name, count in performance_count.items()
+                                                   if count != counts_before.get(name, 0)}
+        else:
+            # Not read, as athlete IDs to match names in club spreadsheets are kept with cache
+            for name, count in saved_counts.get(query.cache_key, {}).items():
+                performance_count[name] = performance_count.get(name, 0) + count
+    return crawl_keys
+
+
+def process_input_files(input_files, types):
+    for input_file in input_files:
+        push_record_contributor(input_file_key_prefix + input_file)
+        try:
+            process_one_club_record_input_file(input_file, types)
+        finally:
+            record_contributors.pop()
+
+
+def push_record_contributor(key):
+    """Note that performances processed from now come from this cache key (or input
+    file), as well as any it's nested in; popped from record_contributors when done"""
+
+    record_contributors.append(key)
+    if record_state_file and not discovering_tables:
+        contributor_tables.setdefault(key, set())
+
+
+def table_computed(table_id):
+    """Note which contributors' performances reach this record table; True if the
+    performance should be considered for it, or False if the table is unchanged
+    from saved record state or we're only finding the tables changed results reach"""
+
+    if not record_state_file:
+        return True
+    if discovering_tables:
+        discovered_tables[table_id] = True
+        return False
+    for key in record_contributors:
+        contributor_tables[key].add(table_id)
+    return table_id not in clean_tables
+
+
+def make_record_state_file_name(cache_file):
+    return cache_file + '.records'
+
+
+def contributor_fingerprint(key, performance_cache):
+    """Hash of what a cache key contributes to record tables, to spot change since the
+    tables were saved, or of file contents for an input file; None if nothing cached"""
+
+    if key.startswith(input_file_key_prefix):
+        with open(key[len(input_file_key_prefix):], 'rb') as fd:
+            return hashlib.sha1(fd.read()).hexdigest()
+    perf_list = performance_cache.get(key, None)
+    if perf_list is None:
+        return None
+    resolve_athlete_keys(perf_list)
+    return hashlib.sha1(repr([perf_fingerprint_fields(perf) + (stable_athlete_key(perf),)
+                              for perf in perf_list]).encode()).hexdigest()
+
+
+def unkeyed_athlete_names(perf_list):
+    """Normalised names of athletes in list with no ID of their own, whose athlete
+    keys depend on the IDs seen with those names in other lists"""
+
+    return sorted({normalise_athlete_name(perf.athlete_name) for perf in perf_list or [] if not perf.athlete_id})
+
+
+def contributor_unchanged(key, state):
+    """True if what a cache key contributes to record tables can't have changed since
+    they were saved, so it needn't be read to compare fingerprints: not fetched since,
+    and no athlete in it without an ID now has a different ID seen with their name"""
+
+    saved_fetch_time = state['fetch_times'].get(key)
+    if saved_fetch_time is None or key in cache_keys_refreshed or fetch_times.get(key) != saved_fetch_time:
+        return False
+    return all(athlete_ids_by_name.get(name, 0) == state['athlete_ids'].get(name, 0)
+               for name in state['unkeyed_names'].get(key, []))
+
+
+def make_record_state_signature(options, table_files):
+    """Everything that can affect any record table, so saved tables are only used if
+    it's the same: run options, and files such as EA PB score tables"""
+
+    file_hashes = tuple(contributor_fingerprint(input_file_key_prefix + table_file, None) if table_file else None
+                        for table_file in table_files)
+    return ((record_state_version, cache_schema_version, max_records_all, max_records_age_group, max_wavas_all,
+             max_wavas_year, max_ea_pbs_all, max_ea_pbs_year, max_trophy_entries) + tuple(options) + file_hashes)
+
+
+def load_record_state(state_file, signature):
+    """Record tables saved by previous run with what contributed to them, or None if
+    there are none we can use"""
+
+    try:
+        with open(state_file, 'rb') as fd:
+            state = pickle.load(fd)
+    except IOError:
+        print(f"Record state {state_file} can't be opened, computing all record tables afresh")
+        return None
+    except Exception as e:
+        # E.g. file left broken, or pickled from classes since changed
+        print(f"Record state {state_file} can't be read ({e!r}), computing all record tables afresh")
+        return None
+    if not isinstance(state, dict) or state.get('signature') != signature:
+        print(f'Record state {state_file} is from different options or files, computing all record tables afresh')
+        return None
+    return state
+
+
+def save_record_state(state_file, signature, performance_cache, old_state, crawl_keys):
+    """Save record tables, with the cache keys (and input files) that contributed to
+    each and a fingerprint of what they contributed"""
+
+    if old_state is None:
+        old_state = {'contributor_tables' : {}, 'contributor_links' : {}, 'contributor_counts' : {},
+                     'fingerprints' : {}, 'crawl_keys' : {}, 'unkeyed_names' : {}}
+    tables = {table_id : (table.max_records, table.smaller_score_better, table.compare_field,
+                          [[(perf, stable_athlete_key(perf), perf.alt_sources) for perf in perf_list] for perf_list in table])
+              for table_id, table in collect_record_tables().items()}
+    # Contributors not processed this run contributed as they did before
+    state = {'signature'          : signature,
+             'tables'             : tables,
+             'contributor_tables' : {**old_state['contributor_tables'], **contributor_tables},
+             'contributor_links'  : {**old_state['contributor_links'], **contributor_links},
+             'contributor_counts' : {**old_state['contributor_counts'], **contributor_counts},
+             'fingerprints'       : dict(old_state['fingerprints']),
+             'unkeyed_names'      : dict(old_state['unkeyed_names']),
+             'crawl_keys'         : crawl_keys,
+             'ea_pb_order'        : list(ea_pb)}
+    for key in contributor_tables:
+        state['fingerprints'][key] = contributor_fingerprint(key, performance_cache)
+        unkeyed_names = [] if key.startswith(input_file_key_prefix) else unkeyed_athlete_names(performance_cache.get(key, None))
+        if unkeyed_names:
+            state['unkeyed_names'][key] = unkeyed_names
+        else:
+            state['unkeyed_names'].pop(key, None)
+    for key in old_state['crawl_keys']:
+        if key not in crawl_keys:
+            # Now pruned or no longer requested
+            for name in ['contributor_tables', 'contributor_links', 'contributor_counts', 'fingerprints', 'unkeyed_names']:
+                state[name].pop(key, None)
+    # To tell which lists can't have changed without reading them next time
+    state['fetch_times'] = {key : fetch_times.get(key) for key in state['fingerprints']}
+    state['athlete_ids'] = {name : athlete_ids_by_name.get(name, 0)
+                            for names in state['unkeyed_names'].values() for name in names}
+    for name in ['contributor_tables', 'contributor_counts']:
+        # Most lists reach no record table, so only note those that do
+        state[name] = {key : value for key, value in state[name].items() if value}
+    try:
+        # Write whole file then rename, so an interruption can't leave a broken file
+        temp_file = state_file + '.tmp'
+        with open(temp_file, 'wb') as fd:
+            pickle.dump(state, fd, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(temp_file, state_file)
+        print(f'Record tables written to {state_file}')
+    except IOError:
+        print(f"Record state {state_file} can't be written, record tables computed this time not saved")
+
+
+def collect_record_tables():
+    """All record tables, by the table ID used for them in process_performance()"""
+
+    tables = {}
+    for category, events in record.items():
+        for event, genders in events.items():
+            for gender, record_list in genders.items():
+                tables[('record', category, event, gender)] = record_list
+    for event, years in wava.items():
+        for year, record_list in years.items():
+            tables[('wava', event, year)] = record_list
+    for bucket, years in ea_pb.items():
+        for year, record_list in years.items():
+            tables[('ea_pb', bucket, year)] = record_list
+    for trophy in cnc_trophies:
+        if trophy.record_table is not None:
+            tables[('agm', trophy.tag)] = trophy.record_table
+    return tables
+
+
+def restore_record_table(table_id, saved_table):
+    """Put record table saved by save_record_state() back where process_performance() would make it"""
+
+    max_records, smaller_score_better, compare_field, entries = saved_table
+    record_list = RecordTable(max_records, smaller_score_better, compare_field)
+    for entry in entries:
+        for perf, athlete_key, alt_sources in entry:
+            # Not kept when performances are pickled; saved as name if no ID
+            perf.athlete_key = athlete_key if isinstance(athlete_key, int) else get_athlete_name_key(athlete_key)
+            perf.alt_sources = alt_sources
+        record_list.append_entry([perf for perf, _, _ in entry])
+    kind = table_id[0]
+    if kind == 'record':
+        _, category, event, gender = table_id
+        record.setdefault(category, {}).setdefault(event, {})[gender] = record_list
+    elif kind == 'wava':
+        _, event, year = table_id
+        wava.setdefault(event, {})[year] = record_list
+    elif kind == 'ea_pb':
+        _, bucket, year = table_id
+        ea_pb.setdefault(bucket, {})[year] = record_list
+    else:
+        for trophy in cnc_trophies:
+            if trophy.tag == table_id[1]:
+                trophy.record_table = record_list
+                agm[str(agm_year)][trophy.tag] = record_list
+
+
+def reset_record_tables(do_agm):
+    """Start again with no record tables"""
+
+    record.clear()
+    wava.clear()
+    ea_pb.clear()
+    agm.clear()
+    if do_agm:
+        index_agm_trophies(agm_year)
+
+
+def order_ea_pb_buckets(saved_order):
+    """EA PB buckets are output in the order first found, so put those restored from
+    saved state back in their order from then, ahead of any new ones"""
+
+    bucket_places = {bucket : place for place, bucket in enumerate(saved_order)}
+    ordered = sorted(ea_pb.items(), key=lambda item: bucket_places.get(item[0], len(bucket_places)))
+    ea_pb.clear()
+    ea_pb.update(ordered)
+
+
+def note_nested_parents(query, perf_list, do_wava, rebuild_wava, nested_parents):
+    """Note the cache keys of athlete profiles or lists fetched to process this rankings list"""
+
+    if do_wava and wava_source == 'profile' and query.kind == 'runbritain_rankings':
+        for perf in perf_list:
+            if perf.event in wava_events and perf.athlete_id:
+                nested_parents.setdefault(make_po10_wava_query(perf, rebuild_wava).cache_key, {})[query.cache_key] = query
+    if (po10_mode == 'coalesced' and query.kind == 'po10_rankings' and query.context['category'] == 'ALL'
+            and any(not perf.age_group for perf in perf_list)):
+        # Junior age groups fetched separately, see process_po10_junior_age_groups()
+        for category in powerof10_categories:
+            if category == 'ALL':
+                continue
+            age_group_query = make_po10_query(query.request_params['clubid'], query.context['year'], query.context['gender'],
+                                              category, query.request_params['firstclaimonly'] == 'y', query.rebuild_cache)
+            nested_parents.setdefault(age_group_query.cache_key, {})[query.cache_key] = query
+
+
+def plan_record_recompute(state, crawl_queries, performance_cache, input_files, types, do_wava, rebuild_wava, do_agm):
+    """Find the record tables reached by results that have changed since the tables
+    were saved, before or after the change, and restore all the others. Returns cache
+    keys of the rankings lists to process again, those reaching any changed table, or
+    None if we can't tell so all must be."""
+    global discovering_tables
+
+    fingerprints = state['fingerprints']
+    changed = {} # cache keys (or input files) whose results are new, different or gone
+    changed_queries = {} # cache key to query, for those that are rankings lists
+    changed_files = []
+    crawl_keys = {}
+    unread_queries = [] # rankings lists that can't have changed, so not read yet
+    nested_parents = {} # cache key of profile or list fetched for rankings lists, to those lists
+    for query in crawl_queries:
+        # Pruned as the processing will, so yields noted as it goes
+        if query_pruned(query, performance_cache):
+            note_query_pruned(query)
+            continue
+        crawl_keys[query.cache_key] = True
+        if contributor_unchanged(query.cache_key, state):
+            # Yield kept with cache when it was last read
+            unread_queries.append(query)
+            continue
+        perf_list = performance_cache.get(query.cache_key, None)
+        if perf_list is None:
+            changed[query.cache_key] = True
+            changed_queries[query.cache_key] = query
+            continue
+        note_query_yield(query, perf_list)
+        if contributor_fingerprint(query.cache_key, performance_cache) != fingerprints.get(query.cache_key):
+            changed[query.cache_key] = True
+            changed_queries[query.cache_key] = query
+        note_nested_parents(query, perf_list, do_wava, rebuild_wava, nested_parents)
+    for key in state['crawl_keys']:
+        if key not in crawl_keys:
+            changed[key] = True
+    for input_file in input_files:
+        key = input_file_key_prefix + input_file
+        if contributor_fingerprint(key, performance_cache) != fingerprints.get(key):
+            changed[key] = True
+            changed_files.append(input_file)
+    for key, fingerprint in fingerprints.items():
+        if key in crawl_keys or key in state['crawl_keys'] or key.startswith(input_file_key_prefix):
+            continue
+        # Athlete profile, or junior age group list only processed for the rankings lists that need it
+        if contributor_unchanged(key, state) or contributor_fingerprint(key, performance_cache) == fingerprint:
+            continue
+        for query in unread_queries:
+            # Only worth reading them now, to find which need this
+            note_nested_parents(query, performance_cache.get(query.cache_key, None) or [], do_wava, rebuild_wava,
+                                nested_parents)
+        unread_queries = []
+        if key not in nested_parents:
+            print(f'Record state: results changed for {key}, but not known what needs them, computing all record tables afresh')
+            return None
+        changed[key] = True
+        changed_queries.update(nested_parents[key])
+
+    # Tables that changed results reach now; the processing must leave counts as they were
+    saved_counts = dict(performance_count)
+    saved_wava_athlete_ids = dict(wava_athlete_ids_done)
+    discovered_tables.clear()
+    discovering_tables = True
+    for query in changed_queries.values():
+        process_crawl_query(query, performance_cache, types, do_wava, rebuild_wava, do_agm)
+    for input_file in changed_files:
+        process_one_club_record_input_file(input_file, types)
+    discovering_tables = False
+    performance_count.clear()
+    performance_count.update(saved_counts)
+    wava_athlete_ids_done.clear()
+    wava_athlete_ids_done.update(saved_wava_athlete_ids)
+
+    # Tables they reached before, also those of lists sharing performances with them
+    dirty_tables = dict(discovered_tables)
+    process_keys = dict.fromkeys(changed_queries, True)
+    for key in changed:
+        for linked_key in [key] + list(state['contributor_links'].get(key, [])):
+            dirty_tables.update(dict.fromkeys(state['contributor_tables'].get(linked_key, []), True))
+            process_keys[linked_key] = True
+    # And the lists that reach those tables, so the tables get everything they did before
+    for key in crawl_keys:
+        if key not in process_keys and any(table_id in dirty_tables for table_id in state['contributor_tables'].get(key, [])):
+            process_keys[key] = True
+    # And lists sharing performances with those, which decide the sources shown for them
+    linked_keys = list(process_keys)
+    while linked_keys:
+        for linked_key in state['contributor_links'].get(linked_keys.pop(), []):
+            if linked_key not in process_keys:
+                process_keys[linked_key] = True
+                linked_keys.append(linked_key)
+
+    reset_record_tables(do_agm)
+    clean_tables.clear()
+    for table_id, saved_table in state['tables'].items():
+        if table_id not in dirty_tables:
+            restore_record_table(table_id, saved_table)
+            clean_tables[table_id] = True
+    print(f'Record state: {len(changed)} changed results reach {len(dirty_tables)} record tables, '
+          f'{len(clean_tables)} unchanged; processing {sum(key in process_keys for key in crawl_keys)} '
+          f'of {len(crawl_keys)} rankings lists')
+    return process_keys
+
+
+def snapshot_record_tables():
+    """Record tables by ID as plain values, for comparison"""
+
+    snapshot = {table_id : [[perf_fingerprint_fields(perf) + (stable_athlete_key(perf), perf.ea_pb_score, perf.alt_sources)
+                             for perf in perf_list]
+                            for perf_list in record_list]
+                for table_id, record_list in collect_record_tables().items()}
+    snapshot[('ea_pb order',)] = list(ea_pb)
+    return snapshot
+
+
+def verify_full_rebuild(crawl_queries, performance_cache, input_files, types, do_wava, rebuild_wava, do_agm,
+                        initial_counts, max_examples=10):
+    """Check record tables computed using saved record state against processing all
+    results again; leaves the tables from the full rebuild. True if they match."""
+    global pruned_query_count, duplicate_perf_count
+
+    computed = snapshot_record_tables()
+    computed_counts = dict(performance_count)
+    reset_record_tables(do_agm)
+    clean_tables.clear()
+    ingested_perfs.clear()
+    duplicate_perf_count = 0
+    pruned_query_count = 0
+    performance_count.clear()
+    performance_count.update(initial_counts)
+    process_crawl_queries(crawl_queries, performance_cache, types, do_wava, rebuild_wava, do_agm)
+    process_input_files(input_files, types)
+    rebuilt = snapshot_record_tables()
+
+    mismatches = [table_id for table_id in rebuilt if computed.get(table_id) != rebuilt[table_id]]
+    mismatches += [table_id for table_id in computed if table_id not in rebuilt]
+    for table_id in mismatches[:max_examples]:
+        print(f'  Record table {table_id} differs from full rebuild')
+    if computed_counts != performance_count:
+        print(f'  Performance counts {computed_counts} differ from full rebuild {performance_count}')
+    print(f'Full rebuild check: {len(rebuilt)} record tables, {len(mismatches)} differ')
+    return not mismatches and computed_counts == performance_count
+
+
+def make_resume_file_name(cache_file):
+    return cache_file + '.resume'
+
+
+def load_resume_state(cache_file):
+    """Note cache keys already refreshed by interrupted run, so they aren't fetched again"""
+
+    resume_file = make_resume_file_name(cache_file)
+    try:
+        with open(resume_file, 'rb') as fd:
+            cache_keys_refreshed.update(pickle.load(fd))
+        print(f'Resuming interrupted run, {len(cache_keys_refreshed)} cache entries already refreshed')
+    except IOError:
+        print(f"No interrupted run to resume ({resume_file} can't be opened), starting afresh")
+
+
 def main(club_id=238, output_file='records.htm', first_year=2005, last_year=2024, 
          do_po10=False, do_runbritain=True, input_files=[],
          cache_file='cache.pkl', rebuild_final_year=False, rebuild_prefinal_year=False,
          first_claim_only=False,
          types=['T', 'F', 'R', 'M'], do_wava=True, rebuild_wava=False,
-         ea_pb_award_file=None, do_agm=False):
+         ea_pb_award_file=None, do_agm=False, fetch_threads=1, max_per_host=4,
+         fetch_retries=3, fetch_timeout=30.0, raw_store_dir=None, reparse_from_raw=False,
+         engine='incremental', import_cache_file=None, checkpoint_keys=200, checkpoint_sec=300.0,
+         resume=False, wava_mode='profile', age_factor_file=None, runbritain_queries='age-groups',
+         po10_queries='age-groups', full_sweep=False, prune_years=0, plan_only=False, request_budget=0,
+         ttl_days=[1, 7, 365], keep_record_state=False, verify_full=False):
+
+    global fetch_max_retries, fetch_timeout_sec, fetch_offline, raw_page_store, record_engine
+    global checkpoint_cache_file, checkpoint_every_keys, checkpoint_every_sec, last_checkpoint_time
+    global wava_source, runbritain_mode, po10_mode, prune_empty_years, pruned_query_count, max_requests
+    global freshness_ttl_days, record_state_file
+    record_engine = engine
+    freshness_ttl_days = ttl_days
+    max_requests = request_budget
+    prune_empty_years = 0 if full_sweep else prune_years
+    po10_mode = po10_queries
+    wava_source = wava_mode
+    runbritain_mode = runbritain_queries
+    if wava_source != 'profile':
+        if not age_factor_file:
+            print('ERROR: need --age-factor-file to compute age grades locally')
+            sys.exit(1)
+        read_age_factor_tables(age_factor_file)
+    if do_wava and wava_source == 'local':
+        # Only counted (and shown) when age grades are computed here
+        performance_count['Local-WAVA'] = 0
+        performance_count['File(s)'] = performance_count.pop('File(s)') # still last
+    fetch_max_retries = fetch_retries
+    fetch_timeout_sec = fetch_timeout
+    if raw_store_dir:
+        raw_page_store = RawPageStore(raw_store_dir)
+    if reparse_from_raw:
+        if not raw_page_store:
+            print('ERROR: need --raw-store directory to reparse from')
+            sys.exit(1)
+        fetch_offline = True
 
     # Retrieve cache of performances obtained from web trawl previously
-    try:
-        with open(cache_file, 'rb') as fd:
-            performance_cache = pickle.load(fd)
-            print(f'Cached web results retrieved from {cache_file}')
-    except IOError:
-        print(f"Cache file {cache_file} can't be opened, starting new cache")
-        performance_cache = {}
+    performance_cache = load_performance_cache(cache_file)
+    if import_cache_file:
+        if not isinstance(performance_cache, SqlitePerformanceCache):
+            print('ERROR: can only import old cache into SQLite cache (.sqlite or .db file)')
+            sys.exit(1)
+        performance_cache.import_pickle_cache(import_cache_file)
+
+    if resume:
+        load_resume_state(cache_file)
+    if checkpoint_keys or checkpoint_sec:
+        checkpoint_cache_file = cache_file
+        checkpoint_every_keys = checkpoint_keys
+        checkpoint_every_sec = checkpoint_sec
+        last_checkpoint_time = time.time()
 
     if ea_pb_award_file:
         read_ea_pb_award_score_tables(ea_pb_award_file)
+    if do_agm:
+        index_agm_trophies(last_year)
 
-    for year in range(first_year, last_year + 1):
-        # E.g. to rebuild in Jan 2024 want last results from 2023 so year before too,
-        # but later in year it's safe to only rebuild 2024
-        rebuild_cache = ((rebuild_final_year    and (year == last_year    )) or
-                         (rebuild_prefinal_year and (year == last_year - 1))   )
-        for gender in ['W', 'M']:
-            if do_po10:
-                for category in powerof10_categories:
-                    process_one_po10_year_gender(club_id, year, gender, category,
-                                                 performance_cache, rebuild_cache, first_claim_only,
-                                                 types, do_agm)
-            if do_runbritain:
-                for (event, _, _, runbritain, type, categories) in known_events: # debug [('Mar', True, 3, True, 'R')]:
-                    if not runbritain: continue
-                    if type not in types: continue
-                    for (category, _, _) in runbritain_categories: # debug [('ALL', 0, 0), ('V50', 50, 54)]
-                        if event_relevant_to_category(event, gender, category):
-                            process_one_runbritain_year_gender(club_id, year, gender, category, event,
-                                                            performance_cache, rebuild_cache,
-                                                            first_claim_only, types, do_wava, rebuild_wava,
-                                                            do_agm)
+    if reparse_from_raw:
+        reparse_raw_pages(performance_cache, types)
 
-    # Input files last so manual 'invalidate' entries will remove known anomalies from Po10
-    for input_file in input_files:
-        process_one_club_record_input_file(input_file, types)
+    crawl_queries = make_crawl_queries(club_id, first_year, last_year, do_po10, do_runbritain,
+                                       first_claim_only, types, rebuild_final_year, rebuild_prefinal_year)
+    if runbritain_mode == 'coalesced':
+        refetch_lists_without_age_groups(crawl_queries, performance_cache)
+    if plan_only:
+        plan_crawl(crawl_queries, performance_cache, do_wava, rebuild_wava, fetch_threads, max_per_host)
+        return
 
-    # Save updated cache for next time
+    # Record tables saved last time only of use if they'd be computed the same way
+    record_state = None
+    if keep_record_state and record_engine == 'incremental' and runbritain_mode != 'verify' and wava_source != 'verify':
+        record_state_file = make_record_state_file_name(cache_file)
+        record_state_signature = make_record_state_signature(
+            [club_id, first_year, last_year, do_po10, do_runbritain, first_claim_only, tuple(types), do_wava,
+             wava_source, po10_mode, runbritain_mode, do_agm, tuple(input_files)], [ea_pb_award_file, age_factor_file])
+        record_state = load_record_state(record_state_file, record_state_signature)
+    initial_counts = dict(performance_count)
     try:
-        with open(cache_file, 'wb') as fd:
-            pickle.dump(performance_cache, fd)
-        print(f'Cached web results written to {cache_file}')
-    except IOError:
-        print(f"Cache file {cache_file} can't be written, any new web results this time not cached")
+        if fetch_threads > 1 or record_state:
+            # Everything fetched first if using saved record tables, to see what's changed
+            prefetch_crawl_queries(crawl_queries, performance_cache, types, fetch_threads, max_per_host)
+            if do_wava:
+                wava_queries = make_wava_queries(crawl_queries, performance_cache, rebuild_wava)
+                prefetch_queries(wava_queries, performance_cache, types, fetch_threads, max_per_host)
+
+        if not athlete_ids_loaded:
+            note_cached_athlete_ids(crawl_queries, performance_cache)
+        if ea_pb_award_score and not record_state and not isinstance(performance_cache, SqlitePerformanceCache):
+            # All lists to be processed, and whole cache loaded anyway
+            score_cached_ea_pb_performances(crawl_queries, performance_cache)
+        process_keys = None
+        if record_state:
+            process_keys = plan_record_recompute(record_state, crawl_queries, performance_cache, input_files,
+                                                 types, do_wava, rebuild_wava, do_agm)
+        crawl_keys = process_crawl_queries(crawl_queries, performance_cache, types, do_wava, rebuild_wava, do_agm,
+                                           process_keys, record_state['contributor_counts'] if record_state else None)
+    except KeyboardInterrupt:
+        if checkpoint_cache_file:
+            print('Interrupted, writing checkpoint; use --resume y to carry on from here')
+            write_checkpoint(performance_cache)
+        sys.exit(1)
+    except RequestBudgetSpent:
+        print(f'Fetched --max-requests {max_requests} pages, writing checkpoint; use --resume y to carry on from here')
+        checkpoint_cache_file = cache_file
+        write_checkpoint(performance_cache)
+        sys.exit(0)
+
+    # Input files last so manual 'invalidate' entries will remove known anomalies from Po10
+    process_input_files(input_files, types)
+    if record_state:
+        order_ea_pb_buckets(record_state['ea_pb_order'])
+
+    # Save updated cache for next time, before any check that fails the run
+    save_performance_cache(performance_cache, cache_file)
+    if os.path.exists(make_resume_file_name(cache_file)):
+        # Run completed so nothing to resume now
+        os.remove(make_resume_file_name(cache_file))
+
+    if verify_full:
+        if not verify_full_rebuild(crawl_queries, performance_cache, input_files, types, do_wava, rebuild_wava,
+                                   do_agm, initial_counts):
+            print('ERROR: record tables using saved record state do not match full rebuild')
+            if record_state_file and os.path.exists(record_state_file):
+                # Not to be used again, so next run computes all record tables afresh
+                os.remove(record_state_file)
+            if raw_page_store and not fetch_offline:
+                raw_page_store.save_index()
+            sys.exit(1)
+
+    if record_engine == 'batch':
+        build_batch_record_tables(batch_tables)
+
+    if do_wava and wava_source == 'verify':
+        report_wava_verification()
+    if runbritain_mode == 'verify':
+        report_runbritain_verification()
+
+    if record_state_file:
+        save_record_state(record_state_file, record_state_signature, performance_cache, record_state, crawl_keys)
 
     club_name = get_po10_club_name(club_id)
 
+    if raw_page_store and not fetch_offline:
+        raw_page_store.save_index()
+
+    print('Web fetch stats:' + ''.join(f' {name}: {count}' for name, count in fetch_stats.items()))
+    if prune_empty_years > 0:
+        print(f'Crawl pruning: {pruned_query_count} requests saved by skipping those with no results in previous '
+              f'{prune_empty_years} years (--full-sweep y to make them all)')
+    print(f'Duplicate performances: {duplicate_perf_count} already found from another source, so only noted as alternative source')
+
     output_records(output_file, first_year, last_year, club_id, do_po10, do_runbritain, input_files, club_name)
 
 
@@ -1750,9 +4154,11 @@ if __name__ == '__main__':
     parser.add_argument('--lastyear', dest='last_year', type=int, default=this_year)
     parser.add_argument('--clubid', dest='club_id', type=int, default=cnc_po10_club_id)
     parser.add_argument('--output', dest='output_filename', default='records.htm')
-    parser.add_argument('--cache', dest='cache_filename', default='cache.pkl')
-    parser.add_argument('--rebuild-final-year', dest='rebuild_final_year', choices=yes_no_choices, default='n')
+    parser.add_argument('--cache', dest='cache_filename', default='cache.pkl') # .sqlite or .db for SQLite cache
+    parser.add_argument('--import-pkl-cache', dest='import_cache_filename', default=None) # copy old pickle cache into SQLite cache
+    parser.add_argument('--rebuild-final-year', dest='rebuild_final_year', choices=yes_no_choices, default='n') # fetch again regardless of --ttl-days
     parser.add_argument('--rebuild-prefinal-year', dest='rebuild_prefinal_year', choices=yes_no_choices, default='n')
+    parser.add_argument('--ttl-days', dest='ttl_days', default='1,7,365') # days cached results stay fresh: current year, previous, older; 'none' for ever
     parser.add_argument('--rebuild-wava', dest='rebuild_wava',  choices=yes_no_choices, default='n')
     parser.add_argument('--first-claim-only', dest='first_claim_only',  choices=yes_no_choices, default='n')
     parser.add_argument('--track', dest='track',  choices=yes_no_choices, default='y')
@@ -1760,20 +4166,44 @@ if __name__ == '__main__':
     parser.add_argument('--road', dest='road',  choices=yes_no_choices, default='y')
     parser.add_argument('--multievent', dest='multievent',  choices=yes_no_choices, default='y')
     parser.add_argument('--wava', dest='wava',  choices=yes_no_choices, default='y')
+    parser.add_argument('--plan', dest='plan', choices=yes_no_choices, default='n') # just report requests that would be made
+    parser.add_argument('--max-requests', dest='max_requests', type=int, default=0) # stop with checkpoint after fetching this many pages
+    parser.add_argument('--full-sweep', dest='full_sweep', choices=yes_no_choices, default='n') # don't skip requests that have been empty in previous years
+    parser.add_argument('--prune-empty-years', dest='prune_empty_years', type=int, default=0,
+                        help='skip request with nothing cached if empty this many years running, 0 (default) for never; '
+                             'never skipped for the current year, or for an age group the ALL list shows someone in, and '
+                             'made again after being skipped this many years running')
+    parser.add_argument('--po10-queries', dest='po10_queries', choices=['age-groups', 'coalesced'], default='age-groups') # coalesced: juniors from ALL rankings
+    parser.add_argument('--runbritain-queries', dest='runbritain_queries', choices=['age-groups', 'coalesced', 'verify'], default='age-groups') # coalesced: one ALL list per event
+    parser.add_argument('--wava-source', dest='wava_source', choices=['profile', 'local', 'verify'], default='profile') # verify: compare local age grades with Po10
+    parser.add_argument('--age-factor-file', dest='age_factor_file', default=None) # .xlsx age factors for local age grading
     parser.add_argument('--ea-pb-award-file', dest='ea_pb_award_file', default=None)
     parser.add_argument('--agm', dest='agm',  choices=yes_no_choices, default='n')
+    parser.add_argument('--fetch-threads', dest='fetch_threads', type=int, default=1) # >1 to fetch pages in parallel
+    parser.add_argument('--max-per-host', dest='max_per_host', type=int, default=4) # parallel fetch limit for any one site
+    parser.add_argument('--fetch-retries', dest='fetch_retries', type=int, default=3) # retries if connection/server error
+    parser.add_argument('--fetch-timeout', dest='fetch_timeout', type=float, default=30.0) # seconds per request
+    parser.add_argument('--raw-store', dest='raw_store_dir', default=None) # directory to keep compressed raw pages
+    parser.add_argument('--reparse-from-raw', dest='reparse_from_raw', choices=yes_no_choices, default='n')
+    parser.add_argument('--checkpoint-keys', dest='checkpoint_keys', type=int, default=200) # save cache after this many new entries, 0 for never
+    parser.add_argument('--checkpoint-sec', dest='checkpoint_sec', type=float, default=300.0) # or after this long, 0 for never
+    parser.add_argument('--resume', dest='resume', choices=yes_no_choices, default='n') # don't refetch pages fetched by interrupted run
+    parser.add_argument('--engine', dest='engine', choices=['incremental', 'batch'], default='incremental') # batch: ties don't depend on order, but slower
+    parser.add_argument('--record-state', dest='record_state', choices=yes_no_choices, default='n') # only recompute record tables changed results reach
+    parser.add_argument('--verify-full', dest='verify_full', choices=yes_no_choices, default='n') # check those against computing all afresh
 
     args = parser.parse_args()
 
     do_po10               = y_n_option_true(args.do_po10)
     do_runbritain         = y_n_option_true(args.do_runbritain)
     rebuild_final_year    = y_n_option_true(args.rebuild_final_year)
-    rebuild_prefinal_year = y_n_option_true(args.rebuild_final_year)
+    rebuild_prefinal_year = y_n_option_true(args.rebuild_prefinal_year)
     rebuild_wava          = y_n_option_true(args.rebuild_wava)
     first_claim_only      = y_n_option_true(args.first_claim_only)
     do_wava               = y_n_option_true(args.wava)
     do_agm                = y_n_option_true(args.agm)
     ea_pb_award_file      = args.ea_pb_award_file
+    ttl_days              = [] if args.ttl_days.lower() == 'none' else [float(days) for days in args.ttl_days.split(',')]
     types = []
     if y_n_option_true(args.track):      types.append('T')
     if y_n_option_true(args.field):      types.append('F')
@@ -1785,4 +4215,13 @@ if __name__ == '__main__':
          input_files=args.excel_file, cache_file=args.cache_filename, rebuild_final_year=rebuild_final_year,
          rebuild_prefinal_year=rebuild_prefinal_year, first_claim_only=first_claim_only, types=types,
          do_wava=do_wava, rebuild_wava=rebuild_wava,
-         ea_pb_award_file=ea_pb_award_file, do_agm=do_agm)
+         ea_pb_award_file=ea_pb_award_file, do_agm=do_agm, fetch_threads=args.fetch_threads,
+         max_per_host=args.max_per_host, fetch_retries=args.fetch_retries, fetch_timeout=args.fetch_timeout,
+         raw_store_dir=args.raw_store_dir, reparse_from_raw=y_n_option_true(args.reparse_from_raw),
+         engine=args.engine, import_cache_file=args.import_cache_filename, checkpoint_keys=args.checkpoint_keys,
+         checkpoint_sec=args.checkpoint_sec, resume=y_n_option_true(args.resume), wava_mode=args.wava_source,
+         age_factor_file=args.age_factor_file, runbritain_queries=args.runbritain_queries,
+         po10_queries=args.po10_queries, full_sweep=y_n_option_true(args.full_sweep),
+         prune_years=args.prune_empty_years, plan_only=y_n_option_true(args.plan), request_budget=args.max_requests,
+         ttl_days=ttl_days, keep_record_state=y_n_option_true(args.record_state),
+         verify_full=y_n_option_true(args.verify_full))